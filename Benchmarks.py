@@ -0,0 +1,503 @@
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from messageFraming import recv_frame, send_frame
+from queue import Queue
+from scheduler import Scheduler
+from threading import Thread, Timer
+from data.priceSnapshot import PriceSnapshot
+from exchangeStorage import ExchangeStorage
+from inventoryJournal import InventoryJournal
+from ipoSchedule import IpoSchedule
+from priceStore import PriceStore
+from registrationStorage import RegistrationStorage
+from testSandbox import make_sandbox, network_peer, offline_exchange
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+NO_CLR = '\033[m'
+
+BENCH_STOCKS = {"AAPL": 10**9, "MSFT": 10**9, "AERO": 10**9, "IBM": 10**9}
+BENCH_ORDER = {"AAPL": 1, "MSFT": 2, "AERO": 3}
+BENCH_LEG = {"STOCK" + str(i): 1 for i in range(10)}
+
+
+def report(label, count, unit, elapsed):
+    print(OK_CLR, "{:<48} {:>10.1f} {}/s  ({} in {:.3f}s)".format(label, count / elapsed, unit, count, elapsed), NO_CLR)
+
+
+#########################
+# 3PC ORDER THROUGHPUT  #
+#########################
+
+def bench_order_throughput(latency, orders):
+    """Runs reserve, precommit and commit for a number of orders on one exchange"""
+
+    exchange = offline_exchange('Bench', BENCH_STOCKS)
+    exchange.kInjectedLatency = latency
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(orders):
+            reservation_number = exchange.reserve_stocks(BENCH_ORDER)
+            exchange.precommit_reservation(reservation_number)
+            exchange.execute_reservation(reservation_number)
+    return time.perf_counter() - start
+
+
+def orders():
+    print(TXT_CLR, "Orders per second per exchange (reserve, precommit, commit)...", NO_CLR)
+    report("Fixed 1s sleeps (kInjectedLatency = 1)", 2, "orders", bench_order_throughput(1, 2))
+    report("Latency injection off (default)", 500, "orders", bench_order_throughput(0, 500))
+
+
+def connect_per_call_update(database_name, stock_name, change_in_quantity):
+    """The old Node.update_quantity: a fresh connection, a read and a write per call"""
+
+    db_connection = sqlite3.connect(database_name)
+    db_cursor = db_connection.cursor()
+    db_cursor.execute('''SELECT * FROM stock_current_quantity_table WHERE stock_name=?''', [stock_name, ])
+    new_quantity = db_cursor.fetchall()[0][1] + change_in_quantity
+    db_cursor.execute('''UPDATE stock_current_quantity_table SET current_quantity=? WHERE stock_name=?''', [new_quantity, stock_name,])
+    db_connection.commit()
+    db_connection.close()
+
+
+def connect_per_call_quantities(database_name, quantity_date, quantity_time):
+    """The old TimeUpdate lookup: a fresh connection and a query of the quantity table per tick"""
+
+    db_connection = sqlite3.connect(database_name)
+    db_cursor = db_connection.cursor()
+    db_cursor.execute('''SELECT * FROM stock_quantity_table WHERE quantity_date=? AND quantity_time=?''', [quantity_date, quantity_time,])
+    all_rows = db_cursor.fetchall()
+    db_connection.close()
+    return all_rows
+
+
+#######################
+# INVENTORY PERSISTING #
+#######################
+
+def inventory():
+    print(TXT_CLR, "Persisting a ten-stock mutual fund leg...", NO_CLR)
+    legs = 200
+
+    start = time.perf_counter()
+    for i in range(legs):
+        for symbol, qty in BENCH_LEG.items():
+            connect_per_call_update('data/Bench.db', symbol, -qty)
+    report("Connect and update per symbol", legs, "legs", time.perf_counter() - start)
+
+    journal = InventoryJournal(ExchangeStorage('Bench'))
+    start = time.perf_counter()
+    for i in range(legs):
+        for symbol, qty in BENCH_LEG.items():
+            journal.record(symbol, i)
+        journal.flush()
+    report("InventoryJournal, one flush per leg", legs, "legs", time.perf_counter() - start)
+
+
+#####################
+# STORAGE LIFETIME  #
+#####################
+
+def storage():
+    print(TXT_CLR, "Single quantity updates, connection per call vs long-lived...", NO_CLR)
+    updates = 1000
+
+    start = time.perf_counter()
+    for i in range(updates):
+        connect_per_call_update('data/Bench.db', "AAPL", -1)
+    report("sqlite3.connect per update", updates, "updates", time.perf_counter() - start)
+
+    exchange_storage = ExchangeStorage('Bench')
+    start = time.perf_counter()
+    for i in range(updates):
+        exchange_storage.add_quantity("AAPL", -1)
+    report("ExchangeStorage, WAL and cached statements", updates, "updates", time.perf_counter() - start)
+    exchange_storage.close()
+
+
+##################
+# TIMEOUT TIMERS #
+##################
+
+def timers():
+    print(TXT_CLR, "Arming and cancelling one reservation timeout...", NO_CLR)
+    count = 2000
+
+    start = time.perf_counter()
+    for i in range(count):
+        timer = Timer(10, print)
+        timer.start()
+        timer.cancel()
+    report("threading.Timer per timeout", count, "timers", time.perf_counter() - start)
+
+    scheduler = Scheduler(Queue().put)
+    start = time.perf_counter()
+    for i in range(count):
+        scheduler.cancel(scheduler.schedule(10, print))
+    report("Shared Scheduler heap", count, "timers", time.perf_counter() - start)
+
+
+#################
+# PRICE HISTORY #
+#################
+
+def price_rows(stocks, days):
+    """Synthetic stock_price_table rows: hourly ticks from 8:00 to 16:00"""
+    rows = []
+    for day in range(days):
+        date = "{}/{}/2016".format(day // 28 + 1, day % 28 + 1)
+        for hour in range(8, 17):
+            for stock in range(stocks):
+                rows.append(("STOCK" + str(stock), 100.0 + day + hour / 100, date, str(hour) + ":00"))
+    return rows
+
+
+def nested_price_dict(rows):
+    """The old Exchange.stock_prices: stock, then date, then time"""
+    stock_prices = {}
+    for stock_name, stock_price, stock_date, stock_time in rows:
+        stock_prices.setdefault(stock_name, {}).setdefault(stock_date, {})[stock_time] = stock_price
+    return stock_prices
+
+
+def measure(build, stocks, days):
+    """Memory still held once the rows a build was given are freed, as after fetchall()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(price_rows(stocks, days))
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def prices():
+    stocks, days = 100, 250
+    print(TXT_CLR, "Price history of {} stocks over {} days of hourly ticks...".format(stocks, days), NO_CLR)
+
+    stock_prices, size, elapsed = measure(nested_price_dict, stocks, days)
+    print(OK_CLR, "{:<48} {:>10.1f} MB  (rows and build in {:.3f}s)".format("Nested dict", size / 2**20, elapsed), NO_CLR)
+    store, size, elapsed = measure(PriceStore.from_rows, stocks, days)
+    print(OK_CLR, "{:<48} {:>10.1f} MB  (rows and build in {:.3f}s)".format("PriceStore columns", size / 2**20, elapsed), NO_CLR)
+
+    lookups = 100000
+    start = time.perf_counter()
+    for i in range(lookups):
+        stock_prices["STOCK7"]["3/4/2016"]["12:00"]
+    report("Nested dict point lookups", lookups, "lookups", time.perf_counter() - start)
+    tick = store.tick_of("3/4/2016", "12:00")
+    start = time.perf_counter()
+    for i in range(lookups):
+        store.price_as_of("STOCK7", tick)
+    report("PriceStore as-of lookups by tick", lookups, "lookups", time.perf_counter() - start)
+
+
+def startup():
+    """Needs NumPy, which builds the snapshot as exchangeInit does"""
+    import numpy as np
+    from data import csvArrays, exchangeInit
+    stocks, days = 100, 250
+    print(TXT_CLR, "Loading the price history of {} stocks over {} days at startup...".format(stocks, days), NO_CLR)
+    rows = price_rows(stocks, days)
+    db_connection = sqlite3.connect('data/Bench.db')
+    db_connection.execute('''DELETE FROM stock_price_table''')
+    db_connection.executemany('INSERT INTO stock_price_table VALUES (?, ?, ?, ?)', rows)
+    db_connection.commit()
+    db_connection.close()
+    prices = csvArrays.from_rows(rows, 'Bench', np.float64, np.nan)
+    quantities = csvArrays.from_rows([], 'Bench', np.int64, 0)
+    exchangeInit.write_exchange_snapshot('data/Bench.snap', exchangeInit.exchange_source('Bench', prices, quantities))
+
+    loads = 3
+    start = time.perf_counter()
+    for i in range(loads):
+        PriceStore.from_rows(ExchangeStorage('Bench').load_prices())
+    report("fetchall() and PriceStore.from_rows", loads, "starts", time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(loads):
+        PriceStore.from_snapshot(PriceSnapshot('data/Bench.snap'))
+    report("Mapped PriceSnapshot", loads, "starts", time.perf_counter() - start)
+
+
+################
+# IPO SCHEDULE #
+################
+
+def ipo():
+    stocks, days = 100, 250
+    print(TXT_CLR, "Handling TimeUpdates against {} stocks over {} days of quantity rows...".format(stocks, days), NO_CLR)
+    # An issue of 5 shares every tenth tick for every stock, in an unindexed table as built before
+    rows = [(stock, 5 if i % 10 == 0 else 0, date, tm) for i, (stock, price, date, tm) in enumerate(price_rows(stocks, days))]
+    db_connection = sqlite3.connect('data/Bench.db')
+    db_connection.execute('''DELETE FROM stock_quantity_table''')
+    db_connection.executemany('INSERT INTO stock_quantity_table VALUES (?, ?, ?, ?)', rows)
+    db_connection.commit()
+    db_connection.close()
+    ticks = [("2/{}/2016".format(day), str(hour) + ":00") for day in range(1, 4) for hour in range(8, 17)]
+
+    start = time.perf_counter()
+    for date, tm in ticks:
+        for stock_name, quantity, quantity_date, quantity_time in connect_per_call_quantities('data/Bench.db', date, tm):
+            if quantity > 0:
+                connect_per_call_update('data/Bench.db', stock_name, quantity)
+    report("Quantity query and update per row", len(ticks), "ticks", time.perf_counter() - start)
+
+    exchange = offline_exchange('Bench', BENCH_STOCKS)
+    start = time.perf_counter()
+    exchange.ipo_schedule = IpoSchedule.from_rows(exchange.storage.load_quantity_schedule())
+    print(OK_CLR, "{:<48} {:>10.3f} s".format("Building the IpoSchedule at startup", time.perf_counter() - start), NO_CLR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for date, tm in ticks:
+            exchange.process_request({"action": "TimeUpdate", "serverDate": date, "serverTime": tm})
+    stats = exchange.tick_stats()
+    print(OK_CLR, "{:<48} {:>10.3f} ms mean, {:.3f} ms max over {} ticks".format(
+        "IpoSchedule lookup and batched book update", stats["mean_ms"], stats["max_ms"], stats["ticks"]), NO_CLR)
+
+
+#################
+# CSV INGESTION #
+#################
+
+def csv_loading():
+    """Needs NumPy, which the data scripts use to load the CSVs"""
+    from data import csvArrays, csvReader
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    file_name = os.path.join(data_directory, 'qty_stocks.csv')
+    print(TXT_CLR, "Loading every exchange's quantities from qty_stocks.csv as integers...", NO_CLR)
+
+    loads = 3
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(loads):
+            exchange_dict, stock_list = csvReader.read_quantity_for_all_exchanges(file_name)
+            for stock_dict in exchange_dict.values():
+                for date_dict in stock_dict.values():
+                    for time_dict in date_dict.values():
+                        for tm, qty in time_dict.items():
+                            time_dict[tm] = int(qty)
+        nested = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(loads):
+            csvArrays.load_quantities(file_name)
+        arrays = time.perf_counter() - start
+    report("csvReader nested dicts, int() per cell", loads, "loads", nested)
+    report("csvArrays typed int64 array", loads, "loads", arrays)
+
+
+#########################
+# REGISTRATION BURST    #
+#########################
+
+BENCH_REGISTRATION_PORT = 12445
+
+
+def register_clients(first, count, errors):
+    """One exchange starting up: connect, register and read the reply, for count exchanges"""
+
+    for i in range(first, first + count):
+        msg = {"action": "Register", "group": i % 6, "name": "Exchange" + str(i), "portNum": 20000 + i}
+        try:
+            with socket.create_connection(("localhost", BENCH_REGISTRATION_PORT), timeout=10) as soc:
+                send_frame(soc, json.dumps(msg).encode('ascii'))
+                if recv_frame(soc) is None:
+                    errors.append(i)
+        except OSError:
+            errors.append(i)
+
+
+def registrations():
+    """Runs registrationServer.py in the sandbox and registers exchanges from concurrent clients"""
+
+    server_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'registrationServer.py')
+    server = subprocess.Popen([sys.executable, server_file, str(BENCH_REGISTRATION_PORT)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for i in range(100):
+            try:
+                socket.create_connection(("localhost", BENCH_REGISTRATION_PORT), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        print(TXT_CLR, "Registrations per second against a burst of concurrent exchanges...", NO_CLR)
+        for clients, per_client in ((1, 200), (20, 20), (100, 5)):
+            errors = []
+            threads = [Thread(target=register_clients, args=(c * per_client, per_client, errors))
+                       for c in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            report("{} clients, {} failed".format(clients, len(errors)), clients * per_client,
+                   "registrations", elapsed)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+#########################
+# HISTORY REPLAY        #
+#########################
+
+BENCH_REPLAY_PORT = 12446
+
+
+def replay():
+    """Replays every market hour of 2016 to a super peer and 8 peers in each clock mode"""
+
+    import registrationServer
+    registrationServer.STORAGE = RegistrationStorage(registrationServer.DATABASE_NAME)
+    registrationServer.SERVER_PORT_NUM = BENCH_REPLAY_PORT
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(asyncio.start_server(registrationServer.handle_connection, "localhost",
+                                                 BENCH_REPLAY_PORT, reuse_address=True))
+    Thread(target=loop.run_forever, daemon=True).start()
+    superpeer = network_peer("Super", BENCH_REPLAY_PORT + 1, 0, BENCH_REPLAY_PORT, print)
+    superpeer.isSuper = True
+    for i in range(8):
+        peer = network_peer("Peer" + str(i), BENCH_REPLAY_PORT + 2 + i, i + 1, BENCH_REPLAY_PORT, print)
+        superpeer.peer_list[peer.name] = {"portNum": peer.port}
+    registrationServer.SUPER_PEER_LIST.append(registrationServer.SuperPeer(0, superpeer.port, 0, "Super"))
+    superpeer.send_heartbeat()
+
+    print(TXT_CLR, "Replaying the ticks of 1/1/2016 to 12/12/2016 to 9 nodes...", NO_CLR)
+    for mode in ('max', 'virtual'):
+        registrationServer.TICK_EPOCH += 1
+        clock = registrationServer.TimeThread(1, 1, 2016, 7, mode=mode, end=datetime.date(2016, 12, 12))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            clock.start()
+            clock.join()
+        elapsed = time.perf_counter() - start
+        report("{} mode, last tick handled {}".format(mode.capitalize(), superpeer.tick_seq), clock._tick_seq,
+               "ticks", elapsed)
+    superpeer.isSuper = False
+    print(OK_CLR, "{:<48} {:>10.1f} ticks/s  ({} in {:.0f}s)".format(
+        "Rate mode (default, 1 tick a second)", registrationServer.CLOCK_RATE, clock._tick_seq,
+        clock._tick_seq / registrationServer.CLOCK_RATE), NO_CLR)
+
+
+#########################
+# CLOCK PERSISTENCE     #
+#########################
+
+def connect_per_call_tick(database_name, year, month, day, hour):
+    """The old update_time_database: a fresh connection and a committed update per tick"""
+
+    db_connection = sqlite3.connect(database_name)
+    db_cursor = db_connection.cursor()
+    db_cursor.execute('''UPDATE date_time_table SET month=?, day=?, hour=?
+                      WHERE year=?''', [month, day, hour, year,])
+    db_connection.commit()
+    db_connection.close()
+
+
+def report_jitter(label, samples):
+    samples = sorted(samples)
+    print(OK_CLR, "{:<48} {:>10.3f} ms mean, {:.3f} ms p99, {:.3f} ms max".format(
+        label, 1000 * sum(samples) / len(samples), 1000 * samples[len(samples) * 99 // 100], 1000 * samples[-1]),
+        NO_CLR)
+
+
+def clock_persistence():
+    ticks = 1000
+    print(TXT_CLR, "Time the clock thread is held up saving each of {} ticks...".format(ticks), NO_CLR)
+    db_connection = sqlite3.connect('data/ClockBefore.db')
+    db_connection.execute('''CREATE TABLE IF NOT EXISTS date_time_table
+                          (year INTEGER PRIMARY KEY, month INTEGER, day INTEGER, hour INTEGER)''')
+    db_connection.execute('''INSERT OR IGNORE INTO date_time_table VALUES (2016, 1, 1, 7)''')
+    db_connection.commit()
+    db_connection.close()
+    storage = RegistrationStorage('data/Clock.db')
+
+    for label, save in (("Connect, update and commit per tick",
+                         lambda *tick: connect_per_call_tick('data/ClockBefore.db', *tick)),
+                        ("RegistrationStorage, one commit per 0.5 s", storage.record_tick)):
+        samples = []
+        for i in range(ticks):
+            start = time.perf_counter()
+            save(2016, 1 + i // 252, 1 + i // 9 % 28, 8 + i % 9)
+            samples.append(time.perf_counter() - start)
+            # A tick every 2 ms, about the pace of max mode
+            time.sleep(0.002)
+        report_jitter(label, samples)
+    storage.close()
+    print(OK_CLR, "{:<48} {:>10} commits".format("Commits for {} ticks with RegistrationStorage".format(ticks),
+                                               storage.flushes), NO_CLR)
+
+
+#########################
+# SUPER PEER QUERIES    #
+#########################
+
+def queries():
+    """Answers Query messages from handle_message, the way the event loop does"""
+
+    import registrationServer
+    registrationServer.STORAGE = RegistrationStorage('data/Query.db')
+    if not registrationServer.SUPER_PEER_LIST:
+        for group in range(registrationServer.CONTINENTAL_GROUPS):
+            registrationServer.SUPER_PEER_LIST.append(
+                registrationServer.SuperPeer(group, 12351 + group, 3, "Exchange" + str(group)))
+    version = [registrationServer.TICK_EPOCH, registrationServer.SUPER_PEER_VERSION]
+    count = 20000
+    print(TXT_CLR, "Super peer queries answered per second during a registration storm...", NO_CLR)
+    for label, msg, keep_cache in (
+            ("Table serialized per query", {"action": "Query", "group": 0}, False),
+            ("Cached full table", {"action": "Query", "group": 0}, True),
+            ("Cached not modified", {"action": "Query", "group": 0, "version": version}, True)):
+        msg = json.dumps(msg)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for i in range(count):
+                if not keep_cache:
+                    registrationServer.QUERY_CACHE.clear()
+                reply = registrationServer.handle_message(msg)
+            elapsed = time.perf_counter() - start
+        report("{}, {} byte reply".format(label, len(reply)), count, "queries", elapsed)
+    registrationServer.STORAGE.close()
+
+
+BENCHMARKS = {
+    "orders": orders,
+    "inventory": inventory,
+    "storage": storage,
+    "timers": timers,
+    "prices": prices,
+    "startup": startup,
+    "ipo": ipo,
+    "csv": csv_loading,
+    "registrations": registrations,
+    "replay": replay,
+    "clock": clock_persistence,
+    "queries": queries,
+}
+
+
+def main():
+    """Runs the benchmarks named on the command line, or all of them"""
+
+    names = sys.argv[1:] or list(BENCHMARKS)
+    stocks = dict(BENCH_STOCKS)
+    stocks.update({"STOCK" + str(i): 10**9 for i in range(100)})
+    os.chdir(make_sandbox('Bench', stocks))
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import asyncio
+import contextlib
+import datetime
+import io
+import os
+import sys
+import tempfile
+import time
+import registrationServer
+from registrationStorage import RegistrationStorage
+from testSandbox import network_peer
+from threading import Thread
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+REGISTRATION_PORT = 14700
+SUPER_PORT = 14701
+# Nothing listens here: it stands in for a peer that died
+DEAD_PORT = 14699
+PEERS = 20
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def start_registration_server():
+    """Serves registrationServer's message handlers on an event loop thread"""
+    # Ticks name the port their receipts go back to
+    registrationServer.SERVER_PORT_NUM = REGISTRATION_PORT
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(asyncio.start_server(registrationServer.handle_connection, "localhost",
+                                                 REGISTRATION_PORT, reuse_address=True))
+    Thread(target=loop.run_forever, daemon=True).start()
+
+
+def send_tick(tick_seq, server_time):
+    """Sends one tick from the registration server and returns its report"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        registrationServer.send_time_update("1/4/2016", server_time, tick_seq)
+        time.sleep(1)
+        return registrationServer.report_tick(tick_seq)
+
+
+def run_clock(mode, last_day, rate=None):
+    """
+    Runs the registration server's clock from 1/4/2016 to last_day of January,
+    9 ticks a day, and returns the clock and the seconds it took
+    """
+    # A new epoch, as if the server restarted, so tick numbers start over
+    registrationServer.TICK_EPOCH += 1
+    clock = registrationServer.TimeThread(4, 1, 2016, 7, mode=mode, rate=rate, end=datetime.date(2016, 1, last_day))
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        clock.start()
+        clock.join()
+    return clock, time.monotonic() - start
+
+
+def test_clock_modes(superpeer, peers):
+    registrationServer.STORAGE = RegistrationStorage(os.path.join(tempfile.mkdtemp(), 'registration.db'))
+    nodes = [superpeer] + peers
+    missed_ticks = [node.missed_ticks for node in nodes]
+
+    print(TXT_CLR, "Testing rate mode paces ticks by wall time...", NO_CLR)
+    clock, elapsed = run_clock('rate', 4, rate=20)
+    test_assert_equal([9] * len(nodes), [node.tick_seq for node in nodes])
+    test_assert_equal(True, 9 / 20 - 0.05 < elapsed < 9 / 20 + 0.5)
+
+    print(TXT_CLR, "Testing max mode sends a week of ticks as fast as super peers acknowledge...", NO_CLR)
+    clock, elapsed = run_clock('max', 8)
+    print(TXT_CLR, "\t45 ticks in {:.2f} s, against 45 s at one tick a second".format(elapsed), NO_CLR)
+    # Only super peers are waited for, so peers may still be handling the last tick
+    time.sleep(0.5)
+    test_assert_equal([45] * len(nodes), [node.tick_seq for node in nodes])
+    test_assert_equal("16:00", peers[-1].node_time)
+    test_assert_equal(True, elapsed < 45 / registrationServer.CLOCK_RATE / 4)
+
+    print(TXT_CLR, "Testing virtual mode waits for every node before the next tick...", NO_CLR)
+    clock, elapsed = run_clock('virtual', 8)
+    print(TXT_CLR, "\t45 ticks in {:.2f} s".format(elapsed), NO_CLR)
+    test_assert_equal([45] * len(nodes), [node.tick_seq for node in nodes])
+    test_assert_equal({node.name for node in nodes}, clock._members)
+    test_assert_equal(missed_ticks, [node.missed_ticks for node in nodes])
+
+    print(TXT_CLR, "Testing virtual mode is best effort: a node slower than the timeout is left behind...", NO_CLR)
+    with registrationServer.TICK_LOCK:
+        registrationServer.TICK_STATS[0] = (time.time(), {"Fast": time.time()})
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        acked = registrationServer.await_tick_acks(0, {"Fast", "Slow"}, 0.2)
+        registrationServer.report_tick(0)
+    test_assert_equal({"Fast"}, acked)
+    test_assert_equal(True, 0.2 <= time.monotonic() - start < 0.5)
+
+
+def main():
+    start_registration_server()
+    superpeer = network_peer("Super", SUPER_PORT, 0, REGISTRATION_PORT, print)
+    superpeer.isSuper = True
+    peers = [network_peer("Peer" + str(i), SUPER_PORT + 1 + i, i + 1, REGISTRATION_PORT, print)
+             for i in range(PEERS)]
+    for i, peer in enumerate(peers):
+        # With 21 members split 4 ways, the dead peer heads the second subtree of 6
+        if i == 6:
+            superpeer.peer_list["Dead"] = {"portNum": DEAD_PORT}
+        superpeer.peer_list[peer.name] = {"portNum": peer.port}
+    registrationServer.SUPER_PEER_LIST.append(registrationServer.SuperPeer(0, SUPER_PORT, 0, "Super"))
+    registrationServer.FAILURE_DETECTOR.heartbeat(SUPER_PORT)
+
+    print(TXT_CLR, "Testing a tick reaches every live node down the tree...", NO_CLR)
+    report = send_tick(1, "09:00")
+    test_assert_equal([1] * PEERS, [peer.tick_seq for peer in peers])
+    test_assert_equal("09:00", peers[-1].node_time)
+
+    print(TXT_CLR, "Testing the subtree of a dead node is sent the tick by its parent...", NO_CLR)
+    test_assert_equal(False, "Dead" in superpeer.peer_list)
+
+    print(TXT_CLR, "Testing every node's receipt is reported...", NO_CLR)
+    test_assert_equal(PEERS + 1, report[0])
+    print(TXT_CLR, "\tSpread {:.1f} ms, last node {:.1f} ms after send".format(report[1] * 1000, report[2] * 1000),
+          NO_CLR)
+
+    print(TXT_CLR, "Testing a repeated tick is dropped...", NO_CLR)
+    registrationServer.TICK_STATS[1] = (time.time(), {})
+    superpeer.request_queue.put({"action": "TimeUpdate", "serverDate": "1/4/2016", "serverTime": "09:00",
+                                 "tickEpoch": registrationServer.TICK_EPOCH, "tickSeq": 1})
+    time.sleep(0.5)
+    test_assert_equal(None, registrationServer.report_tick(1))
+
+    print(TXT_CLR, "Testing nodes count the ticks they missed...", NO_CLR)
+    report = send_tick(3, "11:00")
+    test_assert_equal([3] * PEERS, [peer.tick_seq for peer in peers])
+    test_assert_equal([1] * PEERS, [peer.missed_ticks for peer in peers])
+
+    test_clock_modes(superpeer, peers)
+    test_asyncio_tree(peers)
+    sys.exit(1 if FAILURES else 0)
+
+
+def test_asyncio_tree(peers):
+    print(TXT_CLR, "Testing an asyncio superpeer sends the subtree of a dead node the tick...", NO_CLR)
+    superpeer = network_peer("Async Super", SUPER_PORT + PEERS + 1, 0, REGISTRATION_PORT, print, runtime="asyncio")
+    superpeer.isSuper = True
+    for i, peer in enumerate(peers):
+        if i == 6:
+            superpeer.peer_list["Dead"] = {"portNum": DEAD_PORT}
+        superpeer.peer_list[peer.name] = {"portNum": peer.port}
+    # A new epoch, so the peers take the tick whatever they last heard
+    registrationServer.TICK_EPOCH += 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        superpeer.request_queue.put({"action": "TimeUpdate", "serverDate": "1/4/2016", "serverTime": "16:00",
+                                     "tickEpoch": registrationServer.TICK_EPOCH, "tickSeq": 1,
+                                     "registrationPort": REGISTRATION_PORT})
+        time.sleep(1)
+    test_assert_equal(["16:00"] * PEERS, [peer.node_time for peer in peers])
+    test_assert_equal(False, "Dead" in superpeer.peer_list)
+    superpeer.runtime.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import select
+import socket
+import struct
+import sys
+import time
+from connectionPool import ConnectionPool, FanOut
+from messageFraming import recv_frame, send_frame
+from threading import Thread
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+BASE_PORT = 14500
+# Nothing listens here
+DEAD_PORT = 14499
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def serve(port, handle):
+    """
+    Listens on port and runs handle(conn, number, received) for every
+    connection, numbered from 0. Returns the list of payloads received.
+    """
+    received = []
+    listener = socket.create_server(("localhost", port))
+
+    def accept():
+        number = 0
+        while True:
+            conn, address = listener.accept()
+            Thread(target=handle, args=(conn, number, received), daemon=True).start()
+            number += 1
+    Thread(target=accept, daemon=True).start()
+    return received
+
+
+def echo(conn, number, received):
+    """Replies to every frame with the frame itself"""
+    while True:
+        payload = recv_frame(conn)
+        if payload is None:
+            break
+        received.append(payload)
+        send_frame(conn, payload)
+    conn.close()
+
+
+def close_after_one(conn, number, received):
+    """Reads one frame and closes the connection without replying"""
+    received.append(recv_frame(conn))
+    conn.close()
+
+
+def reset_unread(conn, number, received):
+    """
+    The first connection answers one frame, then resets once the next
+    arrives, unread, as a peer does that closes just as a send starts
+    """
+    if number > 0:
+        return echo(conn, number, received)
+    payload = recv_frame(conn)
+    received.append(payload)
+    send_frame(conn, payload)
+    select.select([conn], [], [])
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    conn.close()
+
+
+def close_unanswered(conn, number, received):
+    """
+    The first connection answers one frame, then reads the next and closes
+    without answering, as a peer does that fails while handling it
+    """
+    if number > 0:
+        return echo(conn, number, received)
+    payload = recv_frame(conn)
+    received.append(payload)
+    send_frame(conn, payload)
+    received.append(recv_frame(conn))
+    conn.close()
+
+
+def test_retries():
+    print(TXT_CLR, "Testing a connection the peer closed is not reused...", NO_CLR)
+    pool = ConnectionPool()
+    received = serve(BASE_PORT, close_after_one)
+    test_assert_equal(True, pool.send("localhost", BASE_PORT, b"first"))
+    time.sleep(0.1)
+    test_assert_equal(True, pool.send("localhost", BASE_PORT, b"second"))
+    time.sleep(0.1)
+    test_assert_equal([b"first", b"second"], received)
+    test_assert_equal((2, 0), (pool.connects, pool.reuses))
+
+    print(TXT_CLR, "Testing a reused connection reset before it was read is retried once...", NO_CLR)
+    pool = ConnectionPool()
+    received = serve(BASE_PORT + 1, reset_unread)
+    test_assert_equal(b"first", pool.send("localhost", BASE_PORT + 1, b"first", need_reply=True))
+    test_assert_equal(b"second", pool.send("localhost", BASE_PORT + 1, b"second", need_reply=True))
+    test_assert_equal([b"first", b"second"], received)
+    test_assert_equal((2, 1), (pool.connects, pool.reuses))
+
+    print(TXT_CLR, "Testing a payload the peer read but did not answer is not sent twice...", NO_CLR)
+    pool = ConnectionPool()
+    received = serve(BASE_PORT + 2, close_unanswered)
+    test_assert_equal(b"first", pool.send("localhost", BASE_PORT + 2, b"first", need_reply=True))
+    test_assert_equal(None, pool.send("localhost", BASE_PORT + 2, b"second", need_reply=True))
+    time.sleep(0.1)
+    test_assert_equal([b"first", b"second"], received)
+    test_assert_equal(b"third", pool.send("localhost", BASE_PORT + 2, b"third", need_reply=True))
+
+    print(TXT_CLR, "Testing an unreachable destination is reported...", NO_CLR)
+    test_assert_equal(None, pool.send("localhost", DEAD_PORT, b"lost"))
+    test_assert_equal(0, pool.open_count[("localhost", DEAD_PORT)])
+
+
+def test_limits():
+    print(TXT_CLR, "Testing connections per destination are capped...", NO_CLR)
+    dest = ("localhost", BASE_PORT + 3)
+    serve(BASE_PORT + 3, echo)
+    pool = ConnectionPool(max_per_destination=2)
+    first, reused = pool.acquire(dest)
+    second, reused = pool.acquire(dest)
+    start = time.monotonic()
+    test_assert_equal((None, False), pool.acquire(dest, timeout=0.2))
+    test_assert_equal(True, time.monotonic() - start >= 0.2)
+
+    print(TXT_CLR, "Testing a released connection goes to a waiting sender...", NO_CLR)
+    acquired = []
+    waiter = Thread(target=lambda: acquired.append(pool.acquire(dest, timeout=2)))
+    waiter.start()
+    time.sleep(0.1)
+    pool.release(dest, first)
+    waiter.join()
+    test_assert_equal([(first, True)], acquired)
+    pool.discard(dest, second)
+    pool.discard(dest, first)
+    test_assert_equal(0, pool.open_count[dest])
+
+    print(TXT_CLR, "Testing a connection idle past the timeout is replaced...", NO_CLR)
+    pool = ConnectionPool(idle_timeout=0.1)
+    test_assert_equal(b"ping", pool.send(*dest, b"ping", need_reply=True))
+    time.sleep(0.2)
+    test_assert_equal(b"ping", pool.send(*dest, b"ping", need_reply=True))
+    test_assert_equal((2, 0), (pool.connects, pool.reuses))
+    test_assert_equal(1, pool.open_count[dest])
+
+    print(TXT_CLR, "Testing idle connections are evicted by the periodic sweep...", NO_CLR)
+    time.sleep(1.1)
+    # Any checkout sweeps, whatever its destination
+    pool.send("localhost", DEAD_PORT, b"lost")
+    test_assert_equal(([], 0), (pool.idle[dest], pool.open_count[dest]))
+
+
+class BlackholePool():
+    """
+    Stands in for a ConnectionPool to which the ports in blackholed never
+    answer, so a send to them takes its whole timeout. Records every send.
+    """
+    def __init__(self, blackholed):
+        self.blackholed = blackholed
+        self.sends = []
+
+    def send(self, address, port, payload, need_reply=False, timeout=5):
+        self.sends.append((port, timeout))
+        if port in self.blackholed:
+            time.sleep(timeout)
+            return None
+        return payload if need_reply else True
+
+
+def test_fan_out():
+    print(TXT_CLR, "Testing live peers queued behind blackholed ones are not reported...", NO_CLR)
+    pool = BlackholePool({1, 2, 3, 4})
+    fan_out = FanOut(pool, workers=2)
+    targets = [("Dead" + str(port), port, b"ping") for port in (1, 2, 3, 4)] + [("Live", 5, b"ping")]
+    start = time.monotonic()
+    test_assert_equal(["Dead1", "Dead2", "Dead3", "Dead4"], fan_out.send_to_many(targets, timeout=0.5))
+    test_assert_equal(True, time.monotonic() - start < 0.7)
+    test_assert_equal([1, 2, 3, 4, 5], sorted(port for port, timeout in pool.sends))
+
+    print(TXT_CLR, "Testing each send is given no more than the time left to the call...", NO_CLR)
+    test_assert_equal(True, all(timeout <= 0.5 for port, timeout in pool.sends))
+
+    print(TXT_CLR, "Testing a job still queued at the deadline is dropped unsent...", NO_CLR)
+    pool.sends.clear()
+    fan_out.jobs.put((("Late", 6, b"ping"), False, time.monotonic(), set(), {}, None))
+    with fan_out.lock:
+        fan_out.pending += 1
+    time.sleep(0.1)
+    test_assert_equal([], pool.sends)
+
+    print(TXT_CLR, "Testing ask_many returns the replies that came back in time...", NO_CLR)
+    targets = [("Dead1", 1, b"ping"), ("Live5", 5, b"pong5"), ("Live6", 6, b"pong6")]
+    test_assert_equal({"Live5": b"pong5", "Live6": b"pong6"}, fan_out.ask_many(targets, timeout=0.3))
+
+
+def main():
+    test_retries()
+    test_limits()
+    test_fan_out()
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import contextlib
+import csv
+import io
+import math
+import numpy as np
+import os
+import sqlite3
+import sys
+import tempfile
+from data import csvArrays, csvReader, exchangeInit
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+HEADER = [
+    ['', '', 'Continent', 'Europe', 'Europe', 'America'],
+    ['', '', 'Country', 'France', 'France', 'United States'],
+    ['', '', 'Market', 'Euronext Paris', 'Euronext Paris', 'New York Stock Exchange'],
+    ['Date', 'GMT Time', 'Stock', 'ACCOR', 'AIRBUS GROUP', 'Intel'],
+]
+# Rows out of time order, since the files are not sorted either
+PRICE_ROWS = [
+    ['1/4/2016', '9:00', '', '38.5', '', '32.25'],
+    ['1/5/2016', '9:00', '', '', '60.5', '32.5'],
+    ['1/4/2016', '10:00', '', '38.75', '61', ''],
+]
+QUANTITY_ROWS = [
+    ['1/4/2016', '9:00', '', '100', '', '250'],
+    ['1/5/2016', '9:00', '', '5', '', '10'],
+    ['1/4/2016', '10:00', '', '', '40', ''],
+]
+# What the nested-dict reader returned for the fixture before it was rewritten as a single pass
+OLD_PRICES = {
+    'Euronext Paris': {
+        'ACCOR': {'1/4/2016': {'9:00': '38.5', '10:00': '38.75'}, '1/5/2016': {'9:00': ''}},
+        'AIRBUS GROUP': {'1/4/2016': {'9:00': '', '10:00': '61'}, '1/5/2016': {'9:00': '60.5'}},
+    },
+    'New York Stock Exchange': {
+        'Intel': {'1/4/2016': {'9:00': '32.25', '10:00': ''}, '1/5/2016': {'9:00': '32.5'}},
+    },
+}
+OLD_QUANTITIES = {
+    'Euronext Paris': {
+        'ACCOR': {'1/4/2016': {'9:00': '100', '10:00': 0}, '1/5/2016': {'9:00': '5'}},
+        'AIRBUS GROUP': {'1/4/2016': {'9:00': 0, '10:00': '40'}, '1/5/2016': {'9:00': 0}},
+    },
+    'New York Stock Exchange': {
+        'Intel': {'1/4/2016': {'9:00': '250', '10:00': 0}, '1/5/2016': {'9:00': '10'}},
+    },
+}
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def write_csv(file_name, rows):
+    with open(file_name, 'w', newline='') as csv_file:
+        csv.writer(csv_file).writerows(HEADER + rows)
+
+
+def write_fixture(directory):
+    """Writes the price and quantity CSVs into directory and returns their paths"""
+    prices = os.path.join(directory, 'price_stocks.csv')
+    quantities = os.path.join(directory, 'qty_stocks.csv')
+    write_csv(prices, PRICE_ROWS)
+    write_csv(quantities, QUANTITY_ROWS)
+    return prices, quantities
+
+
+def as_nested_dicts(arrays, exchange_name, cell):
+    """Returns one exchange of a MarketArrays in the nested-dict layout, each value passed through cell"""
+    stock_dict = {}
+    for stock, column in zip(arrays.exchange_stocks(exchange_name), arrays.exchange_values(exchange_name).T.tolist()):
+        for (date, tm), value in zip(arrays.ticks, column):
+            stock_dict.setdefault(stock, {}).setdefault(date, {})[tm] = cell(value)
+    return stock_dict
+
+
+def test_stream_reader(prices, quantities):
+    print(TXT_CLR, "Testing the streaming reader returns what the nested-dict reader did...", NO_CLR)
+    for exchange_name in OLD_PRICES:
+        test_assert_equal((OLD_PRICES[exchange_name], list(OLD_PRICES[exchange_name])),
+                          csvReader.read_price_for_exchange(prices, exchange_name))
+        test_assert_equal((OLD_QUANTITIES[exchange_name], list(OLD_QUANTITIES[exchange_name])),
+                          csvReader.read_quantity_for_exchange(quantities, exchange_name))
+
+    print(TXT_CLR, "Testing one pass reads every exchange, without the label column...", NO_CLR)
+    test_assert_equal((OLD_PRICES, ['ACCOR', 'AIRBUS GROUP', 'Intel']),
+                      csvReader.read_price_for_all_exchanges(prices))
+    test_assert_equal((OLD_QUANTITIES, ['ACCOR', 'AIRBUS GROUP', 'Intel']),
+                      csvReader.read_quantity_for_all_exchanges(quantities))
+    test_assert_equal(list(OLD_PRICES), csvReader.get_exchange_list(prices))
+
+
+def test_arrays(prices, quantities):
+    print(TXT_CLR, "Testing the arrays hold the ticks in time order...", NO_CLR)
+    price_arrays = csvArrays.load_prices(prices)
+    quantity_arrays = csvArrays.load_quantities(quantities)
+    ticks = [('1/4/2016', '9:00'), ('1/4/2016', '10:00'), ('1/5/2016', '9:00')]
+    test_assert_equal((ticks, ticks), (price_arrays.ticks, quantity_arrays.ticks))
+    test_assert_equal(list(OLD_PRICES), price_arrays.exchanges())
+
+    print(TXT_CLR, "Testing the arrays hold the nested-dict reader's values, blanks as NaN or 0...", NO_CLR)
+    for exchange_name in OLD_PRICES:
+        old_prices = {stock: {date: {tm: float(price) if price else 'blank' for tm, price in times.items()}
+                              for date, times in dates.items()}
+                      for stock, dates in OLD_PRICES[exchange_name].items()}
+        test_assert_equal(old_prices, as_nested_dicts(price_arrays, exchange_name,
+                                                      lambda price: 'blank' if math.isnan(price) else price))
+        old_quantities = {stock: {date: {tm: int(qty) for tm, qty in times.items()} for date, times in dates.items()}
+                          for stock, dates in OLD_QUANTITIES[exchange_name].items()}
+        test_assert_equal(old_quantities, as_nested_dicts(quantity_arrays, exchange_name, lambda qty: qty))
+    test_assert_equal(('float64', 'int64'), (str(price_arrays.values.dtype), str(quantity_arrays.values.dtype)))
+
+
+def test_unpriced_stocks():
+    print(TXT_CLR, "Testing stocks with quantities but no prices are left out with a warning...", NO_CLR)
+    prices = csvArrays.from_rows([('ACCOR', 38.5, '1/4/2016', '9:00')], 'Euronext Paris', np.float64, np.nan)
+    quantities = csvArrays.from_rows([('ACCOR', 100, '1/4/2016', '9:00'), ('AIRBUS GROUP', 40, '1/4/2016', '9:00')],
+                                     'Euronext Paris', np.int64, 0)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        stock_list, ticks, price_block, quantity_block = exchangeInit.exchange_source('Euronext Paris', prices,
+                                                                                      quantities)
+    test_assert_equal((['ACCOR'], [[100]]), (stock_list, quantity_block.tolist()))
+    test_assert_equal(['Warning: Euronext Paris leaves out stocks with quantities but no prices: AIRBUS GROUP'],
+                      output.getvalue().splitlines())
+
+
+def build(force=False):
+    """Builds the exchanges from the CSVs of the working directory. Returns the names of those rebuilt."""
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        exchangeInit.build_all_exchanges(jobs=1, force=force)
+    lines = output.getvalue().splitlines()
+    return [exchange_name for exchange_name in OLD_PRICES if 'Built ' + exchange_name in lines]
+
+
+def quantities_at(database_name, date, tm):
+    db_connection = sqlite3.connect(database_name)
+    rows = db_connection.execute("SELECT stock_name, quantity FROM stock_quantity_table "
+                                 "WHERE quantity_date=? AND quantity_time=? ORDER BY stock_name", [date, tm]).fetchall()
+    db_connection.close()
+    return rows
+
+
+def test_incremental_build(directory):
+    os.chdir(directory)
+    print(TXT_CLR, "Testing every exchange is built the first time...", NO_CLR)
+    test_assert_equal(list(OLD_PRICES), build())
+    test_assert_equal(True, all(os.path.exists(name + '.snap') for name in OLD_PRICES))
+
+    print(TXT_CLR, "Testing unchanged exchanges are skipped...", NO_CLR)
+    test_assert_equal([], build())
+    test_assert_equal(list(OLD_PRICES), build(force=True))
+
+    print(TXT_CLR, "Testing an edited CSV rebuilds only the exchange whose columns changed...", NO_CLR)
+    write_csv('price_stocks.csv', [row[:5] + ['33'] if row[0] == '1/5/2016' else row for row in PRICE_ROWS])
+    test_assert_equal(['New York Stock Exchange'], build())
+    test_assert_equal([], build())
+
+    print(TXT_CLR, "Testing CSVs that cover different ticks still build, as before the arrays...", NO_CLR)
+    write_csv('qty_stocks.csv', QUANTITY_ROWS[:2])
+    # Intel had no quantity at the dropped tick anyway, so its exchange builds from the same data
+    test_assert_equal(['Euronext Paris'], build())
+    test_assert_equal([('ACCOR', 0), ('AIRBUS GROUP', 0)], quantities_at('Euronext Paris.db', '1/4/2016', '10:00'))
+    test_assert_equal([('ACCOR', 5), ('AIRBUS GROUP', 0)], quantities_at('Euronext Paris.db', '1/5/2016', '9:00'))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    prices, quantities = write_fixture(directory)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        test_stream_reader(prices, quantities)
+        test_arrays(prices, quantities)
+        test_unpriced_stocks()
+        test_incremental_build(directory)
+    # The reads report their speed, which would bury the results
+    print("\n".join(line for line in output.getvalue().splitlines() if not line.startswith(('Read ', 'Loaded '))))
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
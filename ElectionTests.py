@@ -0,0 +1,170 @@
+import contextlib
+import io
+import sys
+import time
+from failureDetector import FailureDetector
+from paxos import PaxosNode, ballot
+from testSandbox import network_peer
+from threading import Thread
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+BASE_PORT = 14600
+# Nothing listens here: it stands in for the failed superpeer and the registration server
+DEAD_PORT = 14599
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def make_group(size, winners, first_port, dead_peers=0):
+    peers = [network_peer("Peer" + str(i), first_port + i, i + 1, DEAD_PORT, winners.append) for i in range(size)]
+    peer_list = {peer.name: {"portNum": peer.port} for peer in peers}
+    for i in range(dead_peers):
+        peer_list["Dead" + str(i)] = {"portNum": DEAD_PORT}
+    for peer in peers:
+        peer.peer_list = dict(peer_list)
+    return peers
+
+
+def elect(peers):
+    """Runs elect_superpeer on every given peer at once, quietly"""
+    threads = [Thread(target=peer.elect_superpeer) for peer in peers]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def test_leases():
+    print(TXT_CLR, "Testing proposal numbers stay ordered past 100 peers...", NO_CLR)
+    node = PaxosNode()
+    node.peer_num = 250
+    node.msg_prepare()
+    test_assert_equal(True, node.last_proposal > ballot([1, 99]))
+    test_assert_equal(True, node.last_proposal < ballot([2, 1]))
+
+    print(TXT_CLR, "Testing peers holding the leader's lease refuse a new election...", NO_CLR)
+    winners = []
+    peers = make_group(5, winners, BASE_PORT + 40)
+    elect(peers[:1])
+    leader = peers[0]
+    leader.isSuper = True
+    leader.lease_duration = 0.5
+    leader.send_heartbeat()
+    time.sleep(0.1)
+    test_assert_equal(True, all(peer.lease_holds() for peer in peers[1:]))
+    elect(peers[3:4])
+    test_assert_equal(["Peer0"], winners)
+    test_assert_equal(leader.port, peers[3].superpeer)
+
+    print(TXT_CLR, "Testing an expired lease lets the group fail over...", NO_CLR)
+    leader.isSuper = False
+    leader.cancel_timer(leader.heartbeat_timer)
+    time.sleep(0.6)
+    elect(peers[3:4])
+    test_assert_equal(["Peer0", "Peer3"], winners)
+
+    print(TXT_CLR, "Testing peers elect on their own once heartbeats stop...", NO_CLR)
+    leader = peers[3]
+    leader.isSuper = True
+    leader.lease_duration = 0.2
+    leader.heartbeat_interval = 0.1
+    for peer in peers:
+        peer.failure_detector = FailureDetector(0.1)
+        peer.superpeer = leader.port
+    leader.send_heartbeat()
+    time.sleep(0.5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        peers[1].check_superpeer()
+    test_assert_equal(["Peer0", "Peer3"], winners)
+    leader.isSuper = False
+    leader.cancel_timer(leader.heartbeat_timer)
+    time.sleep(1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        peers[1].check_superpeer()
+    test_assert_equal(["Peer0", "Peer3", "Peer1"], winners)
+
+    print(TXT_CLR, "Testing a held lease delays an election by one lease at most...", NO_CLR)
+    peer, new_superpeer = peers[2], peers[4]
+    peer.superpeer = DEAD_PORT
+    peer.heartbeat_interval = 0.1
+    peer.lease_duration = 0.3
+    # As if the superpeer kept heartbeating while refusing messages
+    peer.multi_paxos = True
+    peer.lease_expiry = time.monotonic() + 60
+    peer.elect_superpeer = lambda: setattr(peer, "superpeer", new_superpeer.port)
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        peer.send_message({"action": "Route", "dest": "Peer0", "path": peer.name, "msg": "Hello"})
+        returned = time.monotonic() - start
+        while peer.superpeer != new_superpeer.port and time.monotonic() - start < 1:
+            time.sleep(0.01)
+    elapsed = time.monotonic() - start
+    # The retries run from timers, so the processing thread is not held up meanwhile
+    test_assert_equal(True, returned < peer.heartbeat_interval)
+    test_assert_equal(new_superpeer.port, peer.superpeer)
+    test_assert_equal(True, peer.lease_duration <= elapsed < 1)
+
+
+def main():
+    winners = []
+    peers = make_group(5, winners, BASE_PORT)
+
+    print(TXT_CLR, "Testing a single proposer wins once a quorum replies...", NO_CLR)
+    elect(peers[:1])
+    test_assert_equal(["Peer0"], winners)
+    print(TXT_CLR, "\tFailover took {:.1f} ms, against 10 s of fixed sleeps".format(
+        peers[0].failover_time * 1000), NO_CLR)
+    test_assert_equal(True, peers[0].failover_time < 1)
+
+    print(TXT_CLR, "Testing unreachable peers do not hold up the quorum...", NO_CLR)
+    winners = []
+    peers = make_group(4, winners, BASE_PORT + 10, dead_peers=2)
+    elect(peers[:1])
+    test_assert_equal(["Peer0"], winners)
+    test_assert_equal(True, peers[0].failover_time < 1)
+
+    print(TXT_CLR, "Testing a lost quorum ends at the phase timeout...", NO_CLR)
+    winners = []
+    peers = make_group(1, winners, BASE_PORT + 20, dead_peers=3)
+    peers[0].phase_timeout = 0.5
+    elect(peers)
+    test_assert_equal([], winners)
+    test_assert_equal(True, peers[0].failover_time < 1)
+
+    print(TXT_CLR, "Testing duelling proposers back off until exactly one wins...", NO_CLR)
+    winners = []
+    peers = make_group(5, winners, BASE_PORT + 30)
+    start = time.monotonic()
+    elect(peers[:2])
+    elapsed = time.monotonic() - start
+    print(TXT_CLR, "\t{} won in {:.1f} ms".format(", ".join(winners) or "Nobody", elapsed * 1000), NO_CLR)
+    test_assert_equal(1, len(winners))
+    test_assert_equal(True, elapsed < PaxosNode.phase_timeout)
+
+    print(TXT_CLR, "Testing a peer that already accepted the winner proposes it again...", NO_CLR)
+    winners = []
+    peers = make_group(3, winners, BASE_PORT + 50)
+    elect(peers[:1])
+    # Peer1 accepted Peer0 but has not heard it won, as when it starts its own election late
+    elect(peers[1:2])
+    test_assert_equal(["Peer0"], winners)
+
+    test_leases()
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
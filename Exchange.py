@@ -2,9 +2,15 @@ import Node
 import time
 import socket
 import json
+import os
 import sys
 import sqlite3
-from threading import Timer
+from data.priceSnapshot import PriceSnapshot
+from exchangeStorage import ExchangeStorage
+from inventoryJournal import InventoryJournal
+from ipoSchedule import IpoSchedule
+from priceStore import PriceStore
+from sqlite3 import Error
 
 class Exchange(Node.Node):
     """The exchange class handle the trading logic in our system
@@ -12,14 +18,20 @@ class Exchange(Node.Node):
     
     Attributes:
         stocks: A dict containing information about the price and quantity of stocks CURRENTLY available
+        stock_prices: A PriceStore with the price history of the stocks this exchange trades
+        snapshot: The mapped PriceSnapshot of this exchange, or None if it has none
         reservations: An array containing reservation dicts for stocks this exchange trades
         orders: An array containing order dicts for stocks on other exchanges
         precommit_acks: A dict, keyed by order number, of sets of reservation numbers
             for which we have received precommit acks
         mutual_funds: A dict containing Mutual Fund dicts
+        reservation_timers: A dict, keyed by reservation number, of pending timeout timer ids
+        order_timers: A dict, keyed by order number, of the pending timeout timer id of each order
     """
     #Timeouts
     kReservationTimeout = 10
+    #Simulated network latency in seconds before each 3PC step, off by default
+    kInjectedLatency = 0
     #Message Constants
     kExchangeAction = "exchange_action"
     kMessageBuy = "TradeMF"
@@ -41,67 +53,53 @@ class Exchange(Node.Node):
     kCancelled = "cancelled"
     kReservationFailed = -1
 
-    def __init__(self, group, name, port, registration_port, reservations = [], orders = [], mutual_funds = {}, precommit_acks = {}):
+    def __init__(self, group, name, port, registration_port, reservations = [], orders = [], mutual_funds = {}, precommit_acks = {}, runtime = None, injected_latency = None):
+        if injected_latency is not None:
+            self.kInjectedLatency = injected_latency
         self.reservations = reservations
         self.orders = orders
         self.mutual_funds = mutual_funds
         self.precommit_acks = precommit_acks
         self.clients = {} # dict of client ports to send response on order termination, keyed by order_number
+        self.reservation_timers = {}
+        self.order_timers = {}
 
         with open('MutualFunds.json') as mf_data:
             self.mutual_funds = json.load(mf_data)
 
-        super().__init__(group,name,port,registration_port)
-
         # Gianni's Code Below
 
-        # Connect to sqlite database
+        # Market data is loaded before the node starts, so the first TimeUpdate finds the book ready
+        # One long-lived connection serves the exchange for its whole lifetime
         try:
-            db_connection = sqlite3.connect('data/' + self.name + '.db')
+            self.storage = ExchangeStorage(name)
         except Error as e:
             print(e)
             exit(0)
 
-        self.stock_prices = {}
         self.stocks = {}
-
-        # Gets the cursor
-        db_cursor = db_connection.cursor()
-
-        # Gets information from the stock price table
-        db_cursor.execute('''SELECT * FROM stock_price_table''')
-        all_rows = db_cursor.fetchall()
-
-        # Fills the stock_prices with the pricing information
-        for row in all_rows:
-            stock_name = row[0]
-            stock_price = row[1]
-            stock_date = row[2]
-            stock_time = row[3]
-
-            # Inits a new stock if it doesn't exist
-            if stock_name not in self.stock_prices:
-                self.stock_prices[stock_name] = {}
-
-            # Inits a new date if it doesn't exist
-            if stock_date not in self.stock_prices[stock_name]:
-                self.stock_prices[stock_name][stock_date] = {}
-
-            # Finally fills the dict
-            self.stock_prices[stock_name][stock_date][stock_time] = stock_price
-
-        # Gets information from the current quantity table
-        db_cursor.execute('''SELECT * FROM stock_current_quantity_table''')
-        all_rows = db_cursor.fetchall()
+        # Changes to self.stocks are written behind to the database in batches
+        self.inventory = InventoryJournal(self.storage)
+
+        # Price history indexed by tick, one array column per stock, mapped from
+        # the snapshot exchangeInit writes when there is one
+        snapshot_name = 'data/' + name + '.snap'
+        if os.path.exists(snapshot_name):
+            self.snapshot = PriceSnapshot(snapshot_name)
+            self.stock_prices = PriceStore.from_snapshot(self.snapshot)
+            self.ipo_schedule = IpoSchedule.from_snapshot(self.snapshot)
+        else:
+            self.snapshot = None
+            self.stock_prices = PriceStore.from_rows(self.storage.load_prices())
+            self.ipo_schedule = IpoSchedule.from_rows(self.storage.load_quantity_schedule())
 
         # Fills the stock_dict with the current quantity
-        for row in all_rows:
+        for row in self.storage.load_quantities():
             stock_name = row[0]
             stock_qty = row[1]
             self.stocks[stock_name] = stock_qty
 
-        # Finally closes the connection
-        db_connection.close()
+        super().__init__(group,name,port,registration_port,runtime=runtime)
 
         # For Debugging purposes
         #for stock, qty in stock_dict.items():
@@ -109,15 +107,35 @@ class Exchange(Node.Node):
         print(self.name, " ready!")
 
     # Initialization Code
+    def inject_latency(self):
+        """ Sleeps for kInjectedLatency seconds to simulate a slow network.
+        Does nothing unless latency injection was turned on. """
+        if self.kInjectedLatency > 0:
+            time.sleep(self.kInjectedLatency)
+
     def add_stocks(self, stocks):
         """ Adds the given stocks to the stocks dict for this exchange
         Any adding of stocks to the exchange should pass through this method"""
         for symbol, qty in stocks.items():
-            if symbol in self.stocks:
-                self.stocks[symbol] += qty
-                self.update_quantity(symbol, qty)
-            else:
-                self.stocks[symbol] = qty
+            self.update_quantity(symbol, qty)
+
+    def update_quantity(self, stock_name, change_in_quantity):
+        """ Applies a change to the in-memory book and journals the new quantity.
+        Overrides the Node version, which wrote to the database on every call. """
+        self.stocks[stock_name] = self.stocks.get(stock_name, 0) + change_in_quantity
+        self.inventory.record(stock_name, self.stocks[stock_name])
+
+    def update_quantities(self, changes):
+        """ Applies a batch of changes to the in-memory book. The journal writes them
+        with the flush at the end of the tick. """
+        for stock_name, change_in_quantity in changes:
+            self.update_quantity(stock_name, change_in_quantity)
+
+    def process_request(self, msg):
+        """ Flushes the inventory journal once per time tick """
+        super().process_request(msg)
+        if msg.get("action") == "TimeUpdate":
+            self.inventory.flush()
 
     # Routing Code
     def process_message(self, msg):
@@ -166,10 +184,7 @@ class Exchange(Node.Node):
     def __send_msg_client(self, msg):
         """ TODO """
         print(msg)
-        s = socket.socket()
-        s.connect(("localhost", msg["dest"]))
-        s.send(json.dumps(msg).encode('ascii'))
-        s.close()
+        self.send_to_port("localhost", msg["dest"], json.dumps(msg).encode('ascii'))
 
     def __create_msg_client(self, client_port):
         msg = {}
@@ -210,7 +225,7 @@ class Exchange(Node.Node):
 
     def receive_buy_order(self, requested_fund_name, requested_qty):
         """ Send reservation requests to each exchange as needed. """
-        time.sleep(1)
+        self.inject_latency()
         print(self.name, " received buy order for ", requested_qty, " ",requested_fund_name)
         if requested_fund_name not in self.mutual_funds:
             print("Invalid mutual fund!")
@@ -221,6 +236,8 @@ class Exchange(Node.Node):
         order = {} # Dict of exchange:reservation_number
         self.orders.append(order)
         order_number = len(self.orders) - 1
+        # Set timer for receive reservation timeout before any response can arrive
+        self.__set_order_timer(order_number)
         for mutual_fund_name, exchanges_dict in self.mutual_funds.items():
             if mutual_fund_name == requested_fund_name:
                 for exchange, stocks_dict in exchanges_dict.items():
@@ -234,8 +251,6 @@ class Exchange(Node.Node):
                         buy_msg = self.__create_buy_message(order_number, exchange, stocks_dict)
                         self.send_message(buy_msg) # Hand off message to Node class
                         order[exchange] = None
-                # Set timer for receive reservation timeout
-                Timer(self.kReservationTimeout, self.__abort_valid_reservations, [order_number]).start()
                 return order_number
 
     def __create_buy_message(self, order_number, exchange, stocks_dict):
@@ -260,14 +275,26 @@ class Exchange(Node.Node):
             elif all(not (v == self.kReservationFailed or v is None) 
                      for v in order_dict.values()):
                 # Set timer for receive precommit acks
+                self.__set_order_timer(order_number)
                 self.__send_precommit_messages(order_number)
-                Timer(self.kReservationTimeout, self.__abort_valid_reservations, [order_number]).start()
         except IndexError:
             print("Trying to process response for invalid order number: ", order_number)
         except KeyError:
             print("Order ", order_number, " does not contain entry for ", origin)
         
+    def __set_order_timer(self, order_number):
+        """ Replaces the timeout of the current 3PC phase of an order """
+        self.__clear_order_timer(order_number)
+        self.order_timers[order_number] = self.schedule(self.kReservationTimeout,
+                                                        self.__abort_valid_reservations, order_number)
+
+    def __clear_order_timer(self, order_number):
+        timer_id = self.order_timers.pop(order_number, None)
+        if timer_id is not None:
+            self.cancel_timer(timer_id)
+
     def __abort_valid_reservations(self, order_number):
+        self.__clear_order_timer(order_number)
         try:
             order_dict = self.orders[order_number]
             valid_reservations_dict = {
@@ -345,6 +372,7 @@ class Exchange(Node.Node):
         try:
             self.precommit_acks[order_number].append(reservation_number)
             if len(self.precommit_acks[order_number]) == len(self.orders[order_number]):
+                self.__clear_order_timer(order_number)
                 self.__send_commit_messages(order_number)
                 del self.precommit_acks[order_number]
                 self.report_order_success(order_number)
@@ -377,7 +405,7 @@ class Exchange(Node.Node):
         """ Try to reserve each stock in the given stock dict.
         If we can't reserve any single stock, then fail the whole reservation.
         Returns a reservation number corresponding to the reserved stocks. """
-        time.sleep(1)
+        self.inject_latency()
         print(self.name, " received a request to reserve: ", stocks_dict)
         print("Available stocks:\n", self.stocks)
         reservation = {}
@@ -388,8 +416,7 @@ class Exchange(Node.Node):
             for symbol, qty in stocks_dict.items():
                 if not order_failed and self.stocks[symbol] >= qty:
                     reservation[symbol] = qty
-                    self.stocks[symbol] -= qty
-                    self.update_quantity(symbol, qty)
+                    self.update_quantity(symbol, -qty)
                 else:
                     order_failed = True
                     break
@@ -398,7 +425,6 @@ class Exchange(Node.Node):
             if order_failed:
                 for symbol, qty in reservation.items():
                     if symbol != "status":
-                        self.stocks[symbol] += qty
                         self.update_quantity(symbol, qty)
                 return self.kReservationFailed # -1
             else:
@@ -406,7 +432,8 @@ class Exchange(Node.Node):
                 self.reservations.append(reservation)
                 # Set up timer to unreserve the stocks
                 reservation_number = len(self.reservations) - 1
-                Timer(self.kReservationTimeout, self.__timeout_reservation, [reservation_number]).start()
+                self.reservation_timers[reservation_number] = self.schedule(
+                    self.kReservationTimeout, self.__timeout_reservation, reservation_number)
                 return reservation_number
         except KeyError as e:
             print("Missing stock: ", e, "\nStocks:\n",self.stocks)
@@ -422,11 +449,13 @@ class Exchange(Node.Node):
     def precommit_reservation(self, reservation_number):
         """ Put the given reservation into the precommit state. If the reservation times out,
         then it will be executed instead of being cancelled."""
-        time.sleep(1)
+        self.inject_latency()
         print(self.name, "receiving precommit for reservation: ", reservation_number)
         try:
             if self.reservations[reservation_number][self.kReservationStatus] == self.kReserved:
                 self.reservations[reservation_number][self.kReservationStatus] = self.kPreCommit
+                # The book must be on disk before the precommit is
+                self.inventory.flush()
                 return self.__add_to_database(reservation_number)
             else:
                 print("Tried to precommit a reservation that was not reserved first!")
@@ -439,16 +468,8 @@ class Exchange(Node.Node):
         """ Add the precommitted reservation to the database, so it can still be executed
         in case this server goes down and needs to be recovered."""
         try:
-            conn = sqlite3.connect('data/exchange.db')
-            cursor = conn.cursor()
-            # Prepare statement to avoid sql injection
             # SQL table will contain reservation number, and JSON string to rehydrate dict from
-            sql_command = "INSERT INTO preCommit VALUES (?,?)"
-            cursor.execute(sql_command,
-                [reservation_number,
-                 self.reservations[reservation_number],])
-            conn.commit()
-            conn.close()
+            self.storage.add_precommit(reservation_number, self.reservations[reservation_number])
             return 0
         except sqlite3.Error as e:
             print("SQL ERROR: ",e)
@@ -467,7 +488,7 @@ class Exchange(Node.Node):
     def execute_reservation(self, reservation_number):
         """ We need to define what executing a reservation actually does in terms of data,
         since we don't actually ask the trader for money."""
-        time.sleep(1)
+        self.inject_latency()
         print(self.name, " executing reservation number: ", reservation_number)
         try:
             reservation_status = self.reservations[reservation_number][self.kReservationStatus]
@@ -482,6 +503,7 @@ class Exchange(Node.Node):
                 return 4
             elif reservation_status == self.kPreCommit:
                 self.reservations[reservation_number][self.kReservationStatus] = self.kCommitted
+                self.__clear_reservation_timer(reservation_number)
                 return 0
             else:
                 print("Error: unknown status code in reservation: ", reservation_status)
@@ -517,17 +539,23 @@ class Exchange(Node.Node):
         """ Should never be called by anything other than cancel_reservation"""
         try:
             self.reservations[reservation_number][self.kReservationStatus] = self.kCancelled
+            self.__clear_reservation_timer(reservation_number)
             print("Res dict:\n",self.reservations[reservation_number])
             for symbol, qty in self.reservations[reservation_number].items():
                 if symbol != "status":
-                    self.stocks[symbol] += qty
                     self.update_quantity(symbol, qty)
         except IndexError:
             print("Invalid Reservation Number: ", reservation_number)
         
+    def __clear_reservation_timer(self, reservation_number):
+        timer_id = self.reservation_timers.pop(reservation_number, None)
+        if timer_id is not None:
+            self.cancel_timer(timer_id)
+
     def __timeout_reservation(self, reservation_number):
         """ Handles timeout behavior for the given reservation. What is done depends
         on the phase of the Three Phase Commit protocol the transaction is on."""
+        self.reservation_timers.pop(reservation_number, None)
         try:
             #Will behave differently based on the phase of 3pc we're currently in
             reservation_status = self.reservations[reservation_number][self.kReservationStatus]
@@ -545,5 +573,10 @@ if __name__ == "__main__":
     group = int(sys.argv[1])
     name = sys.argv[2]
     port = int(sys.argv[3])
-    reg_port = int(sys.argv[4])
-    Exchange(group,name,port,reg_port)
+    # The registration server's port, or the comma-separated ports of its replicas
+    reg_port = [int(port) for port in sys.argv[4].split(",")]
+    # Optional fifth argument selects the node runtime, e.g. "asyncio"
+    runtime = sys.argv[5] if len(sys.argv) > 5 else None
+    # Optional sixth argument injects latency in seconds before each 3PC step
+    injected_latency = float(sys.argv[6]) if len(sys.argv) > 6 else None
+    Exchange(group,name,port,reg_port,runtime=runtime,injected_latency=injected_latency)
@@ -0,0 +1,64 @@
+import sys
+from failureDetector import FailureDetector
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def main():
+    detector = FailureDetector(interval=1.0, threshold=3.0)
+
+    print(TXT_CLR, "Testing members never heard from are not alive...", NO_CLR)
+    test_assert_equal(False, detector.is_alive(12351, now=0))
+    test_assert_equal(None, detector.phi(12351, now=0))
+
+    print(TXT_CLR, "Testing a member beating on time stays alive...", NO_CLR)
+    for beat in range(10):
+        detector.heartbeat(12351, now=beat)
+    test_assert_equal(True, detector.is_alive(12351, now=10))
+    test_assert_equal(True, detector.is_alive(12351, now=15))
+
+    print(TXT_CLR, "Testing a silent member is suspected after about 7 intervals...", NO_CLR)
+    test_assert_equal(False, detector.is_alive(12351, now=16))
+
+    print(TXT_CLR, "Testing suspicion scales with the member's own interval...", NO_CLR)
+    for beat in range(10):
+        detector.heartbeat(12352, now=beat * 5)
+    test_assert_equal(True, detector.is_alive(12352, now=45 + 16))
+    test_assert_equal(False, detector.is_alive(12352, now=45 + 40))
+
+    print(TXT_CLR, "Testing a burst of heartbeats does not shrink the mean below the floor...", NO_CLR)
+    for beat in range(50):
+        detector.heartbeat(12353, now=beat * 0.01)
+    test_assert_equal(True, detector.is_alive(12353, now=0.5 + 3))
+
+    print(TXT_CLR, "Testing only a member that kept up heartbeats is suspected once silent...", NO_CLR)
+    test_assert_equal(False, detector.is_suspected(12354, now=0))
+    detector.heartbeat(12354, now=0)
+    test_assert_equal((False, False), (detector.is_alive(12354, now=60), detector.is_suspected(12354, now=60)))
+    detector.heartbeat(12354, now=61)
+    test_assert_equal(False, detector.is_suspected(12354, now=62))
+    test_assert_equal(True, detector.is_suspected(12354, now=200))
+
+    print(TXT_CLR, "Testing a removed member is forgotten...", NO_CLR)
+    detector.remove(12351)
+    test_assert_equal(False, detector.knows(12351))
+
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
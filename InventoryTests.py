@@ -0,0 +1,181 @@
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import sys
+from exchangeStorage import ExchangeStorage
+from inventoryJournal import InventoryJournal
+from testSandbox import make_sandbox, offline_exchange
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+STOCKS = {"AAPL": 50, "MSFT": 75, "AERO": 80}
+DATABASE_NAME = 'data/Test.db'
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def stored_quantities():
+    db_connection = sqlite3.connect(DATABASE_NAME)
+    rows = db_connection.execute('''SELECT * FROM stock_current_quantity_table''').fetchall()
+    db_connection.close()
+    return dict(rows)
+
+
+def reset_table():
+    db_connection = sqlite3.connect(DATABASE_NAME)
+    db_connection.execute('''DROP TRIGGER IF EXISTS fail_msft''')
+    db_connection.execute('''DELETE FROM stock_current_quantity_table''')
+    db_connection.executemany('INSERT INTO stock_current_quantity_table VALUES (?, ?)', STOCKS.items())
+    db_connection.commit()
+    db_connection.close()
+
+
+def test_write_behind():
+    reset_table()
+    journal = InventoryJournal(ExchangeStorage('Test'))
+
+    print(TXT_CLR, "Testing changes are not written before a flush...", NO_CLR)
+    journal.record("AAPL", 40)
+    journal.record("MSFT", 70)
+    test_assert_equal(STOCKS, stored_quantities())
+
+    print(TXT_CLR, "Testing the newest value of a symbol wins...", NO_CLR)
+    journal.record("AAPL", 30)
+    test_assert_equal(2, journal.pending())
+
+    print(TXT_CLR, "Testing all dirty rows are written in a single flush...", NO_CLR)
+    test_assert_equal(2, journal.flush())
+    test_assert_equal(1, journal.flushes)
+    test_assert_equal({"AAPL": 30, "MSFT": 70, "AERO": 80}, stored_quantities())
+
+
+def test_batch_threshold():
+    reset_table()
+    journal = InventoryJournal(ExchangeStorage('Test'), flush_batch=3)
+
+    print(TXT_CLR, "Testing a full batch flushes without waiting for the tick...", NO_CLR)
+    journal.record("AAPL", 1)
+    journal.record("MSFT", 2)
+    test_assert_equal(STOCKS, stored_quantities())
+    journal.record("AERO", 3)
+    test_assert_equal({"AAPL": 1, "MSFT": 2, "AERO": 3}, stored_quantities())
+    test_assert_equal(0, journal.pending())
+
+
+def test_failed_flush_is_atomic():
+    reset_table()
+    journal = InventoryJournal(ExchangeStorage('Test'))
+
+    # Any write of MSFT fails half way through the batch
+    db_connection = sqlite3.connect(DATABASE_NAME)
+    db_connection.execute('''CREATE TRIGGER fail_msft BEFORE INSERT ON stock_current_quantity_table
+                          WHEN NEW.stock_name = 'MSFT' BEGIN SELECT RAISE(ABORT, 'disk full'); END''')
+    db_connection.commit()
+    db_connection.close()
+
+    print(TXT_CLR, "Testing a failed flush writes nothing and keeps the rows dirty...", NO_CLR)
+    journal.record("AAPL", 10)
+    journal.record("MSFT", 20)
+    with contextlib.redirect_stdout(io.StringIO()):
+        test_assert_equal(0, journal.flush())
+    test_assert_equal(STOCKS, stored_quantities())
+    test_assert_equal(2, journal.pending())
+
+    print(TXT_CLR, "Testing a value recorded after the failure is not overwritten by the retry...", NO_CLR)
+    journal.record("AAPL", 5)
+    reset_table()
+    test_assert_equal(2, journal.flush())
+    test_assert_equal({"AAPL": 5, "MSFT": 20, "AERO": 80}, stored_quantities())
+
+
+def test_precommit_flushes_book():
+    reset_table()
+    exchange = offline_exchange('Test', STOCKS)
+    order = {"AAPL": 10, "AERO": 5}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        reservation_number = exchange.reserve_stocks(order)
+
+    print(TXT_CLR, "Testing a reservation updates the in-memory book only...", NO_CLR)
+    test_assert_equal({"AAPL": 40, "MSFT": 75, "AERO": 75}, exchange.stocks)
+    test_assert_equal(STOCKS, stored_quantities())
+
+    print(TXT_CLR, "Testing the book is on disk once the reservation is precommitted...", NO_CLR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        exchange.precommit_reservation(reservation_number)
+    test_assert_equal({"AAPL": 40, "MSFT": 75, "AERO": 75}, stored_quantities())
+
+    print(TXT_CLR, "Testing the precommitted reservation is stored as JSON...", NO_CLR)
+    db_connection = sqlite3.connect('data/exchange.db')
+    row = db_connection.execute('''SELECT * FROM preCommit WHERE reservation_number=?''', [reservation_number]).fetchone()
+    db_connection.close()
+    test_assert_equal(exchange.reservations[reservation_number], json.loads(row[1]))
+
+    print(TXT_CLR, "Testing a cancelled reservation returns its stocks to the book...", NO_CLR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        reservation_number = exchange.reserve_stocks(order)
+        exchange.cancel_reservation(reservation_number)
+    exchange.inventory.flush()
+    test_assert_equal({"AAPL": 40, "MSFT": 75, "AERO": 75}, stored_quantities())
+
+
+def test_time_update_applies_ipos():
+    reset_table()
+    db_connection = sqlite3.connect(DATABASE_NAME)
+    db_connection.execute('''DELETE FROM stock_quantity_table''')
+    db_connection.executemany('INSERT INTO stock_quantity_table VALUES (?, ?, ?, ?)',
+                              [("AAPL", 50, "1/1/2016", "8:00"), ("AAPL", 0, "1/1/2016", "9:00"),
+                               ("AAPL", 7, "1/4/2016", "8:00"), ("AERO", 3, "1/4/2016", "8:00"),
+                               ("MSFT", 5, "1/4/2016", "9:00")])
+    db_connection.commit()
+    db_connection.close()
+    exchange = offline_exchange('Test', STOCKS)
+
+    print(TXT_CLR, "Testing the opening tick is not issued again...", NO_CLR)
+    test_assert_equal({("AAPL", 7), ("AERO", 3)}, set(exchange.ipo_schedule.events_at("1/4/2016", "8:00")))
+    test_assert_equal([], exchange.ipo_schedule.events_at("1/1/2016", "8:00"))
+
+    print(TXT_CLR, "Testing a TimeUpdate in server format issues the tick's stock to the book and table...", NO_CLR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        exchange.process_request({"action": "TimeUpdate", "serverDate": "1/4/2016", "serverTime": "08:00"})
+    test_assert_equal({"AAPL": 57, "MSFT": 75, "AERO": 83}, exchange.stocks)
+    test_assert_equal({"AAPL": 57, "MSFT": 75, "AERO": 83}, stored_quantities())
+    test_assert_equal(1, exchange.tick_stats()["ticks"])
+
+    print(TXT_CLR, "Testing missed ticks are caught up from the schedule...", NO_CLR)
+    reset_table()
+    exchange = offline_exchange('Test', STOCKS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for seq, date, server_time in ((1, "1/1/2016", "16:00"), (4, "1/4/2016", "09:00"), (4, "1/4/2016", "09:00")):
+            exchange.process_request({"action": "TimeUpdate", "serverDate": date, "serverTime": server_time,
+                                      "tickEpoch": 1, "tickSeq": seq})
+    test_assert_equal(2, exchange.missed_ticks)
+    test_assert_equal({"AAPL": 57, "MSFT": 80, "AERO": 83}, exchange.stocks)
+    test_assert_equal(2, exchange.tick_stats()["ticks"])
+
+
+def main():
+    os.chdir(make_sandbox('Test', STOCKS))
+    test_write_behind()
+    test_batch_threshold()
+    test_failed_flush_is_atomic()
+    test_precommit_flushes_book()
+    test_time_update_applies_ipos()
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
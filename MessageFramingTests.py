@@ -0,0 +1,132 @@
+import asyncio
+import io
+import socket
+import sys
+from messageFraming import HEADER, MAX_FRAME_SIZE, FrameDecoder, FrameError, encode_frame, read_frame, \
+    read_frame_async, recv_frame, send_frame
+from threading import Thread
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def raises_frame_error(read, *args):
+    """Returns True if read(*args) raises FrameError"""
+    try:
+        read(*args)
+    except FrameError:
+        return True
+    return False
+
+
+def read_async(data):
+    """Runs read_frame_async over a stream holding data, then end of stream"""
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_frame_async(reader)
+    return asyncio.run(read())
+
+
+def test_decoder():
+    print(TXT_CLR, "Testing a frame fed a byte at a time is decoded once complete...", NO_CLR)
+    decoder = FrameDecoder()
+    frame = encode_frame('{"action": "Query"}')
+    frames = [decoder.feed(frame[i:i + 1]) for i in range(len(frame))]
+    test_assert_equal([[]] * (len(frame) - 1), frames[:-1])
+    test_assert_equal([b'{"action": "Query"}'], frames[-1])
+    test_assert_equal(0, decoder.pending())
+
+    print(TXT_CLR, "Testing several frames in one buffer are all decoded...", NO_CLR)
+    data = encode_frame(b"first") + encode_frame(b"") + encode_frame(b"third") + encode_frame(b"fourth")[:6]
+    test_assert_equal([b"first", b"", b"third"], decoder.feed(data))
+    test_assert_equal(6, decoder.pending())
+    test_assert_equal([b"fourth"], decoder.feed(encode_frame(b"fourth")[6:]))
+
+    print(TXT_CLR, "Testing a header over the maximum size is rejected...", NO_CLR)
+    test_assert_equal(True, raises_frame_error(FrameDecoder().feed, HEADER.pack(MAX_FRAME_SIZE + 1)))
+    test_assert_equal(True, raises_frame_error(encode_frame, bytes(MAX_FRAME_SIZE + 1)))
+
+
+def test_socket():
+    print(TXT_CLR, "Testing a frame split across recv() calls is received whole...", NO_CLR)
+    sender, receiver = socket.socketpair()
+    frame = encode_frame(b"x" * 100000)
+
+    def send_in_pieces():
+        for i in range(0, len(frame), 7000):
+            sender.sendall(frame[i:i + 7000])
+    thread = Thread(target=send_in_pieces)
+    thread.start()
+    test_assert_equal(b"x" * 100000, recv_frame(receiver))
+    thread.join()
+
+    print(TXT_CLR, "Testing frames sent back to back are received one at a time...", NO_CLR)
+    send_frame(sender, "one")
+    send_frame(sender, b"two")
+    test_assert_equal([b"one", b"two"], [recv_frame(receiver), recv_frame(receiver)])
+
+    print(TXT_CLR, "Testing a clean end of stream is not an error...", NO_CLR)
+    sender.close()
+    test_assert_equal(None, recv_frame(receiver))
+    receiver.close()
+
+    print(TXT_CLR, "Testing end of stream mid-header or mid-body is an error...", NO_CLR)
+    for cut in (2, -3):
+        sender, receiver = socket.socketpair()
+        sender.sendall(encode_frame(b"cut short")[:cut])
+        sender.close()
+        test_assert_equal(True, raises_frame_error(recv_frame, receiver))
+        receiver.close()
+
+    print(TXT_CLR, "Testing a header over the maximum size is rejected before its body...", NO_CLR)
+    sender, receiver = socket.socketpair()
+    sender.sendall(HEADER.pack(MAX_FRAME_SIZE + 1))
+    test_assert_equal(True, raises_frame_error(recv_frame, receiver))
+    sender.close()
+    receiver.close()
+
+
+def test_streams():
+    print(TXT_CLR, "Testing read_frame reads several frames from one stream...", NO_CLR)
+    stream = io.BytesIO(encode_frame(b"one") + encode_frame(b"two"))
+    test_assert_equal([b"one", b"two", None], [read_frame(stream), read_frame(stream), read_frame(stream)])
+
+    print(TXT_CLR, "Testing read_frame tells a clean end of stream from a cut frame...", NO_CLR)
+    frame = encode_frame(b"cut short")
+    test_assert_equal(None, read_frame(io.BytesIO(b"")))
+    test_assert_equal(True, raises_frame_error(read_frame, io.BytesIO(frame[:2])))
+    test_assert_equal(True, raises_frame_error(read_frame, io.BytesIO(frame[:-3])))
+    test_assert_equal(True, raises_frame_error(read_frame, io.BytesIO(HEADER.pack(MAX_FRAME_SIZE + 1))))
+
+    print(TXT_CLR, "Testing read_frame_async does the same on an asyncio stream...", NO_CLR)
+    test_assert_equal(b"whole", read_async(encode_frame(b"whole")))
+    test_assert_equal(None, read_async(b""))
+    test_assert_equal(True, raises_frame_error(read_async, frame[:2]))
+    test_assert_equal(True, raises_frame_error(read_async, frame[:-3]))
+    test_assert_equal(True, raises_frame_error(read_async, HEADER.pack(MAX_FRAME_SIZE + 1)))
+
+
+def main():
+    test_decoder()
+    test_socket()
+    test_streams()
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+from Node import MessageWindow, Node
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def route(orig, msg_num, incarnation):
+    return {"action": "Route", "orig": orig, "dest": "NYSE", "msgNum": msg_num, "incarnation": incarnation}
+
+
+def test_window():
+    print(TXT_CLR, "Testing numbers out of order inside the window are accepted once...", NO_CLR)
+    window = MessageWindow(8)
+    test_assert_equal([True] * 5, [window.check_and_add(msg_num) for msg_num in (3, 1, 5, 2, 4)])
+    test_assert_equal([False] * 5, [window.check_and_add(msg_num) for msg_num in (1, 2, 3, 4, 5)])
+    test_assert_equal((5, 0), (window.watermark, window.bitmap))
+
+    print(TXT_CLR, "Testing a gap stays open until it is filled...", NO_CLR)
+    test_assert_equal(True, window.check_and_add(7))
+    test_assert_equal(5, window.watermark)
+    test_assert_equal(True, window.check_and_add(6))
+    test_assert_equal(7, window.watermark)
+
+    print(TXT_CLR, "Testing a jump past the window slides the watermark...", NO_CLR)
+    test_assert_equal(True, window.check_and_add(9))
+    test_assert_equal(True, window.check_and_add(20))
+    # 20 is the newest of a window of 8, so everything up to 12 is behind the watermark
+    test_assert_equal(12, window.watermark)
+    test_assert_equal(False, window.check_and_add(20))
+
+    print(TXT_CLR, "Testing a number that fell behind the window is dropped though never seen...", NO_CLR)
+    test_assert_equal(False, window.check_and_add(8))
+    test_assert_equal(False, window.check_and_add(12))
+    test_assert_equal(True, window.check_and_add(13))
+
+
+def test_check_message():
+    node = Node.__new__(Node)
+    node.dedup_window = 8
+    node.msg_dict = {}
+    node.dedup_hits = 0
+    node.dedup_misses = 0
+
+    print(TXT_CLR, "Testing a repeated Route message is dropped...", NO_CLR)
+    test_assert_equal([True, True, False], [node.check_message(route("Euronext", msg_num, 100))
+                                            for msg_num in (1, 2, 1)])
+
+    print(TXT_CLR, "Testing a restarted origin numbering from 1 again is not taken for duplicates...", NO_CLR)
+    test_assert_equal([True, True], [node.check_message(route("Euronext", msg_num, 200)) for msg_num in (1, 2)])
+    test_assert_equal(False, node.check_message(route("Euronext", 2, 200)))
+
+    print(TXT_CLR, "Testing messages from before the restart are dropped...", NO_CLR)
+    test_assert_equal(False, node.check_message(route("Euronext", 3, 100)))
+
+    print(TXT_CLR, "Testing origins are tracked apart...", NO_CLR)
+    test_assert_equal(True, node.check_message(route("NYSE", 1, 100)))
+    test_assert_equal((3, 5), (node.dedup_hits, node.dedup_misses))
+
+    print(TXT_CLR, "Testing client messages without a number are always delivered...", NO_CLR)
+    test_assert_equal([True, True], [node.check_message({"action": "Route", "orig": "Client"}) for i in range(2)])
+    test_assert_equal(False, node.check_message({"action": "Route", "msgNum": 1}))
+
+
+def main():
+    test_window()
+    test_check_message()
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
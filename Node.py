@@ -1,15 +1,16 @@
-import copy
 import json
-import socket
 import socketserver
 import sys
 import time
-from collections import deque
-from paxos import PaxosNode
+from asyncRuntime import AsyncRuntime
+from connectionPool import ConnectionPool, FanOut
+from failureDetector import FailureDetector
+from messageFraming import FrameError, read_frame
+from data.priceSnapshot import tick_key
+from paxos import PAXOS_DIRECT, PaxosNode, ballot, proposal_round
 from queue import Queue
+from scheduler import Scheduler
 from threading import Thread
-import sqlite3
-from sqlite3 import Error
 
 # Constants
 GROUP_ASIA = 0
@@ -26,46 +27,138 @@ class MessageHandler(socketserver.StreamRequestHandler):
     """
     def handle(self):
         q = self.server.request_queue
-        msg = self.rfile.read().decode()
-        if len(msg) == 0:
-            return
-        try:
-            msg = json.loads(msg)
-        except json.JSONDecodeError:
-            #print("Message not sent in JSON format.")
-            #print(msg)
-            return
-        # #print(msg)
-        q.put(msg)
+        # A sender may keep the connection open and send several framed messages
+        while True:
+            try:
+                msg = read_frame(self.rfile)
+            except (FrameError, ConnectionError):
+                return
+            if msg is None:
+                return
+            try:
+                msg = json.loads(msg.decode())
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                #print("Message not sent in JSON format.")
+                #print(msg)
+                continue
+            # #print(msg)
+            if msg.get("action") in PAXOS_DIRECT:
+                # The processing thread may be the proposer waiting for this reply
+                self.server.node.receive_paxos(msg)
+            else:
+                q.put(msg)
+
+class MessageWindow():
+    """
+    Duplicate detector for the message numbers of a single origin.
+
+    Every number up to the watermark has been seen. Numbers above it are
+    tracked in a bitmap of window bits, so lookups take constant time and
+    memory stays bounded. A number that arrives more than window places
+    ahead slides the window forward, and anything that falls behind the
+    watermark is treated as a duplicate.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.watermark = 0
+        self.bitmap = 0
+
+    def check_and_add(self, msg_num):
+        """
+        Returns True the first time msg_num is seen, False for a duplicate
+        """
+        if msg_num <= self.watermark:
+            return False
+        offset = msg_num - self.watermark - 1
+        if offset >= self.window:
+            shift = offset - self.window + 1
+            self.bitmap >>= shift
+            self.watermark += shift
+            offset = self.window - 1
+        if self.bitmap >> offset & 1:
+            return False
+        self.bitmap |= 1 << offset
+        # Fold the contiguous run at the bottom of the bitmap into the watermark
+        while self.bitmap & 1:
+            self.bitmap >>= 1
+            self.watermark += 1
+        return True
+
 
 class Node(PaxosNode):
     '''
     Peer-to-peer structure including peer and superpeer functions, superpeer election
     and backup system through central server.
     '''
-    def __init__(self, group, name, port, registration_port, handler=MessageHandler):
+    # Number of message numbers per origin tracked above the dedup watermark
+    dedup_window = 1024
+    # Children per node in the time update broadcast tree
+    time_fanout = 4
+    # Seconds a node waits for its children to take a time update before forwarding their subtrees itself
+    hop_deadline = 0.5
+
+    def __init__(self, group, name, port, registration_port, handler=MessageHandler, runtime=None):
         PaxosNode.__init__(self)
         # General attributes
         self.group = group
         self.name = name
         self.port = port
-        self.registration_port = registration_port
+        # Replicas of the registration server, tried in turn from the last that answered
+        if isinstance(registration_port, (list, tuple)):
+            self.registration_ports = list(registration_port)
+        else:
+            self.registration_ports = [registration_port]
+        self.registration_port = self.registration_ports[0]
+        # Exchanges open their storage and schedule before the node starts, and plain nodes have none
+        if not hasattr(self, "storage"):
+            self.storage = None
+        if not hasattr(self, "ipo_schedule"):
+            self.ipo_schedule = None
 
         self.isSuper = False
         self.node_time = None
+        # Position in the registration server's tick sequence
+        self.tick_epoch = None
+        self.tick_seq = None
+        self.tick = None
+        self.missed_ticks = 0
         self.request_queue = Queue()
+        self.connection_pool = ConnectionPool()
+        self.fan_out = FanOut(self.connection_pool)
+        # Timeouts run on the processing thread, dispatched through request_queue
+        self.scheduler = Scheduler(self.dispatch_timer)
+        # Liveness of the superpeer, fed by its heartbeats
+        self.failure_detector = FailureDetector(self.heartbeat_interval)
+        self.schedule(self.heartbeat_interval, self.watch_superpeer)
 
         # Peer attributes
         self.peer_num = None
         self.superpeer = None
         self.election = False
+        self.failover_time = None
         self.peer_list = {}
         self.msg_num = 0
+        # Restarted nodes number their messages from 1 again, so windows are per incarnation
+        self.incarnation = int(time.time() * 1000)
         self.msg_dict = {}
+        self.dedup_hits = 0
+        self.dedup_misses = 0
 
         # Superpeer attributes
         self.superpeer_list = {}
+        # [epoch, version] of the registration server's super peer table last queried
+        self.superpeer_version = None
         self.max_peer_num = None
+        # Routing index of peer name to the superpeer of its group
+        self.route_index = {}
+
+        # The asyncio runtime replaces the per-connection threads and the process thread
+        if runtime == "asyncio":
+            self.runtime = AsyncRuntime(self)
+            self.request_queue = self.runtime.inbox
+            self.runtime.start()
+            return
+        self.runtime = None
 
         msg_receiver = socketserver.ThreadingTCPServer(("localhost", port), handler)
         msg_receiver.request_queue = self.request_queue
@@ -79,23 +172,54 @@ class Node(PaxosNode):
     def set_superpeer(self):
         self.isSuper = True
         self.max_peer_num = 0
-        while not self.query_superpeers("localhost", self.registration_port):
+        while not self.query_superpeers():
             time.sleep(5)
         self.send_to_list("superpeer", self.msg_superpeerlist())
         if self.name in self.peer_list:
             del self.peer_list[self.name]
         self.send_to_list("peer", "registerOK")
         self.send_to_list("peer", self.msg_peerlist())
+        self.send_to_list("superpeer", self.msg_members())
+        self.send_heartbeat()
 
-    # Query registration server for Superpeer information.
-    def query_superpeers(self, address, port):
-        msg = self.send_to_port(address, port, self.msg_query(), need_reply=True)
+    def send_heartbeat(self):
+        """
+        Tell the registration server and every peer that this superpeer is
+        alive, and schedule the next heartbeat. For peers the heartbeat also
+        renews the lease: the ballot that won the election is reused, so no
+        Prepare is needed while the superpeer lives.
+        """
+        if not self.isSuper:
+            return
+        if self.last_proposal is None:
+            # Appointed by the registration server rather than elected
+            self.last_proposal = (self.election_num, self.peer_num or 0)
+        heartbeat = self.msg_heartbeat()
+        # Every replica of the registration server tracks the superpeer's liveness
+        for port in self.registration_ports:
+            self.send_to_port("localhost", port, heartbeat, timeout=1)
+        if self.multi_paxos:
+            self.send_to_list("peer", heartbeat)
+        self.heartbeat_timer = self.schedule(self.heartbeat_interval, self.send_heartbeat)
+
+    # Query registration server for Superpeer information. Without a port, any of its replicas answers.
+    def query_superpeers(self, address="localhost", port=None):
+        if port is None:
+            msg = self.send_to_registration(self.msg_query(), need_reply=True)
+        else:
+            msg = self.send_to_port(address, port, self.msg_query(), need_reply=True)
         if msg:
-            for superpeer in msg["superPeers"]:
+            # Unless notModified, the reply holds the full table or, if delta, the super peers that changed
+            for superpeer in msg.get("superPeers", []):
+                # A group has one superpeer, so a new one replaces the old
+                for name, known in list(self.superpeer_list.items()):
+                    if known.get("group") == superpeer["group"] and name != superpeer["name"]:
+                        del self.superpeer_list[name]
                 if superpeer["portNum"] != -1:
                     self.superpeer_list[superpeer["name"]] = superpeer
                 if superpeer["group"] == self.group:
                     self.election_num = superpeer["elecNum"]
+            self.superpeer_version = msg.get("version")
             # #print(self.superpeer_list)
             #print("Query to registration server complete.")
             return True
@@ -106,7 +230,7 @@ class Node(PaxosNode):
     # Peer functions
     def register(self):
         while True:
-            msg = self.send_to_port("localhost", self.registration_port, self.msg_register(), need_reply=True, timeout=10)
+            msg = self.send_to_registration(self.msg_register(), need_reply=True, timeout=10)
             if msg is None:
                 print("Connection to registration server failed. Retrying...")
             else:
@@ -120,142 +244,248 @@ class Node(PaxosNode):
         else:
             print("Connection to registration server failed.")
 
-    def connect(self, address, port, timeout=5):
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(timeout)
-            # #print((address,port))
-            s.connect((address, port))
-            # #print("Connection established.")
-            return s
-        except socket.timeout:
-            print("Connect: Connection timeout.")
-        except ConnectionRefusedError:
-            return None
+    def send_to_registration(self, msg, need_reply=False, timeout=5):
+        """
+        Send to the registration server, failing over to its next replica
+        until one answers. Returns as send_to_port.
+        """
+        for i in range(len(self.registration_ports)):
+            reply = self.send_to_port("localhost", self.registration_port, msg, need_reply, timeout)
+            if reply is not None:
+                return reply
+            index = self.registration_ports.index(self.registration_port)
+            self.registration_port = self.registration_ports[(index + 1) % len(self.registration_ports)]
+        return None
 
     def send_to_port(self, address, port, msg, need_reply=False, timeout=5, retries=1):
         reply = None
-        fails = 0
         for i in range(retries):
-            soc = self.connect(address, port, timeout)
-            if soc:
-                try:
-                    soc.send(msg)
-                    if need_reply:
-                        reply = json.loads(soc.recv(1024).decode())
-                    else:
-                        reply = True
-                    soc.close()
-                    break
-                except socket.timeout:
-                    fails += 1
-                    #print("Send_to_port: Connection timeout.")
+            if self.runtime:
+                reply = self.runtime.send_to_port(address, port, msg, need_reply, timeout)
             else:
-                fails += 1
-        if fails == retries:
+                reply = self.connection_pool.send(address, port, msg, need_reply, timeout)
+            if reply is not None:
+                break
+            #print("Send_to_port: Connection failed.")
+        if reply is None:
             return None
+        if need_reply:
+            try:
+                return json.loads(reply.decode())
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                return None
         return reply
 
-    def send_to_list(self, list_type, msg, timeout=5, retries=1):
+    def send_to_list(self, list_type, msg, timeout=5, retries=1, update_on_failure=True):
+        """
+        Broadcast to every peer or superpeer concurrently. Unreachable members
+        are removed in one batch and the updated list is broadcast once.
+        """
         new_list = self.peer_list if list_type == "peer" else self.superpeer_list
-        old_list = copy.deepcopy(new_list)
+        targets = []
         for name in list(new_list.keys()):
             if name == self.name:
                 continue
-            fails = 0
-            soc = None
-            for i in range(retries):
-                try:
-                    soc = self.connect("localhost", new_list[name]["portNum"], timeout)
-                except KeyError:
-                    break
-                if soc:
-                    try:
-                        if msg == "registerOK":
-                            msg = self.msg_registerOK(name, new_list[name]["portNum"])
-                        soc.send(msg)
-                        soc.close()
-                        break
-                    except socket.timeout:
-                        fails += 1
-                        #print("Send_to_list: Connection timeout.")
-                else:
-                    fails += 1
-            if fails == retries:
-                new_list.pop(name, None)
-        if new_list != old_list:
+            try:
+                port = new_list[name]["portNum"]
+            except KeyError:
+                continue
+            payload = self.msg_registerOK(name, port) if msg == "registerOK" else msg
+            targets.append((name, port, payload))
+        if self.runtime:
+            # Failures come back later as a single SendFailed message
+            self.runtime.send_to_many(list_type, targets, timeout)
+            return
+        failed = self.fan_out.send_to_many(targets, timeout)
+        for i in range(retries - 1):
+            if not failed:
+                break
+            failed = self.fan_out.send_to_many([t for t in targets if t[0] in failed], timeout)
+        self.remove_unreachable(list_type, failed, update_on_failure)
+
+    def remove_unreachable(self, list_type, names, rebroadcast=True):
+        """
+        Drop unreachable members from a list and tell the remaining members once
+        """
+        new_list = self.peer_list if list_type == "peer" else self.superpeer_list
+        removed = [name for name in names if new_list.pop(name, None) is not None]
+        if removed and rebroadcast:
             newlist = self.msg_peerlist() if list_type == "peer" else self.msg_superpeerlist()
-            self.send_to_list(list_type, newlist)
+            self.send_to_list(list_type, newlist, update_on_failure=False)
+            if list_type == "peer" and self.isSuper:
+                self.send_to_list("superpeer", self.msg_members(), update_on_failure=False)
 
-    def send_message(self, msg):
+    def send_message(self, msg, retry_deadline=None):
         """
-        Send JSON message to destination based on the role of node
+        Send JSON message to destination based on the role of node. A peer
+        whose superpeer holds the lease but cannot be sent to retries from a
+        timer until retry_deadline, one lease after the first failure.
         """
         dest = msg["dest"]
         msg_json = json.dumps(msg).encode()
         if self.isSuper:
             if dest in self.peer_list:
                 #print("Sending message to peer.")
-                self.send_to_port("localhost", self.peer_list[dest]["port"], msg_json)
+                self.send_to_port("localhost", self.peer_list[dest]["portNum"], msg_json)
             else:
                 #print("Routing message to other superpeers.")
-                self.send_to_list("superpeer", msg_json)
+                self.route_to_superpeers(msg)
         else:
             if self.superpeer:
-                success = self.send_to_port("localhost", self.superpeer, msg_json)
-                if not success:
-                    print("Superpeer cannot be contacted. Election starts.")
-                    self.superpeer = None
-                    self.elect_superpeer()
-                    self.send_message(msg)
-                else:
+                if self.send_to_port("localhost", self.superpeer, msg_json):
                     print("Message sent.")
+                    return
+                if retry_deadline is None:
+                    retry_deadline = time.monotonic() + self.lease_duration
+                if self.lease_holds() and time.monotonic() < retry_deadline:
+                    # The superpeer heartbeated recently, so the failure is transient
+                    self.schedule(self.heartbeat_interval, self.send_message, msg, retry_deadline)
+                    return
+                print("Superpeer cannot be contacted. Election starts.")
+                self.superpeer = None
+                self.elect_superpeer()
+                self.send_message(msg)
             else:
                 print("No current superpeer. Election starts.")
                 self.elect_superpeer()
                 self.send_message(msg)
 
+    def route_to_superpeers(self, msg):
+        """
+        Forward a Route message to the superpeer whose group contains the
+        destination. Falls back to flooding every superpeer not yet on the
+        path when the routing index has no entry for the destination.
+        """
+        dest = msg["dest"]
+        visited = set(hop.replace(" (Super)", "") for hop in msg["path"].split("/"))
+        msg_json = json.dumps(msg).encode()
+        target = dest if dest in self.superpeer_list else self.route_index.get(dest)
+        if target in self.superpeer_list and target != self.name and target not in visited:
+            #print("\tRouting message to ", target)
+            self.send_to_port("localhost", self.superpeer_list[target]["portNum"], msg_json)
+            return
+        for superpeer in list(self.superpeer_list):
+            if superpeer != self.name and superpeer not in visited:
+                #print("\tFlooding message to ", superpeer)
+                self.send_to_port("localhost", self.superpeer_list[superpeer]["portNum"], msg_json)
+
+    def update_route_index(self, superpeer, members):
+        """
+        Replace the routing entries of one superpeer with its current members
+        """
+        self.route_index = {name: owner for name, owner in self.route_index.items() if owner != superpeer}
+        for name in members:
+            self.route_index[name] = superpeer
+
     def elect_superpeer(self):
         """
-        Paxos to elect new superpeer among peers
+        Paxos to elect new superpeer among peers. Each phase ends as soon as
+        a quorum replies. A proposal rejected by a competing proposer is
+        retried after a randomized backoff, unless the competitor has
+        already reached its accept phase.
         """
         self.election = True
-        self.responses = []
-        # print("\tSend prepare to all peers.")        
-        self.isReceiving = True
-        self.send_to_list("peer", self.msg_prepare())
+        started = time.monotonic()
+        for attempt in range(self.election_attempts):
+            if attempt:
+                self.backoff(attempt)
+            if self.run_election() is not None:
+                # Either way the election has ended, so its value is not carried over
+                self.settled_round = max(self.settled_round, self.election_num)
+                break
+        self.failover_time = time.monotonic() - started
+        self.election = False
+
+    def run_election(self):
+        """
+        One Paxos attempt. Returns True when this node won, False when the
+        election ended, and None when a competing proposal should be retried.
+        """
+        # The proposer is one of the acceptors and answers itself over its own port
+        members = len(set(self.peer_list) | {self.name})
+        needed = members//2 + 1
+        # print("\tSend prepare to all peers.")
+        self.start_phase()
+        prepare = self.msg_prepare()
+        self.send_to_list("peer", prepare)
+        self.process_paxos(json.loads(prepare.decode()))
         # print("\tWaiting for replies.")
-        time.sleep(5)
-        self.isReceiving = False
+        promised = self.await_quorum(needed, members)
         print("\tReceived {} promise.".format(len(self.responses)))
-        if len(self.responses) >= len(self.peer_list)//2:
-            #print("\tPromise quorum. Sending accept request...")
-            max_proposal = -1
-            max_name = None
-            for msg in self.responses:
-                if msg["accepted"] and msg["accepted"] > max_proposal:
-                    max_proposal = msg["accepted"]
-                    max_name = msg["name"]
-            if max_proposal == -1:
-                max_name = self.name
-            self.responses = []
-            self.isReceiving = True
-            self.send_to_list("peer", self.msg_accept())
-            time.sleep(5)
-            self.isReceiving = False
+        if not promised:
+            return self.retry_after_rejection()
+        #print("\tPromise quorum. Sending accept request...")
+        # A value accepted earlier in this election must be proposed again
+        max_proposal = None
+        max_name = self.name
+        for msg in self.responses:
+            accepted = ballot(msg["accepted"])
+            if accepted and proposal_round(accepted) > self.settled_round \
+                    and (max_proposal is None or accepted > max_proposal):
+                max_proposal = accepted
+                max_name = msg["acceptedValue"]
+        self.start_phase()
+        accept = self.msg_accept(max_name)
+        self.send_to_list("peer", accept)
+        self.process_paxos(json.loads(accept.decode()))
+        if not self.await_quorum(needed, members):
             #print("\tReceived {} acceptance.".format(len(self.responses)))
-            if len(self.responses) >= len(self.peer_list)//2:
-                #print("\tAccepted Quorum. New superpeer is {}.".format(max_name))
-                if max_name == self.name:
-                    #print("\tWait... I am the new superpeer!")
-                    #print("\tUpdating registration server.")
-                    self.send_to_port("localhost", self.registration_port, self.msg_election())
-                    self.set_superpeer()
-            else:
-                print("\tNo accepted quorum. Election ends.")
-        else:
-            print("\tNo promise quorum. Election ends.")
-        self.election = False
+            return self.retry_after_rejection()
+        #print("\tAccepted Quorum. New superpeer is {}.".format(max_name))
+        if max_name != self.name:
+            return False
+        #print("\tWait... I am the new superpeer!")
+        #print("\tUpdating registration server.")
+        self.send_to_registration(self.msg_election())
+        self.set_superpeer()
+        return True
+
+    def retry_after_rejection(self):
+        """
+        Decides what to do with a phase that missed its quorum
+        """
+        if not self.rejections:
+            print("\tNo quorum. Election ends.")
+            return False
+        # Peers still hold the superpeer's lease, so it is alive and stays
+        for msg in self.rejections:
+            if msg.get("leader"):
+                print("\tSuperpeer {} still holds its lease. Election ends.".format(msg["leader"]))
+                self.superpeer = msg["leaderPort"]
+                return False
+        # A competitor with an accepted proposal is about to win, so let it
+        if any(msg["accepted"] and ballot(msg["accepted"]) > self.last_proposal for msg in self.rejections):
+            print("\tCompeting proposal accepted. Election ends.")
+            return False
+        # Retry in an election number above every promise seen
+        self.election_num = max([self.election_num] + [proposal_round(msg["promise"]) for msg in self.rejections])
+        print("\tProposal rejected. Retrying.")
+        return None
+
+    def receive_heartbeat(self, msg):
+        PaxosNode.receive_heartbeat(self, msg)
+        self.failure_detector.heartbeat(msg["portNum"])
+
+    def watch_superpeer(self):
+        """
+        Runs check_superpeer every heartbeat_interval on the processing thread
+        """
+        self.schedule(self.heartbeat_interval, self.watch_superpeer)
+        self.check_superpeer()
+
+    def check_superpeer(self):
+        """
+        Start an election as soon as the superpeer's heartbeats stop, rather
+        than waiting for a send to it to fail
+        """
+        superpeer = self.superpeer
+        if self.isSuper or self.election or not self.failure_detector.knows(superpeer):
+            return
+        if not self.failure_detector.is_alive(superpeer):
+            print("Superpeer stopped sending heartbeats. Election starts.")
+            self.failure_detector.remove(superpeer)
+            self.superpeer = None
+            self.elect_superpeer()
 
     # Message Functions
     def msg_election(self):
@@ -270,6 +500,18 @@ class Node(PaxosNode):
         msg["elecNum"] = self.election_num
         return json.dumps(msg).encode()
 
+    def msg_tick_ack(self, tick, received_at):
+        """
+        Message Function - Tick Receipt, for the registration server's spread report
+        """
+        msg = {}
+        msg["action"] = "TickAck"
+        msg["name"] = self.name
+        msg["tickEpoch"] = tick["tickEpoch"]
+        msg["tickSeq"] = tick["tickSeq"]
+        msg["receivedAt"] = received_at
+        return json.dumps(msg).encode()
+
     def msg_peerlist(self):
         """
         Message Function - Peer List Update
@@ -288,6 +530,18 @@ class Node(PaxosNode):
         msg["superpeer_list"] = self.superpeer_list
         return json.dumps(msg).encode()
 
+    def msg_members(self):
+        """
+        Message Function - Superpeer Members
+
+        Tells the other superpeers which peers can be reached through this one.
+        """
+        msg = {}
+        msg["action"] = "SuperpeerMembers"
+        msg["name"] = self.name
+        msg["members"] = list(self.peer_list.keys())
+        return json.dumps(msg).encode()
+
     def msg_register(self):
         """
         Message Function - Register
@@ -325,6 +579,7 @@ class Node(PaxosNode):
         msg["dest"] = dest
         self.msg_num += 1
         msg["msgNum"] = self.msg_num
+        msg["incarnation"] = self.incarnation
         msg["sendTime"] = self.node_time
         return msg
 
@@ -335,9 +590,19 @@ class Node(PaxosNode):
         msg = {}
         msg["action"] = "Query"
         msg["group"] = self.group
+        if self.superpeer_version is not None:
+            msg["version"] = self.superpeer_version
         return json.dumps(msg).encode()
 
     def check_message(self, msg):
+        """
+        Returns True if a Route message is to be delivered, False if it is a
+        duplicate or malformed. Message numbers are tracked per origin and
+        incarnation in a MessageWindow, so a message that arrives more than
+        dedup_window numbers behind the newest of its origin is dropped as a
+        duplicate even if it was never delivered. A higher incarnation means
+        the origin restarted and starts a new window.
+        """
         try:
             orig = msg["orig"]
         except KeyError:
@@ -349,110 +614,252 @@ class Node(PaxosNode):
             #print("\tClient Route Message received.")
             return True
 
-        if orig in self.msg_dict:
-            if msg_num in self.msg_dict[orig]:
-                ##print("\tDuplicate Route Message. Discarded.")
-                return False
-            else:
-                self.msg_dict[orig].append(msg_num)
-        else:
-            self.msg_dict[orig] = deque(maxlen=100)
-            self.msg_dict[orig].append(msg_num)
+        incarnation = msg.get("incarnation", 0)
+        known_incarnation, window = self.msg_dict.get(orig, (None, None))
+        if known_incarnation is None or incarnation > known_incarnation:
+            window = MessageWindow(self.dedup_window)
+            self.msg_dict[orig] = (incarnation, window)
             # #print(self.msg_dict)
+        elif incarnation < known_incarnation:
+            # Left over from before the origin restarted
+            self.dedup_hits += 1
+            return False
+
+        if not window.check_and_add(msg_num):
+            ##print("\tDuplicate Route Message. Discarded.")
+            self.dedup_hits += 1
+            return False
+        self.dedup_misses += 1
         return True
 
+    def tick_stats(self):
+        """
+        Per-tick cost of applying the IPO schedule, or None without one
+        """
+        if self.ipo_schedule is None:
+            return None
+        return self.ipo_schedule.stats()
+
+    def dedup_stats(self):
+        """
+        Duplicate suppression counters: hits are discarded duplicates
+        """
+        return {"hits": self.dedup_hits, "misses": self.dedup_misses, "origins": len(self.msg_dict)}
+
     def process(self):
         """
         Process function for messages between nodes
         """
         while True:
-            if self.isSuper:
-                pass
-            else:
-                if not self.superpeer and not self.election:
-                    self.register()
+            self.check_registration()
             msg = self.request_queue.get()
-            try:
-                action = msg["action"]
-            except KeyError:
-                continue
-            # Time Update Messages from Server
-            if action == "TimeUpdate":
-                self.node_time = msg["serverTime"]
-                ##print(self.node_time)
-                if self.isSuper:
-                    self.send_to_list("peer", json.dumps(msg).encode())
-
-                #################
-                # Gianni's Code #
-                #################
-
-                s_date = msg['serverDate']
-                s_time = msg['serverTime']
-
-                # Grabs the quantity in the quantity table for a specific date time
-                db_connection = sqlite3.connect('data/' + self.name + '.db')
-                db_cursor = db_connection.cursor()
-
-                db_cursor.execute('''SELECT * FROM stock_quantity_table WHERE quantity_date=? AND quantity_time=?''', [s_date, s_time,])
-                all_rows = db_cursor.fetchall()
-
-                # Updates the current quantity table only if the new quantity is > 0
-                for row in all_rows:
-                    stock_name = row[0]
-                    new_quantity = row[1]
-                    if new_quantity > 0:
-                        print('New stocks for ' + stock_name + 'at ' + self.name + ' have IPO\'d')
-                        self.update_quantity(stock_name, new_quantity)
-
-                # Finally closes the connection
-                db_connection.close()
-
-                #################
-                # Gianni's Code #
-                #################
-
-            elif action == "Register":
-                if self.isSuper:
-                    self.send_to_port("localhost", msg["portNum"], self.msg_registerOK(msg["name"], msg["portNum"]))
-                    self.send_to_list("peer", self.msg_peerlist())
-                    print(self.name, "received registration from ", msg["name"])
+            self.process_request(msg)
+
+    def check_registration(self):
+        """
+        Peers without a superpeer register again unless an election is running
+        """
+        if self.isSuper:
+            pass
+        else:
+            if not self.superpeer and not self.election:
+                self.register()
+
+    def process_request(self, msg):
+        """
+        Handle a single message received from another node or the registration server
+        """
+        try:
+            action = msg["action"]
+        except KeyError:
+            return
+        # Time Update Messages from Server
+        if action == "TimeUpdate":
+            received_at = time.time()
+            missed = self.check_tick(msg)
+            if missed is None:
+                return
+            self.node_time = msg["serverTime"]
+            ##print(self.node_time)
+            # Forward before anything else, so the tick reaches the whole group with the least skew
+            if self.isSuper:
+                self.forward_time_update(msg, [[name, peer["portNum"]] for name, peer in self.peer_list.items()])
+            elif msg.get("subtree"):
+                self.forward_time_update(msg, msg["subtree"])
+
+            #################
+            # Gianni's Code #
+            #################
+
+            s_date = msg['serverDate']
+            s_time = msg['serverTime']
+
+            # New stocks that IPO at this tick come from the precomputed schedule, which only exchanges have
+            last_tick, self.tick = self.tick, tick_key(s_date, s_time)
+            if self.ipo_schedule is not None:
+                start = time.perf_counter()
+                if missed and last_tick is not None:
+                    # Issues of the ticks this node never heard are applied now
+                    issues = self.ipo_schedule.events_between(last_tick, self.tick)
                 else:
-                    print("Received registration request but not a superpeer.")
-            elif action == "RegisterOK":
-                print("Registration to superpeer complete.")
-                # #print(msg)
-                self.superpeer = msg["portNum"]
-                self.peer_num = msg["peerNum"]
-                self.election_num = msg["elecNum"]
-            elif action == "PeerListUpdate":
-                self.peer_list = msg["peer_list"]
-                print("Peer list updated.")
-            elif action == "SuperpeerListUpdate":
-                self.superpeer_list = msg["superpeer_list"]
-                #print("Superpeer list updated.")
-            elif action == "Route":
-                if not self.check_message(msg):
-                    continue
-                #print(self.name," Received message from {}".format(msg["orig"]))
-                dest = msg["dest"]
-                if dest == self.name:
-                    #print("\tThis message is for me!")
-                    self.process_message(msg)
-                elif self.isSuper:
-                    #print("\tMessage not for me :(. Let's send it to the right place.")
-                    msg["path"] += "/" + self.name + " (Super)"
-                    if dest in self.peer_list:
-                        self.send_to_port("localhost", self.peer_list[dest]["portNum"], json.dumps(msg).encode())
-                        #print("\tThis is for my peer. Routing message to peer.")
-                    else:
-                        #print("\tLet's got through my superpeer list.")
-                        for superpeer in self.superpeer_list:
-                            if superpeer != self.name and not superpeer in msg["path"]:
-                                #print("\tRouting message to ", superpeer)
-                                self.send_to_port("localhost", self.superpeer_list[superpeer]["portNum"], json.dumps(msg).encode())
+                    issues = self.ipo_schedule.events_at(s_date, s_time)
+                if issues:
+                    print('New stocks for ' + ', '.join(stock_name for stock_name, delta in issues) + ' at ' + self.name + ' have IPO\'d')
+                    self.update_quantities(issues)
+                self.ipo_schedule.record(time.perf_counter() - start)
+
+            #################
+            # Gianni's Code #
+            #################
+
+            if "tickSeq" in msg:
+                # Receipts go to the replica of the registration server that sent the tick
+                self.send_to_port("localhost", msg.get("registrationPort", self.registration_port),
+                                  self.msg_tick_ack(msg, received_at), timeout=self.hop_deadline)
+
+        elif action == "Register":
+            if self.isSuper:
+                self.send_to_port("localhost", msg["portNum"], self.msg_registerOK(msg["name"], msg["portNum"]))
+                self.send_to_list("peer", self.msg_peerlist())
+                self.send_to_list("superpeer", self.msg_members())
+                print(self.name, "received registration from ", msg["name"])
             else:
-                self.process_paxos(msg)
+                print("Received registration request but not a superpeer.")
+        elif action == "RegisterOK":
+            print("Registration to superpeer complete.")
+            # #print(msg)
+            self.superpeer = msg["portNum"]
+            self.peer_num = msg["peerNum"]
+            self.election_num = msg["elecNum"]
+            # The superpeer won the election of this number, or was appointed before any
+            self.settled_round = max(self.settled_round, msg["elecNum"])
+        elif action == "PeerListUpdate":
+            self.peer_list = msg["peer_list"]
+            print("Peer list updated.")
+        elif action == "SuperpeerListUpdate":
+            self.superpeer_list = msg["superpeer_list"]
+            # Another superpeer's list may be older or newer than the table this node last queried
+            self.superpeer_version = None
+            #print("Superpeer list updated.")
+            if self.isSuper:
+                # New superpeers need to learn which peers are behind this one
+                self.send_to_list("superpeer", self.msg_members())
+        elif action == "SuperpeerMembers":
+            self.update_route_index(msg["name"], msg["members"])
+        elif action == "SendFailed":
+            self.handle_send_failure(msg)
+        elif action == "Timer":
+            self.scheduler.fire(msg["timer"])
+        elif action == "Route":
+            if not self.check_message(msg):
+                return
+            #print(self.name," Received message from {}".format(msg["orig"]))
+            dest = msg["dest"]
+            if dest == self.name:
+                #print("\tThis message is for me!")
+                self.process_message(msg)
+            elif self.isSuper:
+                #print("\tMessage not for me :(. Let's send it to the right place.")
+                msg["path"] += "/" + self.name + " (Super)"
+                if dest in self.peer_list:
+                    self.send_to_port("localhost", self.peer_list[dest]["portNum"], json.dumps(msg).encode())
+                    #print("\tThis is for my peer. Routing message to peer.")
+                else:
+                    #print("\tLet's route through the superpeer of the destination's group.")
+                    self.route_to_superpeers(msg)
+        else:
+            self.process_paxos(msg)
+
+    def check_tick(self, msg):
+        """
+        Returns how many ticks were missed before this TimeUpdate, or None
+        for a tick already handled. A new epoch means the registration server
+        restarted and numbers its ticks from the start again.
+        """
+        epoch, seq = msg.get("tickEpoch"), msg.get("tickSeq")
+        if seq is None:
+            return 0
+        if epoch == self.tick_epoch and seq <= self.tick_seq:
+            return None
+        missed = seq - self.tick_seq - 1 if epoch == self.tick_epoch else 0
+        if missed:
+            print("Missed {} ticks. Catching up.".format(missed))
+            self.missed_ticks += missed
+        self.tick_epoch, self.tick_seq = epoch, seq
+        return missed
+
+    def forward_time_update(self, msg, members):
+        """
+        Send a time update down a broadcast tree. members is a list of
+        [name, port] pairs: it is split into time_fanout subtrees, and the
+        first member of each is sent the update along with the rest of its
+        subtree to forward in turn. A child that misses hop_deadline cannot
+        forward, so this node sends to its subtree itself. With an asyncio
+        runtime a level is sent without waiting, and handle_send_failure
+        forwards to the subtrees of the children it could not reach.
+        """
+        unreachable = []
+        while members:
+            targets = []
+            subtrees = {}
+            size = -(-len(members) // self.time_fanout)
+            for i in range(0, len(members), size):
+                (name, port), subtree = members[i], members[i + 1:i + size]
+                forward = dict(msg, subtree=subtree)
+                targets.append((name, port, json.dumps(forward).encode()))
+                subtrees[name] = subtree
+            if self.runtime is not None:
+                self.runtime.send_to_many("time", targets, self.hop_deadline,
+                                          {"timeUpdate": msg, "subtrees": subtrees})
+                return
+            failed = self.fan_out.send_to_many(targets, self.hop_deadline)
+            unreachable.extend(failed)
+            members = [member for name in failed for member in subtrees[name]]
+        if unreachable and self.isSuper:
+            self.remove_unreachable("peer", unreachable)
+
+    def handle_send_failure(self, msg):
+        """
+        Asynchronous sends report unreachable destinations here, on the
+        processing thread, instead of blocking the sender.
+        """
+        if "names" in msg and msg["listType"] == "time":
+            # The failed children cannot forward the update, so their subtrees are sent it from here
+            self.forward_time_update(msg["timeUpdate"],
+                                     [member for name in msg["names"] for member in msg["subtrees"][name]])
+            if self.isSuper:
+                self.remove_unreachable("peer", msg["names"])
+        elif "names" in msg:
+            self.remove_unreachable(msg["listType"], msg["names"])
+        elif not self.isSuper and self.superpeer and msg["portNum"] == self.superpeer and self.lease_holds():
+            # The superpeer heartbeated recently, so the failure is transient
+            self.schedule(self.heartbeat_interval, self.send_to_port, "localhost", self.superpeer,
+                          msg["payload"].encode())
+        elif not self.isSuper and self.superpeer and msg["portNum"] == self.superpeer:
+            print("Superpeer cannot be contacted. Election starts.")
+            self.superpeer = None
+            self.elect_superpeer()
+            payload = json.loads(msg["payload"])
+            if payload.get("action") == "Route":
+                self.send_message(payload)
+
+    def schedule(self, delay, callback, *args):
+        """
+        Run callback(*args) on the processing thread after delay seconds. Returns a timer id for cancel_timer.
+        """
+        return self.scheduler.schedule(delay, callback, *args)
+
+    def cancel_timer(self, timer_id):
+        """
+        Cancel a scheduled callback. Returns False if it already ran or was cancelled.
+        """
+        return self.scheduler.cancel(timer_id)
+
+    def dispatch_timer(self, timer_id):
+        """
+        Called on the scheduler thread when a timer is due
+        """
+        self.request_queue.put({"action": "Timer", "timer": timer_id})
 
     def process_message(self, msg):
         """
@@ -465,22 +872,14 @@ class Node(PaxosNode):
     #################
 
     def update_quantity(self, stock_name, change_in_quantity):
-        """Updates the quantity in the stock table"""
-
-        # Grabs the current quantity in the stock quantity table
-        db_connection = sqlite3.connect('data/' + self.name + '.db')
-        db_cursor = db_connection.cursor()
-        db_cursor.execute('''SELECT * FROM stock_current_quantity_table WHERE stock_name=?''', [stock_name, ])
-        all_rows = db_cursor.fetchall()
-
-        # Grabs the old price and adds the change in quantity
-        old_quantity = all_rows[0][1]
-        new_quantity = old_quantity + change_in_quantity
-
-        # Finally updates the price
-        db_cursor.execute('''UPDATE stock_current_quantity_table SET current_quantity=? WHERE stock_name=?''', [new_quantity, stock_name,])
-        db_connection.commit()
-        db_connection.close()
+        """Updates the quantity in the stock table, for nodes with one"""
+        if self.storage is not None:
+            self.storage.add_quantity(stock_name, change_in_quantity)
+
+    def update_quantities(self, changes):
+        """Applies a list of (stock_name, change) tuples. Exchange batches them through its journal."""
+        for stock_name, change_in_quantity in changes:
+            self.update_quantity(stock_name, change_in_quantity)
 
     #################
     # Gianni's Code #
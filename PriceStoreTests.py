@@ -0,0 +1,89 @@
+import numpy as np
+import os
+import sys
+import tempfile
+from data import csvArrays, exchangeInit
+from data.priceSnapshot import PriceSnapshot
+from priceStore import PriceStore, tick_key
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+
+# Rows arrive in table order, not in time order, and IBM has no price at 9:00
+ROWS = [("IBM", 101.0, "1/4/2016", "10:00"),
+        ("AAPL", 20.5, "1/4/2016", "9:00"),
+        ("IBM", 100.0, "1/4/2016", "8:00"),
+        ("AAPL", 20.0, "1/4/2016", "8:00"),
+        ("AAPL", 21.0, "1/4/2016", "10:00"),
+        ("AAPL", 19.0, "12/31/2015", "16:00")]
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def test_snapshot(store):
+    prices = csvArrays.from_rows(ROWS, 'Test', np.float64, np.nan)
+    # AAPL has no quantity rows, as a stock whose quantity cells are all blank
+    quantities = csvArrays.from_rows([("IBM", 500, "1/4/2016", "9:00")], 'Test', np.int64, 0)
+    file_name = os.path.join(tempfile.mkdtemp(), 'Test.snap')
+    exchangeInit.write_exchange_snapshot(file_name, exchangeInit.exchange_source('Test', prices, quantities))
+    snapshot = PriceSnapshot(file_name)
+    mapped = PriceStore.from_snapshot(snapshot)
+
+    print(TXT_CLR, "Testing a mapped snapshot answers like the store built from rows...", NO_CLR)
+    test_assert_equal(store.calendar, mapped.calendar)
+    for stock in ("AAPL", "IBM"):
+        test_assert_equal([store.price_as_of(stock, tick) for tick in range(len(store))],
+                          [mapped.price_as_of(stock, tick) for tick in range(len(mapped))])
+    test_assert_equal(None, mapped.price_at("IBM", 2))
+
+    print(TXT_CLR, "Testing snapshot quantities, with blanks read as zero...", NO_CLR)
+    test_assert_equal(500, snapshot.quantity_at("IBM", 2))
+    test_assert_equal(0, snapshot.quantity_at("AAPL", 1))
+
+    print(TXT_CLR, "Testing columns are views into the mapping, not copies...", NO_CLR)
+    test_assert_equal(True, isinstance(mapped.columns["AAPL"], memoryview))
+
+
+def main():
+    store = PriceStore.from_rows(ROWS)
+
+    print(TXT_CLR, "Testing ticks are numbered in time order...", NO_CLR)
+    test_assert_equal(4, len(store))
+    test_assert_equal(0, store.tick_of("12/31/2015", "16:00"))
+    test_assert_equal(3, store.tick_of("1/4/2016", "10:00"))
+
+    print(TXT_CLR, "Testing server times with a leading zero find the CSV tick...", NO_CLR)
+    test_assert_equal(tick_key("1/4/2016", "8:00"), tick_key("1/4/2016", "08:00"))
+    test_assert_equal(20.0, store.price("AAPL", "1/4/2016", "08:00"))
+
+    print(TXT_CLR, "Testing point lookups...", NO_CLR)
+    test_assert_equal(20.5, store.price_at("AAPL", 2))
+    test_assert_equal(None, store.price_at("IBM", 2))
+
+    print(TXT_CLR, "Testing as-of lookups carry the last price forward...", NO_CLR)
+    test_assert_equal(100.0, store.price_as_of("IBM", 2))
+    test_assert_equal(None, store.price_as_of("IBM", 0))
+    test_assert_equal(21.0, store.price("AAPL", "1/5/2016", "12:00"))
+    test_assert_equal(20.5, store.price("AAPL", "1/4/2016", "09:30"))
+    test_assert_equal(None, store.price("AAPL", "1/1/2015", "08:00"))
+
+    print(TXT_CLR, "Testing range slices...", NO_CLR)
+    test_assert_equal([20.0, 20.5, 21.0], list(store.prices_between("AAPL", 1, 3)))
+
+    test_snapshot(store)
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import registrationServer
+from registrationStorage import RegistrationStorage
+from testSandbox import network_peer
+from threading import Thread
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+REGISTRATION_PORT = 14800
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def query(version=None):
+    msg = {"action": "Query", "group": 0}
+    if version is not None:
+        msg["version"] = version
+    with contextlib.redirect_stdout(io.StringIO()):
+        return registrationServer.handle_message(json.dumps(msg))
+
+
+def register(group, name, port):
+    msg = {"action": "Register", "group": group, "name": name, "portNum": port}
+    with contextlib.redirect_stdout(io.StringIO()):
+        return json.loads(registrationServer.handle_message(json.dumps(msg)))
+
+
+def elect(group, name, port, election_count):
+    msg = {"action": "Election", "group": group, "name": name, "portNum": port, "elecNum": election_count}
+    with contextlib.redirect_stdout(io.StringIO()):
+        registrationServer.handle_message(json.dumps(msg))
+
+
+def main():
+    registrationServer.STORAGE = RegistrationStorage(os.path.join(tempfile.mkdtemp(), 'registration.db'))
+    for group in range(registrationServer.CONTINENTAL_GROUPS):
+        registrationServer.SUPER_PEER_LIST.append(registrationServer.SuperPeer(group, -1, 0, 'UNIDENTIFIED'))
+    epoch = registrationServer.TICK_EPOCH
+
+    print(TXT_CLR, "Testing a query without a version gets the full table...", NO_CLR)
+    full = query()
+    reply = json.loads(full)
+    test_assert_equal([epoch, 0], reply["version"])
+    test_assert_equal(6, len(reply["superPeers"]))
+
+    print(TXT_CLR, "Testing a query with the current version gets not modified...", NO_CLR)
+    not_modified = query([epoch, 0])
+    test_assert_equal({"action": "QueryAck", "version": [epoch, 0], "notModified": True}, json.loads(not_modified))
+    print(TXT_CLR, "\t{} bytes, against {} for the full table".format(len(not_modified), len(full)), NO_CLR)
+
+    print(TXT_CLR, "Testing replies are serialized once per version...", NO_CLR)
+    test_assert_equal(True, query() is full)
+    test_assert_equal(True, query([epoch, 0]) is not_modified)
+
+    print(TXT_CLR, "Testing a query after a registration gets only the changed super peer...", NO_CLR)
+    register(2, "Euronext Paris", 12353)
+    reply = json.loads(query([epoch, 0]))
+    test_assert_equal(True, reply["delta"])
+    test_assert_equal([epoch, 1], reply["version"])
+    test_assert_equal([{"group": 2, "name": "Euronext Paris", "portNum": 12353, "elecNum": 0}], reply["superPeers"])
+    test_assert_equal(True, "notModified" in json.loads(query([epoch, 1])))
+
+    print(TXT_CLR, "Testing versions of another epoch or from the future get the full table...", NO_CLR)
+    test_assert_equal(6, len(json.loads(query([epoch - 1, 1]))["superPeers"]))
+    test_assert_equal(6, len(json.loads(query([epoch, 5]))["superPeers"]))
+
+    print(TXT_CLR, "Testing a node applies deltas and replaces a group's old super peer...", NO_CLR)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(asyncio.start_server(registrationServer.handle_connection, "localhost",
+                                                 REGISTRATION_PORT, reuse_address=True))
+    Thread(target=loop.run_forever, daemon=True).start()
+    node = network_peer("Frankfurt", REGISTRATION_PORT + 1, 1, REGISTRATION_PORT, print)
+    node.group = 2
+    with contextlib.redirect_stdout(io.StringIO()):
+        node.query_superpeers("localhost", REGISTRATION_PORT)
+    test_assert_equal(["Euronext Paris"], list(node.superpeer_list))
+    test_assert_equal([epoch, 1], node.superpeer_version)
+    elect(2, "Frankfurt", node.port, 1)
+    register(4, "Tokyo", 12355)
+    with contextlib.redirect_stdout(io.StringIO()):
+        node.query_superpeers("localhost", REGISTRATION_PORT)
+    test_assert_equal(["Frankfurt", "Tokyo"], sorted(node.superpeer_list))
+    test_assert_equal(1, node.election_num)
+    test_assert_equal([epoch, 3], node.superpeer_version)
+    with contextlib.redirect_stdout(io.StringIO()):
+        test_assert_equal(True, node.query_superpeers("localhost", REGISTRATION_PORT))
+    test_assert_equal(["Frankfurt", "Tokyo"], sorted(node.superpeer_list))
+
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import time
+from registrationStorage import RegistrationStorage
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def main():
+    database_name = os.path.join(tempfile.mkdtemp(), 'registration.db')
+    storage = RegistrationStorage(database_name, flush_interval=0.2)
+
+    print(TXT_CLR, "Testing a new database starts with unknown super peers at 1/1/2016 7:00...", NO_CLR)
+    super_peers, date_time = storage.load()
+    test_assert_equal([(group, -1, 0, 'UNIDENTIFIED') for group in range(6)], super_peers)
+    test_assert_equal((2016, 1, 1, 7), date_time)
+
+    print(TXT_CLR, "Testing a burst of ticks is written in one commit...", NO_CLR)
+    for hour in range(8, 17):
+        for day in range(4, 9):
+            storage.record_tick(2016, 1, day, hour)
+    time.sleep(0.4)
+    test_assert_equal(1, storage.flushes)
+    test_assert_equal(0, storage.pending())
+
+    print(TXT_CLR, "Testing a super peer change is written without waiting out the interval...", NO_CLR)
+    storage.flush_interval = 10
+    storage.record_super_peer(2, 12353, 1, 'Euronext Paris')
+    time.sleep(0.2)
+    test_assert_equal(2, storage.flushes)
+    test_assert_equal(0, storage.pending())
+
+    print(TXT_CLR, "Testing a restart recovers the latest tick and the super peer table...", NO_CLR)
+    # Left open, as by a crash
+    super_peers, date_time = RegistrationStorage(database_name).load()
+    test_assert_equal((2, 12353, 1, 'Euronext Paris'), super_peers[2])
+    test_assert_equal((2016, 1, 8, 16), date_time)
+
+    print(TXT_CLR, "Testing the clock is recovered into a new year...", NO_CLR)
+    storage.record_tick(2017, 1, 2, 8)
+    storage.record_super_peer(0, 12351, 1, 'New York Stock Exchange')
+    time.sleep(0.2)
+    test_assert_equal((2017, 1, 2, 8), RegistrationStorage(database_name).load()[1])
+
+    print(TXT_CLR, "Testing closing writes the ticks still waiting...", NO_CLR)
+    storage.record_tick(2017, 1, 2, 9)
+    test_assert_equal(1, storage.pending())
+    storage.close()
+    test_assert_equal((2017, 1, 2, 9), RegistrationStorage(database_name).load()[1])
+
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
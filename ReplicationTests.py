@@ -0,0 +1,185 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from connectionPool import ConnectionPool
+from registrationReplica import RegistrationReplica
+from testSandbox import network_peer
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+REPLICA_PORTS = [14900, 14901, 14902]
+SUPER_PORT = 14910
+# Ticks per second of the replicas' clock
+CLOCK_RATE = 5
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "registrationServer.py")
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def start_replicas(directory):
+    """Starts a registration server process per replica, logging to a file each"""
+    replicas = {}
+    ports = ",".join(str(port) for port in REPLICA_PORTS)
+    for port in REPLICA_PORTS:
+        log = open(os.path.join(directory, str(port) + ".log"), "w")
+        replicas[port] = subprocess.Popen([sys.executable, "-u", SERVER, str(port), str(CLOCK_RATE), "-", ports],
+                                          cwd=directory, stdout=log, stderr=subprocess.STDOUT)
+    return replicas
+
+
+def await_log(directory, ports, text, timeout=10):
+    """Returns the port of the replica among ports that logs text, or None"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for port in ports:
+            with open(os.path.join(directory, str(port) + ".log")) as log:
+                if text in log.read():
+                    return port
+        time.sleep(0.05)
+    return None
+
+
+def count_log(directory, port, text):
+    """Returns how many times the replica at port logged text"""
+    with open(os.path.join(directory, str(port) + ".log")) as log:
+        return log.read().count(text)
+
+
+def await_leader(directory, ports, timeout=10):
+    """Returns the port of the replica among ports that logs it leads, or None"""
+    return await_log(directory, ports, "leads at version", timeout)
+
+
+def send(pool, port, msg):
+    reply = pool.send("localhost", port, json.dumps(msg).encode(), need_reply=True)
+    return json.loads(reply.decode()) if reply is not None else None
+
+
+def query(pool, port):
+    return send(pool, port, {"action": "Query", "group": 0})
+
+
+def await_tables(pool, ports, group, name, timeout=2):
+    """Returns the replicas' replies to a query once each names the super peer of group"""
+    deadline = time.monotonic() + timeout
+    while True:
+        replies = [query(pool, port) for port in ports]
+        if all(reply["superPeers"][group]["name"] == name for reply in replies) or time.monotonic() > deadline:
+            return replies
+        time.sleep(0.05)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    pool = ConnectionPool()
+    replicas = start_replicas(directory)
+    try:
+        test_replicas(directory, pool, replicas)
+    finally:
+        for replica in replicas.values():
+            replica.kill()
+    sys.exit(1 if FAILURES else 0)
+
+
+def test_replicas(directory, pool, replicas):
+    print(TXT_CLR, "Testing the replicas elect a leader...", NO_CLR)
+    leader = await_leader(directory, REPLICA_PORTS)
+    test_assert_equal(True, leader in REPLICA_PORTS)
+    followers = [port for port in REPLICA_PORTS if port != leader]
+
+    print(TXT_CLR, "Testing a registration at a follower is made by the leader...", NO_CLR)
+    register = {"action": "Register", "group": 2, "name": "Euronext Paris", "portNum": SUPER_PORT}
+    test_assert_equal({"action": "RegisterURSuper", "elecNum": 0}, send(pool, followers[0], register))
+    test_assert_equal({"action": "RegisterOK", "portNum": SUPER_PORT},
+                      send(pool, followers[1], dict(register, name="Euronext Lyon", portNum=SUPER_PORT + 1)))
+
+    print(TXT_CLR, "Testing every replica serves the same table...", NO_CLR)
+    replies = await_tables(pool, REPLICA_PORTS, 2, "Euronext Paris")
+    test_assert_equal(1, len({json.dumps(reply) for reply in replies}))
+    test_assert_equal("Euronext Paris", replies[0]["superPeers"][2]["name"])
+
+    print(TXT_CLR, "Testing ticks come from the leader and name it for receipts...", NO_CLR)
+    superpeer = network_peer("Euronext Paris", SUPER_PORT, 0, REPLICA_PORTS[0], print)
+    superpeer.group = 2
+    superpeer.isSuper = True
+    superpeer.registration_ports = list(REPLICA_PORTS)
+    ticks = []
+    check_tick = superpeer.check_tick
+    superpeer.check_tick = lambda msg: ticks.append(msg) or check_tick(msg)
+    accepts = count_log(directory, followers[0], "accept.")
+    with contextlib.redirect_stdout(io.StringIO()):
+        superpeer.send_heartbeat()
+        time.sleep(1)
+    test_assert_equal(True, len(ticks) > 0)
+    test_assert_equal({leader}, {tick["registrationPort"] for tick in ticks})
+
+    print(TXT_CLR, "Testing the clock is replicated every half second rather than every tick...", NO_CLR)
+    test_assert_equal(True, 1 <= count_log(directory, followers[0], "accept.") - accepts <= 3 < CLOCK_RATE)
+
+    print(TXT_CLR, "Testing the followers elect a new leader once the leader dies...", NO_CLR)
+    last_tick = ticks[-1]
+    replicas[leader].kill()
+    killed = time.monotonic()
+    new_leader = await_leader(directory, followers)
+    elected = time.monotonic() - killed
+    test_assert_equal(True, new_leader in followers)
+    while len(ticks) < 100 and ticks[-1]["registrationPort"] == leader and time.monotonic() - killed < 10:
+        time.sleep(0.01)
+    print(TXT_CLR, "\tElected in {:.2f} s, first tick {:.2f} s after the leader died".format(
+        elected, time.monotonic() - killed), NO_CLR)
+
+    print(TXT_CLR, "Testing the clock resumes in the same epoch after the last committed tick...", NO_CLR)
+    resumed = [tick for tick in ticks if tick["registrationPort"] == new_leader]
+    test_assert_equal(True, len(resumed) > 0)
+    test_assert_equal(last_tick["tickEpoch"], resumed[0]["tickEpoch"])
+    # The ticks the old leader sent since it last committed the clock, half a second's worth, are sent again
+    test_assert_equal(True, last_tick["tickSeq"] - CLOCK_RATE <= resumed[0]["tickSeq"] <= last_tick["tickSeq"] + 1)
+    first = (resumed[0]["serverDate"], resumed[0]["serverTime"])
+    sent = {tick["tickSeq"]: (tick["serverDate"], tick["serverTime"]) for tick in ticks[:ticks.index(resumed[0])]}
+    test_assert_equal(sent.get(resumed[0]["tickSeq"], first), first)
+    test_assert_equal(0, superpeer.missed_ticks)
+
+    print(TXT_CLR, "Testing a node fails over from the dead replica...", NO_CLR)
+    node = network_peer("Frankfurt", SUPER_PORT + 2, 1, leader, print)
+    node.group = 2
+    node.registration_ports = [leader] + followers
+    with contextlib.redirect_stdout(io.StringIO()):
+        test_assert_equal(True, node.query_superpeers())
+    test_assert_equal(["Euronext Paris"], list(node.superpeer_list))
+    test_assert_equal(True, node.registration_port in followers)
+    election = {"action": "Election", "group": 4, "name": "Tokyo", "portNum": SUPER_PORT + 3, "elecNum": 1}
+    node.send_to_registration(json.dumps(election).encode())
+    replies = await_tables(pool, followers, 4, "Tokyo")
+    test_assert_equal(1, len({json.dumps(reply) for reply in replies}))
+    test_assert_equal("Tokyo", replies[0]["superPeers"][4]["name"])
+
+    print(TXT_CLR, "Testing a leader left without a majority steps down once its lease runs out...", NO_CLR)
+    replicas[[port for port in followers if port != new_leader][0]].kill()
+    killed = time.monotonic()
+    test_assert_equal(new_leader, await_log(directory, [new_leader], "lost its lease", timeout=5))
+    # Its lease ran from a heartbeat sent before the other replica died
+    test_assert_equal(True, time.monotonic() - killed < 2 * RegistrationReplica.lease_duration)
+    time.sleep(0.2)
+    count = len(ticks)
+    time.sleep(0.5)
+    test_assert_equal(count, len(ticks))
+
+
+if __name__ == "__main__":
+    main()
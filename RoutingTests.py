@@ -0,0 +1,98 @@
+import sys
+import time
+from testSandbox import network_peer
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+BASE_PORT = 14560
+# Nothing listens here: it stands in for the registration server
+DEAD_PORT = 14559
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def make_network():
+    """
+    Starts superpeers Paris, Frankfurt and Tokyo with peers Lyon under Paris
+    and Osaka under Tokyo. Returns the nodes by name, and a dict of the Route
+    messages each node was handed, by name.
+    """
+    seen = {}
+    nodes = {}
+    for i, name in enumerate(["Paris", "Frankfurt", "Tokyo", "Lyon", "Osaka"]):
+        node = network_peer(name, BASE_PORT + i, i, DEAD_PORT, print)
+        seen[name] = []
+        check_message = node.check_message
+        node.check_message = lambda msg, name=name, check_message=check_message: \
+            seen[name].append(msg["path"]) or check_message(msg)
+        nodes[name] = node
+    superpeer_list = {name: {"portNum": nodes[name].port} for name in ["Paris", "Frankfurt", "Tokyo"]}
+    for name in superpeer_list:
+        nodes[name].isSuper = True
+        nodes[name].superpeer_list = dict(superpeer_list)
+    nodes["Paris"].peer_list = {"Lyon": {"portNum": nodes["Lyon"].port}}
+    nodes["Tokyo"].peer_list = {"Osaka": {"portNum": nodes["Osaka"].port}}
+    return nodes, seen
+
+
+def route(nodes, seen, orig, dest):
+    """Sends a Route message from orig to dest. Returns the paths of the copies each node was handed"""
+    for paths in seen.values():
+        paths.clear()
+    nodes[orig].send_message(nodes[orig].msg_route(dest))
+    time.sleep(0.3)
+    return {name: paths for name, paths in seen.items() if paths}
+
+
+def main():
+    nodes, seen = make_network()
+    frankfurt = nodes["Frankfurt"]
+
+    print(TXT_CLR, "Testing a Route message goes straight to the indexed superpeer...", NO_CLR)
+    for name in ["Paris", "Tokyo"]:
+        frankfurt.request_queue.put(
+            {"action": "SuperpeerMembers", "name": name, "members": list(nodes[name].peer_list)})
+    time.sleep(0.1)
+    test_assert_equal({"Lyon": "Paris", "Osaka": "Tokyo"}, frankfurt.route_index)
+    test_assert_equal({"Paris": ["Frankfurt (Super)"], "Lyon": ["Frankfurt (Super)/Paris (Super)"]},
+                      route(nodes, seen, "Frankfurt", "Lyon"))
+
+    print(TXT_CLR, "Testing a Route message to a superpeer needs no index...", NO_CLR)
+    test_assert_equal({"Tokyo": ["Frankfurt (Super)"]}, route(nodes, seen, "Frankfurt", "Tokyo"))
+
+    print(TXT_CLR, "Testing a destination missing from the index is flooded to...", NO_CLR)
+    frankfurt.update_route_index("Tokyo", [])
+    reached = route(nodes, seen, "Frankfurt", "Osaka")
+    test_assert_equal(["Paris", "Tokyo"], sorted(name for name in reached if name != "Osaka"))
+    # Tokyo may hear of it from Paris too, but delivers it once
+    test_assert_equal(1, len(reached["Osaka"]))
+
+    print(TXT_CLR, "Testing a stale index entry falls back to flooding...", NO_CLR)
+    # Osaka moved to Paris, but Frankfurt still has it behind Tokyo
+    frankfurt.update_route_index("Tokyo", ["Osaka"])
+    nodes["Paris"].peer_list["Osaka"] = nodes["Tokyo"].peer_list.pop("Osaka")
+    reached = route(nodes, seen, "Frankfurt", "Osaka")
+    test_assert_equal(["Frankfurt (Super)"], reached["Tokyo"])
+    test_assert_equal(["Frankfurt (Super)/Tokyo (Super)"], reached["Paris"])
+    test_assert_equal(["Frankfurt (Super)/Tokyo (Super)/Paris (Super)"], reached["Osaka"])
+
+    print(TXT_CLR, "Testing an index update replaces a superpeer's old members...", NO_CLR)
+    frankfurt.update_route_index("Paris", ["Osaka"])
+    test_assert_equal({"Osaka": "Paris"}, frankfurt.route_index)
+    test_assert_equal(["Frankfurt (Super)/Paris (Super)"], route(nodes, seen, "Frankfurt", "Osaka")["Osaka"])
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
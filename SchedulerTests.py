@@ -0,0 +1,98 @@
+import contextlib
+import io
+import os
+import sys
+import time
+from queue import Queue
+from scheduler import Scheduler
+from testSandbox import make_sandbox, offline_exchange
+
+TXT_CLR = '\033[0;36m'
+OK_CLR = '\033[1;32m'
+FAIL_CLR = '\033[0;31m'
+NO_CLR = '\033[m'
+
+FAILURES = 0
+STOCKS = {"AAPL": 50, "MSFT": 75, "AERO": 80}
+
+
+def test_assert_equal(a, b):
+    global FAILURES
+    if a == b:
+        print(OK_CLR, "Test Passed!", NO_CLR)
+    else:
+        FAILURES += 1
+        print(FAIL_CLR, "Test Failed: Expected ", a, "But got: ", b, NO_CLR)
+
+
+def run_due_timers(exchange, wait):
+    """Stands in for the process thread: fires every timer dispatched within wait seconds"""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.01)
+    with contextlib.redirect_stdout(io.StringIO()):
+        while not exchange.request_queue.empty():
+            exchange.scheduler.fire(exchange.request_queue.get()["timer"])
+
+
+def test_scheduler():
+    dispatched = Queue()
+    scheduler = Scheduler(dispatched.put)
+    fired = []
+
+    print(TXT_CLR, "Testing timers are dispatched in deadline order...", NO_CLR)
+    scheduler.schedule(0.10, fired.append, "late")
+    scheduler.schedule(0.05, fired.append, "early")
+    test_assert_equal(2, scheduler.live())
+    for i in range(2):
+        scheduler.fire(dispatched.get(timeout=1))
+    test_assert_equal(["early", "late"], fired)
+    test_assert_equal(0, scheduler.live())
+
+    print(TXT_CLR, "Testing a cancelled timer is never dispatched...", NO_CLR)
+    timer_id = scheduler.schedule(0.05, fired.append, "cancelled")
+    test_assert_equal(True, scheduler.cancel(timer_id))
+    test_assert_equal(False, scheduler.cancel(timer_id))
+    time.sleep(0.1)
+    test_assert_equal(True, dispatched.empty())
+
+    print(TXT_CLR, "Testing a timer cancelled after dispatch does not run...", NO_CLR)
+    timer_id = scheduler.schedule(0, fired.append, "raced")
+    test_assert_equal(timer_id, dispatched.get(timeout=1))
+    scheduler.cancel(timer_id)
+    test_assert_equal(False, scheduler.fire(timer_id))
+    test_assert_equal(["early", "late"], fired)
+
+
+def test_reservation_timers():
+    exchange = offline_exchange('Test', STOCKS)
+    exchange.kReservationTimeout = 0.05
+    order = {"AAPL": 10}
+
+    print(TXT_CLR, "Testing a committed reservation cancels its timer...", NO_CLR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        reservation_number = exchange.reserve_stocks(order)
+    test_assert_equal(1, exchange.scheduler.live())
+    with contextlib.redirect_stdout(io.StringIO()):
+        exchange.precommit_reservation(reservation_number)
+        exchange.execute_reservation(reservation_number)
+    test_assert_equal(0, exchange.scheduler.live())
+
+    print(TXT_CLR, "Testing a reservation that times out is cancelled on the process thread...", NO_CLR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        reservation_number = exchange.reserve_stocks(order)
+    run_due_timers(exchange, 0.2)
+    test_assert_equal(exchange.kCancelled, exchange.reservations[reservation_number][exchange.kReservationStatus])
+    test_assert_equal(40, exchange.stocks["AAPL"])
+    test_assert_equal(0, exchange.scheduler.live())
+
+
+def main():
+    os.chdir(make_sandbox('Test', STOCKS))
+    test_scheduler()
+    test_reservation_timers()
+    sys.exit(1 if FAILURES else 0)
+
+
+if __name__ == "__main__":
+    main()
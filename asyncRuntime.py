@@ -0,0 +1,203 @@
+import asyncio
+import json
+import traceback
+from messageFraming import FrameError, encode_frame, read_frame_async
+from paxos import PAXOS_DIRECT
+from queue import Queue
+from threading import Event, Thread
+
+
+class AsyncRuntime():
+    """
+    asyncio event-loop runtime for Node.
+
+    A single loop thread accepts connections and reads framed messages for
+    every peer, so no thread is spawned per connection. Outbound messages are
+    sent on persistent per-destination streams without blocking the caller,
+    and each send carries its own timeout, so a dead peer only delays the
+    messages addressed to it.
+
+    Received messages are handed one at a time to Node.process_request on a
+    single worker thread. This keeps the node state serialized exactly as the
+    old process() thread did, so process_message and process_paxos overrides
+    such as Exchange keep working unchanged, while none of the sends they make
+    can block the loop.
+
+    Attributes:
+        node: The Node this runtime serves
+        loop: The asyncio event loop, running on its own thread
+        inbox: Queue of received messages waiting for the worker thread
+        connections: A dict, keyed by (address, port), of (reader, writer) tuples
+        locks: A dict, keyed by (address, port), of locks keeping sends to one destination in order
+    """
+    def __init__(self, node):
+        self.node = node
+        self.loop = asyncio.new_event_loop()
+        self.inbox = Queue()
+        self.server = None
+        self.connections = {}
+        self.locks = {}
+
+    def start(self):
+        """
+        Start the loop thread and wait until the node's port is listening
+        """
+        ready = Event()
+        errors = []
+        Thread(target=self.__run, args=(ready, errors)).start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        Thread(target=self.__work).start()
+
+    def stop(self):
+        """
+        Close the node's port and end the loop and worker threads
+        """
+        def close():
+            self.server.close()
+            self.loop.stop()
+        self.loop.call_soon_threadsafe(close)
+        self.inbox.put(None)
+
+    def __run(self, ready, errors):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle_connection, "localhost", self.node.port))
+        except OSError as e:
+            errors.append(e)
+            ready.set()
+            return
+        ready.set()
+        self.loop.run_forever()
+
+    # Receiving
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                payload = await read_frame_async(reader)
+                if payload is None:
+                    break
+                try:
+                    msg = json.loads(payload.decode())
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                if msg.get("action") in PAXOS_DIRECT:
+                    # The worker thread may be the proposer waiting for this reply
+                    self.node.receive_paxos(msg)
+                else:
+                    self.inbox.put(msg)
+        except (FrameError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def deliver(self, msg):
+        """
+        Queue a message for processing. Safe to call from any thread.
+        """
+        self.inbox.put(msg)
+
+    def __work(self):
+        while True:
+            msg = self.inbox.get()
+            if msg is None:
+                return
+            try:
+                self.node.check_registration()
+                self.node.process_request(msg)
+            except Exception:
+                # A bad message must not stop the worker
+                traceback.print_exc()
+
+    # Sending
+    def send_to_port(self, address, port, msg, need_reply=False, timeout=5):
+        """
+        Send a framed message from any thread except the loop thread.
+
+        Without need_reply the send is scheduled and True is returned at once.
+        If the send later fails, a SendFailed message is delivered to the node.
+        With need_reply the caller waits for the reply payload, or None.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.send(address, port, msg, need_reply, timeout), self.loop)
+        if need_reply:
+            return future.result()
+
+        def report(done):
+            if done.result() is None:
+                self.deliver({"action": "SendFailed", "portNum": port, "payload": msg.decode()})
+        future.add_done_callback(report)
+        return True
+
+    def send_to_many(self, list_type, targets, timeout=5, context=None):
+        """
+        Send to every (name, port, payload) target concurrently without waiting.
+        The names that could not be reached are delivered to the node in a
+        single SendFailed message, along with the entries of context.
+        """
+        async def fan_out():
+            results = await asyncio.gather(
+                *[self.send("localhost", port, payload, timeout=timeout) for name, port, payload in targets])
+            failed = [target[0] for target, result in zip(targets, results) if result is None]
+            if failed:
+                self.inbox.put(dict(context or {}, action="SendFailed", listType=list_type, names=failed))
+        asyncio.run_coroutine_threadsafe(fan_out(), self.loop)
+
+    async def send(self, address, port, payload, need_reply=False, timeout=5):
+        """
+        Send one framed payload on a persistent connection to (address, port).
+        Returns the reply payload, True, or None when the destination is unreachable.
+        """
+        # Resolving a host name would need the loop's default executor, which
+        # is shut down once the main thread exits, so connect by address
+        if address == "localhost":
+            address = "127.0.0.1"
+        dest = (address, port)
+        if dest not in self.locks:
+            self.locks[dest] = asyncio.Lock()
+        async with self.locks[dest]:
+            for attempt in range(2):
+                connection = self.connections.get(dest)
+                reused = connection is not None and not connection[0].at_eof() \
+                    and not connection[1].is_closing()
+                try:
+                    if not reused:
+                        self.__drop(dest)
+                        connection = await asyncio.wait_for(asyncio.open_connection(address, port), timeout)
+                        self.connections[dest] = connection
+                    reader, writer = connection
+                    writer.write(encode_frame(payload))
+                    await asyncio.wait_for(writer.drain(), timeout)
+                except OSError:
+                    # The peer closed the reused connection before the payload reached it
+                    self.__drop(dest)
+                    if reused:
+                        continue
+                    return None
+                except asyncio.TimeoutError:
+                    self.__drop(dest)
+                    return None
+                if not need_reply:
+                    return True
+                try:
+                    reply = await asyncio.wait_for(read_frame_async(reader), timeout)
+                    if reply is None:
+                        raise ConnectionError("Connection closed before reply.")
+                    return reply
+                except ConnectionResetError:
+                    # As ConnectionPool.send: a reset means the peer never read the payload
+                    self.__drop(dest)
+                    if reused:
+                        continue
+                    return None
+                except (OSError, asyncio.TimeoutError, FrameError):
+                    self.__drop(dest)
+                    return None
+            return None
+
+    def __drop(self, dest):
+        connection = self.connections.pop(dest, None)
+        if connection:
+            connection[1].close()
@@ -0,0 +1,272 @@
+import select
+import socket
+import time
+from messageFraming import FrameError, recv_frame, send_frame
+from queue import Empty, Queue
+from threading import Condition, Lock, Thread
+
+
+class ConnectionPool():
+    """
+    Pool of persistent outbound connections keyed by destination.
+
+    Sockets are checked out for a single framed exchange and returned to the
+    pool afterwards, so repeated messages to the same node reuse a warm
+    connection instead of paying a TCP handshake each time.
+
+    Attributes:
+        max_per_destination: Cap on open connections (idle and in use) per destination
+        idle_timeout: Seconds after which an unused connection is closed
+        idle: A dict, keyed by (address, port), of lists of (socket, last_used) tuples
+        open_count: A dict, keyed by (address, port), of open connection counts
+    """
+    def __init__(self, max_per_destination=4, idle_timeout=30):
+        self.max_per_destination = max_per_destination
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.open_count = {}
+        self.condition = Condition()
+        self.last_sweep = time.monotonic()
+
+        # Counters for debugging and benchmarks
+        self.connects = 0
+        self.reuses = 0
+
+    def send(self, address, port, payload, need_reply=False, timeout=5):
+        """
+        Send one framed payload and optionally wait for a framed reply.
+
+        Returns the reply payload when need_reply is set, True when the payload
+        was sent, or None when the destination could not be reached.
+
+        A reused connection may have been closed by the peer after it was
+        checked out. The payload is sent again on a fresh connection only when
+        the peer cannot have read it: the send failed, or the peer reset the
+        connection instead of replying. A reply cut short or timed out is not
+        retried, since the peer may have handled the payload already.
+        """
+        dest = (address, port)
+        for attempt in range(2):
+            soc, reused = self.acquire(dest, timeout)
+            if soc is None:
+                return None
+            try:
+                soc.settimeout(timeout)
+                send_frame(soc, payload)
+            except OSError:
+                self.discard(dest, soc)
+                if reused:
+                    continue
+                return None
+            try:
+                if need_reply:
+                    reply = recv_frame(soc)
+                    if reply is None:
+                        raise ConnectionError("Connection closed before reply.")
+                else:
+                    reply = True
+            except ConnectionResetError:
+                self.discard(dest, soc)
+                if reused:
+                    continue
+                return None
+            except (OSError, FrameError):
+                self.discard(dest, soc)
+                return None
+            self.release(dest, soc)
+            return reply
+        return None
+
+    def acquire(self, dest, timeout=5):
+        """
+        Check out a connection to dest, reusing an idle one when possible.
+        Returns a (socket, reused) tuple, or (None, False) on failure.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.__sweep()
+            while True:
+                idle = self.idle.get(dest)
+                while idle:
+                    soc, last_used = idle.pop()
+                    if self.__is_stale(soc, last_used):
+                        self.__close(dest, soc)
+                        continue
+                    self.reuses += 1
+                    return soc, True
+                if self.open_count.get(dest, 0) < self.max_per_destination:
+                    self.open_count[dest] = self.open_count.get(dest, 0) + 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, False
+                self.condition.wait(remaining)
+
+        # Connect outside the lock so a slow destination does not block others
+        try:
+            soc = socket.create_connection(dest, timeout=timeout)
+        except OSError:
+            with self.condition:
+                self.open_count[dest] -= 1
+                self.condition.notify()
+            return None, False
+        soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.condition:
+            self.connects += 1
+        return soc, False
+
+    def release(self, dest, soc):
+        """
+        Return a healthy connection to the pool
+        """
+        with self.condition:
+            self.idle.setdefault(dest, []).append((soc, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, dest, soc):
+        """
+        Close a connection that failed instead of returning it to the pool
+        """
+        with self.condition:
+            self.__close(dest, soc)
+
+    def close_all(self):
+        with self.condition:
+            for dest, idle in self.idle.items():
+                for soc, last_used in idle:
+                    self.__close(dest, soc)
+            self.idle = {}
+
+    def __close(self, dest, soc):
+        # Caller must hold the condition lock
+        try:
+            soc.close()
+        except OSError:
+            pass
+        self.open_count[dest] = max(self.open_count.get(dest, 0) - 1, 0)
+        self.condition.notify()
+
+    def __sweep(self):
+        # Caller must hold the condition lock. Evicts idle connections at most once a second.
+        now = time.monotonic()
+        if now - self.last_sweep < 1:
+            return
+        self.last_sweep = now
+        for dest, idle in self.idle.items():
+            fresh = []
+            for soc, last_used in idle:
+                if now - last_used > self.idle_timeout:
+                    self.__close(dest, soc)
+                else:
+                    fresh.append((soc, last_used))
+            self.idle[dest] = fresh
+
+    def __is_stale(self, soc, last_used):
+        """
+        A pooled connection is stale if it sat idle too long, or if it is
+        readable while idle, which means the peer closed it or sent stray data.
+        """
+        if time.monotonic() - last_used > self.idle_timeout:
+            return True
+        try:
+            readable, _, _ = select.select([soc], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+
+class FanOut():
+    """
+    Worker threads that send one message to many destinations at once.
+
+    A broadcast costs one timeout in the worst case instead of one timeout per
+    unreachable destination. Every job of a call starts at once: when there
+    are fewer idle workers than jobs, more are started, and workers beyond the
+    base count exit once idle for idle_timeout seconds. The workers are plain
+    daemon threads rather than a concurrent.futures executor, because
+    executors refuse new work once the main thread of a node script has returned.
+    """
+    def __init__(self, connection_pool, workers=8, idle_timeout=30):
+        self.connection_pool = connection_pool
+        self.base_workers = workers
+        self.idle_timeout = idle_timeout
+        self.jobs = Queue()
+        self.lock = Lock()
+        self.workers = 0
+        self.idle = 0
+        self.pending = 0
+        with self.lock:
+            self.__start_workers(workers)
+
+    def send_to_many(self, targets, timeout=5):
+        """
+        Send every (name, port, payload) target concurrently, waiting at most
+        timeout seconds overall. Returns the names that were tried and not
+        reached in time. Each send is given only the time left to the call,
+        and a target whose send had not started by then is skipped rather
+        than reported, since it was never tried.
+        """
+        started, results = self.__send_all(targets, timeout, False)
+        return [name for name, port, payload in targets if name in started and not results.get(name)]
+
+    def ask_many(self, targets, timeout=5):
+        """
+        Send every (name, port, payload) target concurrently as send_to_many
+        does, each waiting for a reply. Returns a dict of names to the
+        replies that came back within timeout.
+        """
+        started, results = self.__send_all(targets, timeout, True)
+        return {name: reply for name, reply in results.items() if reply is not None}
+
+    def __send_all(self, targets, timeout, need_reply):
+        # Returns the names whose send started and the results in by the deadline
+        results = {}
+        started = set()
+        done = Condition()
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.__start_workers(len(targets) - (self.idle - self.pending))
+            self.pending += len(targets)
+        for target in targets:
+            self.jobs.put((target, need_reply, deadline, started, results, done))
+        with done:
+            while len(results) < len(targets):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done.wait(remaining)
+            # Sends still running go on updating the shared ones
+            return set(started), dict(results)
+
+    def __start_workers(self, count):
+        for i in range(count):
+            self.workers += 1
+            self.idle += 1
+            Thread(target=self.__work, daemon=True).start()
+
+    def __work(self):
+        while True:
+            try:
+                job = self.jobs.get(timeout=self.idle_timeout)
+            except Empty:
+                with self.lock:
+                    if self.workers > self.base_workers and self.idle > self.pending:
+                        self.workers -= 1
+                        self.idle -= 1
+                        return
+                continue
+            with self.lock:
+                self.idle -= 1
+                self.pending -= 1
+            (name, port, payload), need_reply, deadline, started, results, done = job
+            remaining = deadline - time.monotonic()
+            # Past the deadline the caller has returned, so the job is dropped unsent
+            if remaining > 0:
+                with done:
+                    started.add(name)
+                sent = self.connection_pool.send("localhost", port, payload, need_reply=need_reply, timeout=remaining)
+                with done:
+                    results[name] = sent
+                    done.notify()
+            with self.lock:
+                self.idle += 1
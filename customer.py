@@ -1,6 +1,7 @@
 import sys
 import socket
 import json
+from messageFraming import FrameError, recv_frame, send_frame
 
 HOST_NAME = 'localhost'
 
@@ -44,7 +45,7 @@ def trade_mutual_fund(customer_port, exchange_name, exchange_port_num, action, m
     # Tries to connect to the super peer socket
     try:
         customer_socket.connect(('localhost', exchange_port_num))
-        customer_socket.send(message_string.encode('ascii'))
+        send_frame(customer_socket, message_string.encode('ascii'))
         customer_socket.close()
     except socket.error:
         print('Failed to connect to local exchange')
@@ -57,7 +58,16 @@ def trade_mutual_fund(customer_port, exchange_name, exchange_port_num, action, m
     customer_socket.bind((HOST_NAME, customer_port))
     customer_socket.listen(1)
     conn, addr = customer_socket.accept()
-    received_message = conn.recv(1024).decode('ascii')
+    try:
+        received_message = recv_frame(conn)
+    except FrameError:
+        received_message = None
+    conn.close()
+    if received_message is None:
+        print('Local exchange closed the connection without replying')
+        customer_socket.close()
+        return
+    received_message = received_message.decode('ascii')
     message_dict = json.loads(received_message)
 
     # Interprets the result
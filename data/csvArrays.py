@@ -0,0 +1,141 @@
+import csv
+import time
+import numpy as np
+from data.csvReader import FIRST_STOCK_COLUMN, read_header
+from data.priceSnapshot import tick_key
+
+
+class MarketArrays():
+    """
+    One wide CSV loaded into a typed 2-D array of ticks by stocks.
+
+    Columns are grouped by exchange, so the stocks of an exchange are the
+    contiguous column range exchange_ranges[exchange].
+
+    Attributes:
+        ticks: A list of (date, time) tuples, one per row
+        stocks: A list of stock names, one per column
+        exchange_ranges: A dict of exchange names to (start, stop) column ranges
+        values: The ticks by stocks array
+    """
+    def __init__(self, ticks, stocks, exchange_ranges, values):
+        self.ticks = ticks
+        self.stocks = stocks
+        self.exchange_ranges = exchange_ranges
+        self.values = values
+
+    def exchanges(self):
+        return list(self.exchange_ranges)
+
+    def exchange_stocks(self, exchange_name):
+        start, stop = self.exchange_ranges[exchange_name]
+        return self.stocks[start:stop]
+
+    def exchange_values(self, exchange_name):
+        """Returns a view of the ticks by stocks block of one exchange"""
+        start, stop = self.exchange_ranges[exchange_name]
+        return self.values[:, start:stop]
+
+    def calendar(self):
+        """Returns the tick keys of the rows, in time order"""
+        return [tick_key(date, time) for date, time in self.ticks]
+
+
+def load_csv(file_name, dtype, blank):
+    """
+    Loads a wide price or quantity CSV. Filled cells are converted in one
+    vectorized step and blank cells are set to blank by a mask.
+    """
+
+    start_time = time.perf_counter()
+    with open(file_name, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        exchange_columns = read_header(reader)
+        rows = list(reader)
+
+    # Orders the columns exchange by exchange so that each exchange is one range
+    columns = []
+    stocks = []
+    exchange_ranges = {}
+    for exchange_name, exchange_stock_columns in exchange_columns.items():
+        exchange_ranges[exchange_name] = (len(columns), len(columns) + len(exchange_stock_columns))
+        for column, stock in exchange_stock_columns:
+            columns.append(column - FIRST_STOCK_COLUMN)
+            stocks.append(stock)
+
+    # Rows are put in time order, so row numbers are tick numbers
+    rows.sort(key=lambda row: tick_key(row[0], row[1]))
+    ticks = [(row[0], row[1]) for row in rows]
+    cells = np.array([row[FIRST_STOCK_COLUMN:] for row in rows], dtype=str)[:, columns]
+    empty = cells == ''
+    values = np.full(cells.shape, blank, dtype=np.float64)
+    values[~empty] = cells[~empty].astype(np.float64)
+    values = values.astype(dtype)
+
+    elapsed = time.perf_counter() - start_time
+    print('Loaded {} rows of {} in {:.2f}s ({:.0f} rows/s)'.format(len(rows), file_name, elapsed,
+                                                                   len(rows) / max(elapsed, 1e-9)))
+    return MarketArrays(ticks, stocks, exchange_ranges, values)
+
+
+def from_rows(rows, exchange_name, dtype, blank):
+    """
+    Builds the MarketArrays of one exchange from (stock, value, date, time)
+    rows, as the exchange tables hold them. Stocks are in name order, and
+    cells no row fills are set to blank.
+    """
+    ticks = sorted({(date, tm) for stock, value, date, tm in rows}, key=lambda tick: tick_key(*tick))
+    stocks = sorted({stock for stock, value, date, tm in rows})
+    row_of = {tick: row for row, tick in enumerate(ticks)}
+    column_of = {stock: column for column, stock in enumerate(stocks)}
+    values = np.full((len(ticks), len(stocks)), blank, dtype=dtype)
+    for stock, value, date, tm in rows:
+        values[row_of[date, tm], column_of[stock]] = value
+    return MarketArrays(ticks, stocks, {exchange_name: (0, len(stocks))}, values)
+
+
+def load_prices(file_name):
+    """Prices as float64, NaN where the CSV has no price"""
+    return load_csv(file_name, np.float64, np.nan)
+
+
+def load_quantities(file_name):
+    """Quantities as int64, 0 where the CSV is blank"""
+    return load_csv(file_name, np.int64, 0)
+
+
+def align_columns(arrays, exchange_name, stocks):
+    """
+    Returns the block of one exchange with its columns in the order of stocks.
+    Stocks missing from arrays get a column of zeros.
+    """
+    aligned = np.zeros((len(arrays.ticks), len(stocks)), dtype=arrays.values.dtype)
+    if exchange_name not in arrays.exchange_ranges:
+        return aligned
+    block = arrays.exchange_values(exchange_name)
+    position = {stock: column for column, stock in enumerate(arrays.exchange_stocks(exchange_name))}
+    for column, stock in enumerate(stocks):
+        if stock in position:
+            aligned[:, column] = block[:, position[stock]]
+    return aligned
+
+
+def align_rows(block, block_ticks, ticks, blank):
+    """
+    Returns a ticks by stocks block with each row of block moved to the
+    position of its tick in ticks. Rows of ticks block lacks are set to blank.
+    """
+    aligned = np.full((len(ticks), block.shape[1]), blank, dtype=block.dtype)
+    position = {tick: row for row, tick in enumerate(ticks)}
+    aligned[[position[tick] for tick in block_ticks]] = block
+    return aligned
+
+
+def as_of_ticks(prices):
+    """
+    For a ticks by stocks price block, returns the int32 tick of the latest
+    price at or before every tick, -1 before a stock's first price
+    """
+    observed = ~np.isnan(prices)
+    tick_numbers = np.arange(prices.shape[0], dtype=np.int32)[:, None]
+    return np.maximum.accumulate(np.where(observed, tick_numbers, -1), axis=0).astype(np.int32)
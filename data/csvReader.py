@@ -1,4 +1,9 @@
 import csv
+import time
+from operator import itemgetter
+
+# The first three columns hold the date, the time and the row labels
+FIRST_STOCK_COLUMN = 3
 
 #####################
 # GET ALL EXCHANGES #
@@ -7,24 +12,11 @@ import csv
 def get_exchange_list(file_name):
     """Gets a list of exchanges"""
 
-    # Reads from the csv file
-    reader = csv.DictReader(open(file_name), fieldnames='')
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-
-    # dict to dict_values
-    exchange_dict_values = next(reader).values()
-    # dict_values to list
-    exchange_list = list(exchange_dict_values)
-    # list to unique list
-    unique_exchange_list = list(set(exchange_list[0]))
-    unique_exchange_list.remove('')
-    unique_exchange_list.remove('Market')
+    # Only the header rows are needed
+    with open(file_name, newline='') as csv_file:
+        exchange_columns = read_header(csv.reader(csv_file))
 
-    return unique_exchange_list
+    return list(exchange_columns)
 
 
 def print_exchange_list(exchange_list):
@@ -34,71 +26,111 @@ def print_exchange_list(exchange_list):
         print(exchange)
 
 
-####################################
-# READ FOR SINGLE EXCHANGE - PRICE #
-####################################
+####################
+# STREAMING READER #
+####################
 
-def read_price_for_exchange(file_name, exchange_name):
-    """Returns an exchange dict and a list of stocks in the exchange"""
-
-    # First round of reading to get all the stocks
-    reader = csv.DictReader(open(file_name), fieldnames='')
+def read_header(reader):
+    """Parses the four header rows. Returns a dict of exchanges to lists of (column, stock) tuples"""
 
     # Skip Continent
     next(reader)
     # Skip Country
     next(reader)
-    # Skip Market
-    next(reader)
-
-    # dict to dict_values
-    stock_dict_values = next(reader).values()
-    # dict_values to list
-    stock_list = list(stock_dict_values)
-    # list to tuples
-    stock_tuples = tuple(stock_list[0])
-
-    # Second round of reading now that we know the fieldnames
-    reader = csv.DictReader(open(file_name), fieldnames=stock_tuples)
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-
-    # A Dict of stocks mapped to exchanges
-    stock_to_exchange_dict = next(reader)
-
-    stock_list = []
-    stock_dict = {}
-
-    # Fills the stock_list with the stock names
-    for stock, exchange in stock_to_exchange_dict.items():
-        if exchange == exchange_name:
-            stock_list.append(stock)
-            stock_dict[stock] = {}
-
-    # Skip Stock
-    next(reader)
-
-    # Reads all the remaining rows
-    for row in reader:
+    market_row = next(reader)
+    stock_row = next(reader)
+
+    exchange_columns = {}
+    for column in range(FIRST_STOCK_COLUMN, len(stock_row)):
+        if market_row[column] != '':
+            exchange_columns.setdefault(market_row[column], []).append((column, stock_row[column]))
+
+    return exchange_columns
+
+
+class NestedDictSink():
+    """
+    Collects the rows of one exchange into the nested dicts the read_* functions return:
+    stock, then date, then time. Blank cells become blank_value unless it is None.
+    """
+
+    def __init__(self, blank_value=None):
+        self.blank_value = blank_value
+        self.stock_list = []
+        self.stock_dict = {}
+
+    def start(self, stock_list):
+        self.stock_list = stock_list
+        self.stock_dict = {stock: {} for stock in stock_list}
+
+    def add(self, row_date, row_time, values):
+        for stock_name, value in zip(self.stock_list, values):
+            if value == '' and self.blank_value is not None:
+                value = self.blank_value
+            self.stock_dict[stock_name].setdefault(row_date, {})[row_time] = value
+
+    def result(self):
+        return self.stock_dict, self.stock_list
+
+
+def stream_exchanges(file_name, sinks, make_sink=None):
+    """
+    Reads the CSV in a single pass and hands each row's columns to the sink of every exchange.
+
+    Args:
+        file_name: The wide price or quantity CSV
+        sinks: A dict of exchange names to sinks with start(stock_list) and add(date, time, values)
+        make_sink: Called with the name of every exchange that has no sink yet. The sink it
+            returns is added to sinks; None skips the exchange.
+
+    Returns:
+        The number of data rows read
+    """
+
+    start_time = time.perf_counter()
+    rows = 0
+
+    with open(file_name, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        exchange_columns = read_header(reader)
+
+        # Builds one column getter per exchange that has a sink
+        getters = []
+        for exchange_name, columns in exchange_columns.items():
+            if exchange_name not in sinks and make_sink is not None:
+                sink = make_sink(exchange_name)
+                if sink is not None:
+                    sinks[exchange_name] = sink
+            if exchange_name not in sinks:
+                continue
+            sinks[exchange_name].start([stock for column, stock in columns])
+            getter = itemgetter(*[column for column, stock in columns])
+            if len(columns) == 1:
+                getter = (lambda single: lambda row: (single(row),))(getter)
+            getters.append((sinks[exchange_name], getter))
+
+        # Reads all the remaining rows
+        for row in reader:
+            rows += 1
+            for sink, getter in getters:
+                sink.add(row[0], row[1], getter(row))
+
+    elapsed = time.perf_counter() - start_time
+    print('Read {} rows of {} in {:.2f}s ({:.0f} rows/s)'.format(rows, file_name, elapsed, rows / max(elapsed, 1e-9)))
+    return rows
 
-        # Get the date and the time
-        row_date = row['Date']
-        row_time = row['GMT Time']
 
-        # For each stock, append its datetime and stock value
-        for stock_name in stock_list:
+####################################
+# READ FOR SINGLE EXCHANGE - PRICE #
+####################################
 
-            # If the date does not exist, creates the date dict
-            if row_date not in stock_dict[stock_name]:
-                stock_dict[stock_name][row_date] = {}
+def read_price_for_exchange(file_name, exchange_name):
+    """Returns an exchange dict and a list of stocks in the exchange"""
 
-            # Finally appends the price of the stock to the time
-            stock_dict[stock_name][row_date][row_time] = row[stock_name]
+    sink = NestedDictSink()
+    stream_exchanges(file_name, {exchange_name: sink})
 
-    return stock_dict, stock_list
+    return sink.result()
 
 
 def print_stock_prices_for_dict(stock_dict, stock_name):
@@ -124,67 +156,11 @@ def print_stock_prices_for_dict(stock_dict, stock_name):
 def read_quantity_for_exchange(file_name, exchange_name):
     """Returns an exchange dict and a list of stocks in the exchange"""
 
-    # First round of reading to get all the stocks
-    reader = csv.DictReader(open(file_name), fieldnames='')
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-    # Skip Market
-    next(reader)
-
-    # dict to dict_values
-    stock_dict_values = next(reader).values()
-    # dict_values to list
-    stock_list = list(stock_dict_values)
-    # list to tuples
-    stock_tuples = tuple(stock_list[0])
-
-    # Second round of reading now that we know the fieldnames
-    reader = csv.DictReader(open(file_name), fieldnames=stock_tuples)
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-
-    # A Dict of stocks mapped to exchanges
-    stock_to_exchange_dict = next(reader)
-
-    stock_list = []
-    stock_dict = {}
-
-    # Fills the stock_list with the stock names
-    for stock, exchange in stock_to_exchange_dict.items():
-        if exchange == exchange_name:
-            stock_list.append(stock)
-            stock_dict[stock] = {}
-
-    # Skip Stock
-    next(reader)
-
-    # Reads all the remaining rows
-    for row in reader:
-
-        # Get the date and the time
-        row_date = row['Date']
-        row_time = row['GMT Time']
-
-        # For each stock, append its datetime and stock value
-        for stock_name in stock_list:
-
-            # If the date does not exist, creates the date dict
-            if row_date not in stock_dict[stock_name]:
-                stock_dict[stock_name][row_date] = {}
+    # Blank quantities are stored as 0
+    sink = NestedDictSink(blank_value=0)
+    stream_exchanges(file_name, {exchange_name: sink})
 
-            # Finally appends the quantity of the stock to the time
-            if row[stock_name] == '':
-                stock_dict[stock_name][row_date][row_time] = 0
-            else:
-                stock_dict[stock_name][row_date][row_time] = row[stock_name]
-
-    return stock_dict, stock_list
+    return sink.result()
 
 
 def print_stock_quantities_for_dict(stock_dict, stock_name):
@@ -211,73 +187,11 @@ def print_stock_quantities_for_dict(stock_dict, stock_name):
 def read_price_for_all_exchanges(file_name):
     """Returns a dict of exchanges and a list of all the stocks"""
 
-    # First round of reading to get all the stocks
-    reader = csv.DictReader(open(file_name), fieldnames='')
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-    # Skip Market
-    next(reader)
-
-    # dict to dict_values
-    stock_dict_values = next(reader).values()
-    # dict_values to list
-    stock_list = list(stock_dict_values)
-    # list to tuples
-    stock_tuples = tuple(stock_list[0])
-
-    # Second round of reading now that we know the fieldnames
-    reader = csv.DictReader(open(file_name), fieldnames=stock_tuples)
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-
-    # A Dict of stocks mapped to exchanges
-    stock_to_exchange_dict = next(reader)
-
-    exchange_dict = {}
-    all_stock_list = []
-
-    # Iterates through the list
-    for stock, exchange in stock_to_exchange_dict.items():
-
-        # If exchange has not been initialized, creates it
-        if exchange not in exchange_dict:
-            exchange_dict[exchange] = {}
-
-        # If stock has not been initialized, creates it
-        if (stock not in exchange_dict[exchange]) and (stock != 'Date') and (stock != 'GMT Time'):
-            all_stock_list.append(stock)
-            exchange_dict[exchange][stock] = {}
-
-    # Skip Stock
-    next(reader)
-
-    # Reads all the remaining rows
-    for row in reader:
-
-        # Get the date and the time
-        row_date = row['Date']
-        row_time = row['GMT Time']
-
-        # For each stock, append its datetime and stock value
-        for stock_name in all_stock_list:
-
-            # Gets the actual exchange name
-            exchange_name = stock_to_exchange_dict[stock_name]
-
-            if row_date not in exchange_dict[exchange_name][stock_name]:
-                exchange_dict[exchange_name][stock_name][row_date] = {}
-
-            # Finally appends the price of the stock to the time
-            exchange_dict[exchange_name][stock_name][row_date][row_time] = row[stock_name]
+    sinks = {}
+    stream_exchanges(file_name, sinks, make_sink=lambda exchange_name: NestedDictSink())
 
-    # Deletes empty key
-    del exchange_dict['']
+    exchange_dict = {exchange_name: sink.stock_dict for exchange_name, sink in sinks.items()}
+    stock_list = [stock for sink in sinks.values() for stock in sink.stock_list]
 
     return exchange_dict, stock_list
 
@@ -310,76 +224,12 @@ def print_stock_prices_for_all(exchange_dict, stock_name):
 def read_quantity_for_all_exchanges(file_name):
     """Returns a dict of exchanges and a list of all the stocks"""
 
-    # First round of reading to get all the stocks
-    reader = csv.DictReader(open(file_name), fieldnames='')
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-    # Skip Market
-    next(reader)
-
-    # dict to dict_values
-    stock_dict_values = next(reader).values()
-    # dict_values to list
-    stock_list = list(stock_dict_values)
-    # list to tuples
-    stock_tuples = tuple(stock_list[0])
-
-    # Second round of reading now that we know the fieldnames
-    reader = csv.DictReader(open(file_name), fieldnames=stock_tuples)
-
-    # Skip Continent
-    next(reader)
-    # Skip Country
-    next(reader)
-
-    # A Dict of stocks mapped to exchanges
-    stock_to_exchange_dict = next(reader)
-
-    exchange_dict = {}
-    all_stock_list = []
-
-    # Iterates through the list
-    for stock, exchange in stock_to_exchange_dict.items():
-
-        # If exchange has not been initialized, creates it
-        if exchange not in exchange_dict:
-            exchange_dict[exchange] = {}
-
-        # If stock has not been initialized, creates it
-        if (stock not in exchange_dict[exchange]) and (stock != 'Date') and (stock != 'GMT Time'):
-            all_stock_list.append(stock)
-            exchange_dict[exchange][stock] = {}
-
-    # Skip Stock
-    next(reader)
-
-    # Reads all the remaining rows
-    for row in reader:
-
-        # Get the date and the time
-        row_date = row['Date']
-        row_time = row['GMT Time']
-
-        # For each stock, append its datetime and stock value
-        for stock_name in all_stock_list:
-
-            # Gets the actual exchange name
-            exchange_name = stock_to_exchange_dict[stock_name]
-
-            if row_date not in exchange_dict[exchange_name][stock_name]:
-                exchange_dict[exchange_name][stock_name][row_date] = {}
-
-            # Finally appends the price of the stock to the time
-            if row[stock_name] == '':
-                exchange_dict[exchange_name][stock_name][row_date][row_time] = 0
-            else:
-                exchange_dict[exchange_name][stock_name][row_date][row_time] = row[stock_name]
+    # Blank quantities are stored as 0
+    sinks = {}
+    stream_exchanges(file_name, sinks, make_sink=lambda exchange_name: NestedDictSink(blank_value=0))
 
-    # Deletes empty key
-    del exchange_dict['']
+    exchange_dict = {exchange_name: sink.stock_dict for exchange_name, sink in sinks.items()}
+    stock_list = [stock for sink in sinks.values() for stock in sink.stock_list]
 
     return exchange_dict, stock_list
 
@@ -1,19 +1,98 @@
-import csvReader
+import argparse
+import hashlib
+import json
+import numpy as np
+import os
 import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from sqlite3 import Error
 
+# The data modules import each other as data.*, from the repository root, which a script run in data/ lacks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data import csvArrays, priceSnapshot
+
 CSV_FILENAME_PRICE = 'price_stocks.csv'
 CSV_FILENAME_QUANTITY = 'qty_stocks.csv'
 TEST_EXCHANGE = 'New York Stock Exchange'
 TEST_STOCK = 'Intel'
+# Part of the source hash, so a change to the database layout rebuilds every exchange
+BUILD_VERSION = 2
+
+
+def exchange_source(exchange_name, prices, quantities):
+    """Returns the (stock_list, ticks, price_block, quantity_block) an exchange is built from.
+    When the two CSVs cover different ticks, the exchange covers them all: the ticks
+    one CSV lacks have no price, or a quantity of 0, as blank cells do. Its stocks are
+    those of the price CSV, as before the arrays; others are left out with a warning."""
+
+    stock_list = prices.exchange_stocks(exchange_name)
+    price_block = np.ascontiguousarray(prices.exchange_values(exchange_name))
+    quantity_block = csvArrays.align_columns(quantities, exchange_name, stock_list)
+    if exchange_name in quantities.exchange_ranges:
+        unpriced = sorted(set(quantities.exchange_stocks(exchange_name)) - set(stock_list))
+        if unpriced:
+            print('Warning: ' + exchange_name + ' leaves out stocks with quantities but no prices: ' + ', '.join(unpriced))
+    if prices.ticks == quantities.ticks:
+        return stock_list, prices.ticks, price_block, quantity_block
+
+    ticks = sorted(set(prices.ticks) | set(quantities.ticks), key=lambda tick: priceSnapshot.tick_key(*tick))
+    price_block = csvArrays.align_rows(price_block, prices.ticks, ticks, np.nan)
+    quantity_block = csvArrays.align_rows(quantity_block, quantities.ticks, ticks, 0)
+    return stock_list, ticks, price_block, quantity_block
+
+
+def source_hash(source):
+    """Content hash of the source columns of an exchange, and of the build format"""
+
+    stock_list, ticks, price_block, quantity_block = source
+    digest = hashlib.sha256()
+    digest.update(json.dumps([BUILD_VERSION, stock_list, ticks]).encode('utf-8'))
+    digest.update(price_block.tobytes())
+    digest.update(quantity_block.tobytes())
+    return digest.hexdigest()
+
+
+def stored_hash(database_name):
+    """Returns the source hash of the last build of a database, or None"""
+
+    if not os.path.exists(database_name):
+        return None
+    db_connection = sqlite3.connect(database_name)
+    try:
+        row = db_connection.execute("SELECT value FROM build_info WHERE key='source_hash'").fetchone()
+    except Error:
+        row = None
+    db_connection.close()
+    return row[0] if row else None
+
+
+def init_database_for_exchange(database_name, exchange_name, prices=None, quantities=None, force=False):
+    """Inits the exchange by filling the database with price and quantities.
+    prices and quantities are the MarketArrays of the two CSVs; they are loaded
+    when missing. Returns False if the database was already built from the same data."""
+
+    # Loads the typed arrays
+    if prices is None:
+        prices = csvArrays.load_prices(CSV_FILENAME_PRICE)
+    if quantities is None:
+        quantities = csvArrays.load_quantities(CSV_FILENAME_QUANTITY)
+
+    return build_exchange((database_name, exchange_source(exchange_name, prices, quantities), force))
 
 
-def init_database_for_exchange(database_name, exchange_name):
-    """Inits the exchange by filling the database with price and quantities"""
+def build_exchange(job):
+    """Builds the database and snapshot of one exchange. Runs in the process pool."""
 
-    # Fill the dicts with data
-    (stock_dict_price, stock_list) = csvReader.read_price_for_exchange(file_name=CSV_FILENAME_PRICE, exchange_name=exchange_name)
-    (stock_dict_quantity, stock_list) = csvReader.read_quantity_for_exchange(file_name=CSV_FILENAME_QUANTITY, exchange_name=exchange_name)
+    database_name, source, force = job
+    stock_list, ticks, price_block, quantity_block = source
+    snapshot_name = database_name[:-len('.db')] + '.snap'
+
+    # Skips exchanges whose source columns did not change since the last build
+    content_hash = source_hash(source)
+    if not force and os.path.exists(snapshot_name) and stored_hash(database_name) == content_hash:
+        return False
 
     print(stock_list)
 
@@ -24,66 +103,88 @@ def init_database_for_exchange(database_name, exchange_name):
         print(e)
         exit(0)
 
-    # Gets the cursor
-    db_cursor = db_connection.cursor()
-
-    # Creates stocks table
-    db_cursor.execute('''CREATE TABLE IF NOT EXISTS stock_price_table
-                      (stock_name TEXT, price REAL, price_date TEXT, price_time TEXT)''')
-
-    # Init the price list
-    stock_price_inserts = []
-
-    # Iterates through each stock in stock_dict
-    for stock, date_dict in stock_dict_price.items():
-        # Iterates through each date in date_dict
-        for date, time_dict in date_dict.items():
-            # Iterates through each time in time_dict
-            for time, price in sorted(time_dict.items()):
-                stock_price_inserts.append((stock, float(price), date, time))
-
-    # Finally executes the price
-    db_cursor.executemany('INSERT OR IGNORE INTO stock_price_table (stock_name, price, price_date, price_time) VALUES (?, ?, ?, ?)', stock_price_inserts)
-
-    # Creates quantity table
-    db_cursor.execute('''CREATE TABLE IF NOT EXISTS stock_quantity_table
-                      (stock_name TEXT, quantity INTEGER, quantity_date TEXT, quantity_time TEXT)''')
+    # The tables are rebuilt from scratch, so a crash mid-build is redone on the next run
+    db_connection.execute('''PRAGMA synchronous=OFF''')
+
+    # Price and quantity tables hold nothing but CSV data, so they are recreated with their keys
+    with db_connection:
+        db_connection.execute('''DROP TABLE IF EXISTS stock_price_table''')
+        db_connection.execute('''DROP TABLE IF EXISTS stock_quantity_table''')
+        db_connection.execute('''CREATE TABLE IF NOT EXISTS build_info (key TEXT PRIMARY KEY, value TEXT)''')
+        db_connection.execute("DELETE FROM build_info WHERE key='source_hash'")
+
+    # Creates stocks table and bulk loads it in one transaction
+    # One row per stock and tick that has a price, stock by stock
+    stock_index, tick_index = np.nonzero(~np.isnan(price_block.T))
+    stock_price_inserts = [(stock_list[stock], price) + ticks[tick] for stock, tick, price in
+                           zip(stock_index.tolist(), tick_index.tolist(), price_block.T[stock_index, tick_index].tolist())]
+    with db_connection:
+        db_connection.execute('''CREATE TABLE stock_price_table
+                              (stock_name TEXT, price REAL, price_date TEXT, price_time TEXT,
+                               PRIMARY KEY (stock_name, price_date, price_time))''')
+        db_connection.executemany('INSERT INTO stock_price_table (stock_name, price, price_date, price_time) VALUES (?, ?, ?, ?)', stock_price_inserts)
+
+    # Creates quantity table, one row per stock and tick, blank quantities included as 0
+    # The tick index serves the per-tick IPO query of Node.process
+    stock_qty_inserts = [(stock, qty) + tick for stock, column in zip(stock_list, quantity_block.T.tolist())
+                         for qty, tick in zip(column, ticks)]
+    with db_connection:
+        db_connection.execute('''CREATE TABLE stock_quantity_table
+                              (stock_name TEXT, quantity INTEGER, quantity_date TEXT, quantity_time TEXT,
+                               PRIMARY KEY (stock_name, quantity_date, quantity_time))''')
+        db_connection.executemany('INSERT INTO stock_quantity_table (stock_name, quantity, quantity_date, quantity_time) VALUES (?, ?, ?, ?)', stock_qty_inserts)
+        db_connection.execute('''CREATE INDEX quantity_tick_index ON stock_quantity_table (quantity_date, quantity_time)''')
+
+    # Creates current quantity table. It holds the live book, so existing rows are kept.
+    # The current quantity starts at the very first tick
+    stock_current_qty_inserts = list(zip(stock_list, quantity_block[0].tolist())) if len(ticks) else []
+    with db_connection:
+        db_connection.execute('''CREATE TABLE IF NOT EXISTS stock_current_quantity_table
+                              (stock_name TEXT PRIMARY KEY, current_quantity INTEGER)''')
+        db_connection.executemany('INSERT OR IGNORE INTO stock_current_quantity_table (stock_name, current_quantity) VALUES (?, ?)', stock_current_qty_inserts)
+
+    # Writes the binary snapshot that exchanges map at startup instead of reading the price rows
+    write_exchange_snapshot(snapshot_name, source)
+
+    # The hash is stored last, so an interrupted build is never mistaken for a complete one
+    with db_connection:
+        db_connection.execute('''INSERT INTO build_info (key, value) VALUES ('source_hash', ?)''', [content_hash])
+    db_connection.close()
+    return True
 
-    # Init the qty list
-    stock_qty_inserts = []
 
-    # Iterates through each stock in stock_dict
-    for stock, date_dict in stock_dict_quantity.items():
-        # Iterates through each date in date_dict
-        for date, time_dict in date_dict.items():
-            # Iterates through each time in time_dict
-            for time, qty in sorted(time_dict.items()):
-                stock_qty_inserts.append((stock, int(qty), date, time))
+def write_exchange_snapshot(snapshot_name, source):
+    """Writes the snapshot of an exchange from its (stock_list, ticks, price_block, quantity_block) source"""
 
-    # Finally executes the quantity
-    db_cursor.executemany('INSERT OR IGNORE INTO stock_quantity_table (stock_name, quantity, quantity_date, quantity_time) VALUES (?, ?, ?, ?)', stock_qty_inserts)
+    stock_list, ticks, price_block, quantity_block = source
+    priceSnapshot.write_snapshot_matrices(snapshot_name, stock_list, [priceSnapshot.tick_key(*tick) for tick in ticks],
+                                          np.ascontiguousarray(price_block.T, dtype='<f8'),
+                                          np.ascontiguousarray(csvArrays.as_of_ticks(price_block).T, dtype='<i4'),
+                                          np.ascontiguousarray(quantity_block.T, dtype='<i8'))
 
-    # Creates current quantity table
-    db_cursor.execute('''CREATE TABLE IF NOT EXISTS stock_current_quantity_table
-                          (stock_name TEXT PRIMARY KEY, current_quantity INTEGER)''')
 
-    # Init the current qty list
-    stock_current_qty_inserts = []
+def build_all_exchanges(jobs=None, force=False):
+    """Builds every exchange database in a process pool of jobs workers, one exchange per task.
+    Exchanges whose source columns are unchanged since their last build are skipped."""
 
-    # Iterates through each stock in stock_dict
-    for stock, date_dict in stock_dict_quantity.items():
-        # Only appends the very first time
-        stock_current_qty_inserts.append((stock, int(date_dict['1/1/2016']['8:00'])))
+    # Loads each CSV once into typed arrays shared by every exchange
+    prices = csvArrays.load_prices(CSV_FILENAME_PRICE)
+    quantities = csvArrays.load_quantities(CSV_FILENAME_QUANTITY)
 
-    # Finally executes the current quantity
-    db_cursor.executemany('INSERT OR IGNORE INTO stock_current_quantity_table (stock_name, current_quantity) VALUES (?, ?)', stock_current_qty_inserts)
+    # Each task carries only the columns of its own exchange
+    exchanges = prices.exchanges()
+    tasks = [(exchange + '.db', exchange_source(exchange, prices, quantities), force) for exchange in exchanges]
 
-    db_cursor.execute('''SELECT * FROM stock_current_quantity_table''')
-    all_rows = db_cursor.fetchall()
+    start_time = time.perf_counter()
+    if jobs == 1:
+        results = [build_exchange(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(build_exchange, tasks))
 
-    # Save (commit) the changes and close the connection
-    db_connection.commit()
-    db_connection.close()
+    for exchange, built in zip(exchanges, results):
+        print(('Built ' if built else 'Unchanged, skipped ') + exchange)
+    print('Built {} of {} exchanges in {:.2f}s'.format(sum(results), len(results), time.perf_counter() - start_time))
 
 
 def init_exchange(exchange_name):
@@ -215,13 +316,8 @@ def test_stuff():
     global DATABASE_NAME
     global TEST_STOCK
 
-    # Gets a list of exchanges
-    exchange_list = csvReader.get_exchange_list(CSV_FILENAME_PRICE)
-
     # Creates the db of the exchanges
-    for exchange in exchange_list:
-        print('Init exchangename ' + exchange)
-        init_database_for_exchange(exchange + '.db', exchange)
+    build_all_exchanges()
 
     #init_database_for_exchange('New York Stock Exchange.db', 'New York Stock Exchange')
     #init_exchange('London')
@@ -231,4 +327,14 @@ def test_stuff():
     #print_all_current_qty_table()
 
 
-test_stuff()
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description='Builds the database and snapshot of every exchange from the CSVs')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes, 1 builds in this process')
+    parser.add_argument('--force', action='store_true', help='rebuild exchanges whose data did not change')
+    args = parser.parse_args()
+    build_all_exchanges(jobs=args.jobs, force=args.force)
+
+
+# Guarded so that pool workers importing this module do not start a build
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import mmap
+import struct
+import sys
+
+# magic, version, symbols, ticks, then the offsets of the calendar, price,
+# as-of and quantity sections
+HEADER = struct.Struct('<4sIII4Q')
+MAGIC = b'XSNP'
+VERSION = 1
+CALENDAR_ENTRY = struct.Struct('<HBBBB')
+SYMBOL_LENGTH = struct.Struct('<H')
+
+
+def tick_key(date, time):
+    """
+    Returns a sortable (year, month, day, hour, minute) key for a date and time string.
+
+    The CSV data writes times as '8:00' while the registration server sends
+    '08:00', so both forms map to the same key.
+    """
+    month, day, year = date.split('/')
+    hour, minute = time.split(':')
+    return int(year), int(month), int(day), int(hour), int(minute)
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def write_snapshot_matrices(file_name, symbols, calendar, prices, as_of, quantities):
+    """
+    Writes a fixed-layout binary snapshot of an exchange's history.
+
+    Args:
+        file_name: Path of the snapshot file
+        symbols: The stocks of the exchange, in column order
+        calendar: The list of tick keys, in time order
+        prices, as_of, quantities: Stock-major matrices of little-endian
+            float64 prices (NaN where missing), int32 as-of ticks (-1 before
+            the first price) and int64 quantities, as any objects with tobytes()
+
+    Layout, after the header: the symbol dictionary as length-prefixed UTF-8
+    names, the tick calendar, then the three matrices. Every section starts on
+    an 8-byte boundary. Every field is little-endian.
+    """
+    symbol_table = b''.join(SYMBOL_LENGTH.pack(len(name)) + name
+                            for name in (symbol.encode('utf-8') for symbol in symbols))
+    cells = len(symbols) * len(calendar)
+    calendar_offset = align(HEADER.size + len(symbol_table))
+    prices_offset = align(calendar_offset + CALENDAR_ENTRY.size * len(calendar))
+    as_of_offset = align(prices_offset + 8 * cells)
+    quantities_offset = align(as_of_offset + 4 * cells)
+
+    with open(file_name, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, VERSION, len(symbols), len(calendar),
+                                        calendar_offset, prices_offset, as_of_offset, quantities_offset))
+        snapshot_file.write(symbol_table)
+        for offset, section in ((calendar_offset, b''.join(CALENDAR_ENTRY.pack(*key) for key in calendar)),
+                                (prices_offset, prices.tobytes()),
+                                (as_of_offset, as_of.tobytes()),
+                                (quantities_offset, quantities.tobytes())):
+            snapshot_file.write(b'\0' * (offset - snapshot_file.tell()))
+            snapshot_file.write(section)
+
+
+class PriceSnapshot():
+    """
+    Read-only view of a snapshot written by write_snapshot_matrices.
+
+    The file is memory mapped and every column is a memoryview slice into the
+    mapping, so opening a snapshot copies nothing but the symbol names and the
+    calendar. Exchanges on the same host share the mapped pages.
+
+    Attributes:
+        symbols: The stocks of the exchange, in column order
+        calendar: A list of tick keys, indexed by tick number
+        price_columns: A dict, keyed by stock, of float64 memoryviews
+        as_of_columns: A dict, keyed by stock, of int32 memoryviews
+        quantity_columns: A dict, keyed by stock, of int64 memoryviews
+    """
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as snapshot_file:
+            self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+
+        (magic, version, symbol_count, tick_count,
+         calendar_offset, prices_offset, as_of_offset, quantities_offset) = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} snapshot.".format(file_name, VERSION))
+        # Columns are viewed in place, which needs the host to match the file
+        if sys.byteorder != 'little':
+            raise ValueError("Snapshots can only be mapped on little-endian hosts.")
+
+        self.symbols = []
+        offset = HEADER.size
+        for i in range(symbol_count):
+            length, = SYMBOL_LENGTH.unpack_from(view, offset)
+            offset += SYMBOL_LENGTH.size
+            self.symbols.append(bytes(view[offset:offset + length]).decode('utf-8'))
+            offset += length
+
+        self.calendar = [CALENDAR_ENTRY.unpack_from(view, calendar_offset + CALENDAR_ENTRY.size * tick)
+                         for tick in range(tick_count)]
+
+        cells = symbol_count * tick_count
+        self.price_columns = self.__columns(view[prices_offset:prices_offset + 8 * cells].cast('d'), tick_count)
+        self.as_of_columns = self.__columns(view[as_of_offset:as_of_offset + 4 * cells].cast('i'), tick_count)
+        self.quantity_columns = self.__columns(view[quantities_offset:quantities_offset + 8 * cells].cast('q'),
+                                               tick_count)
+
+    def __columns(self, matrix, tick_count):
+        return {symbol: matrix[column * tick_count:(column + 1) * tick_count]
+                for column, symbol in enumerate(self.symbols)}
+
+    def quantity_at(self, symbol, tick):
+        return self.quantity_columns[symbol][tick]
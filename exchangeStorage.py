@@ -0,0 +1,93 @@
+import json
+import sqlite3
+from threading import Lock
+
+
+class ExchangeStorage():
+    """
+    Long-lived SQLite storage for one exchange.
+
+    Holds a single connection to the exchange database and one to the shared
+    precommit database for the lifetime of the process, instead of connecting
+    on every operation. Both run in WAL mode with synchronous=NORMAL, so a
+    commit appends to the write-ahead log without waiting for a full fsync of
+    the database file. The exchange loads its state through them on the
+    thread that starts it. Everything after that runs on its processing
+    thread, which also runs the timers since they are dispatched there: the
+    precommits, the inventory journal's flushes and the IPO updates. Every
+    statement still runs under a lock, so a caller on another thread cannot
+    interleave with them. The SQL text of each statement is constant, which
+    lets sqlite3 reuse its cached prepared statements.
+
+    Attributes:
+        database_name: Path of the exchange database
+        precommit_database_name: Path of the database holding precommitted reservations
+    """
+    kCacheSizeKiB = 8192
+    kCachedStatements = 64
+
+    kSelectPrices = '''SELECT * FROM stock_price_table'''
+    kSelectCurrentQuantities = '''SELECT * FROM stock_current_quantity_table'''
+    kSelectQuantities = '''SELECT stock_name, quantity, quantity_date, quantity_time FROM stock_quantity_table'''
+    kAddQuantity = '''UPDATE stock_current_quantity_table SET current_quantity=current_quantity+? WHERE stock_name=?'''
+    kWriteQuantity = '''INSERT OR REPLACE INTO stock_current_quantity_table (stock_name, current_quantity) VALUES (?, ?)'''
+    kCreatePreCommit = '''CREATE TABLE IF NOT EXISTS preCommit (reservation_number INTEGER, reservation TEXT)'''
+    kInsertPreCommit = '''INSERT INTO preCommit VALUES (?,?)'''
+
+    def __init__(self, name, directory='data'):
+        self.database_name = directory + '/' + name + '.db'
+        self.precommit_database_name = directory + '/exchange.db'
+        self.lock = Lock()
+        self.connection = self.__connect(self.database_name)
+        self.precommit_connection = self.__connect(self.precommit_database_name)
+        with self.lock:
+            with self.precommit_connection:
+                self.precommit_connection.execute(self.kCreatePreCommit)
+
+    def __connect(self, database_name):
+        connection = sqlite3.connect(database_name, check_same_thread=False,
+                                     cached_statements=self.kCachedStatements)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA cache_size=-{}'.format(self.kCacheSizeKiB))
+        connection.execute('PRAGMA temp_store=MEMORY')
+        return connection
+
+    def load_prices(self):
+        """Returns every (stock_name, price, price_date, price_time) row"""
+        with self.lock:
+            return self.connection.execute(self.kSelectPrices).fetchall()
+
+    def load_quantities(self):
+        """Returns every (stock_name, current_quantity) row"""
+        with self.lock:
+            return self.connection.execute(self.kSelectCurrentQuantities).fetchall()
+
+    def load_quantity_schedule(self):
+        """Returns every (stock_name, quantity, quantity_date, quantity_time) row"""
+        with self.lock:
+            return self.connection.execute(self.kSelectQuantities).fetchall()
+
+    def add_quantity(self, stock_name, change_in_quantity):
+        """Adds a change to the current quantity of one stock"""
+        with self.lock:
+            with self.connection:
+                self.connection.execute(self.kAddQuantity, [change_in_quantity, stock_name])
+
+    def write_quantities(self, quantities):
+        """Writes a dict of absolute quantities, keyed by stock name, in one transaction"""
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(self.kWriteQuantity, quantities.items())
+
+    def add_precommit(self, reservation_number, reservation):
+        """Persists a precommitted reservation as a JSON string"""
+        with self.lock:
+            with self.precommit_connection:
+                self.precommit_connection.execute(self.kInsertPreCommit,
+                                                  [reservation_number, json.dumps(reservation)])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+            self.precommit_connection.close()
@@ -0,0 +1,88 @@
+import math
+import time
+from threading import Lock
+
+
+class FailureDetector():
+    """
+    Phi-accrual failure detector fed by heartbeats.
+
+    Each member's heartbeat inter-arrival times are tracked as a moving mean.
+    Suspicion phi grows with the time since the last heartbeat, scaled by that
+    mean, so a member that normally beats every second is suspected far
+    sooner than one that beats every ten. Assuming exponentially distributed
+    arrivals, phi = elapsed / (mean * ln 10), and a member is suspected once
+    phi reaches the threshold: a threshold of 3 means a 1 in 1000 chance the
+    member is alive but late.
+
+    Every answer is computed from cached state, so checking liveness never
+    opens a connection or blocks. All methods are safe to call from any thread.
+
+    Attributes:
+        threshold: Phi at which a member is suspected
+        interval: Expected heartbeat interval, the mean before any is measured
+        min_interval: Floor of the measured mean, so a burst of heartbeats
+            does not make the detector hair-triggered
+        members: A dict of members to [last heartbeat, mean interval,
+            heartbeat count] lists
+    """
+    # Weight of the newest interval in the moving mean
+    smoothing = 0.2
+
+    def __init__(self, interval=1.0, threshold=3.0, min_interval=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.min_interval = interval / 2 if min_interval is None else min_interval
+        self.members = {}
+        self.lock = Lock()
+
+    def heartbeat(self, member, now=None):
+        """Records a sign of life from member"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            state = self.members.get(member)
+            if state is None:
+                self.members[member] = [now, self.interval, 1]
+                return
+            mean = (1 - self.smoothing) * state[1] + self.smoothing * (now - state[0])
+            state[0] = now
+            state[1] = max(mean, self.min_interval)
+            state[2] += 1
+
+    def phi(self, member, now=None):
+        """
+        Suspicion level of member, or None for a member never heard from
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            state = self.members.get(member)
+            if state is None:
+                return None
+            last, mean, beats = state
+        return max(now - last, 0) / (mean * math.log(10))
+
+    def is_alive(self, member, now=None):
+        """
+        True if member has sent a heartbeat and is not suspected
+        """
+        phi = self.phi(member, now)
+        return phi is not None and phi < self.threshold
+
+    def is_suspected(self, member, now=None):
+        """
+        True if member has kept up heartbeats and then fallen silent. A member
+        never heard from, or heard from only once, as when it has just
+        registered, is not suspected, since it may never send heartbeats.
+        """
+        with self.lock:
+            state = self.members.get(member)
+            if state is None or state[2] < 2:
+                return False
+        return not self.is_alive(member, now)
+
+    def knows(self, member):
+        return member in self.members
+
+    def remove(self, member):
+        with self.lock:
+            self.members.pop(member, None)
@@ -0,0 +1,80 @@
+import sqlite3
+from threading import Lock
+
+
+class InventoryJournal():
+    """
+    Write-behind journal for an exchange's current stock quantities.
+
+    Exchange.stocks is the authoritative book while the exchange runs. Every
+    change to it is recorded here as the symbol's new absolute quantity, and
+    the changed rows are written to stock_current_quantity_table together in
+    a single transaction, once per time tick or as soon as flush_batch
+    symbols are dirty.
+
+    Crash-consistency rules:
+        1. The table may lag the in-memory book by at most one tick, or by
+           fewer than flush_batch changed symbols, whichever comes first.
+        2. Entries hold absolute quantities, not deltas, so a flush is
+           idempotent and the newest value of a symbol always wins.
+        3. A flush is one transaction: after a crash either every row of a
+           batch is on disk or none is. Rows of a failed flush stay dirty
+           and are retried by the next flush.
+        4. The journal is flushed before a reservation is precommitted, so a
+           durable precommit never refers to stock the table still shows as
+           available.
+        5. Reservations that were not precommitted do not survive a crash.
+           The quantities they held may or may not have been flushed.
+
+    Attributes:
+        storage: The ExchangeStorage the rows are written through
+        flush_batch: Number of dirty symbols that triggers an immediate flush
+        dirty: A dict, keyed by symbol, of quantities not yet written
+    """
+    def __init__(self, storage, flush_batch=64):
+        self.storage = storage
+        self.flush_batch = flush_batch
+        self.dirty = {}
+        self.lock = Lock()
+        self.flush_lock = Lock()
+
+        # Counters for debugging and benchmarks
+        self.flushes = 0
+        self.rows_written = 0
+
+    def record(self, symbol, quantity):
+        """
+        Record the new quantity of a symbol, flushing when the batch is full
+        """
+        with self.lock:
+            self.dirty[symbol] = quantity
+            full = len(self.dirty) >= self.flush_batch
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every dirty symbol in one transaction. Returns the number of rows written.
+        """
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return 0
+                batch = self.dirty
+                self.dirty = {}
+            try:
+                self.storage.write_quantities(batch)
+            except sqlite3.Error as e:
+                print("SQL ERROR: ", e)
+                # Keep the failed rows unless a newer value arrived meanwhile
+                with self.lock:
+                    for symbol, quantity in batch.items():
+                        self.dirty.setdefault(symbol, quantity)
+                return 0
+            self.flushes += 1
+            self.rows_written += len(batch)
+            return len(batch)
+
+    def pending(self):
+        with self.lock:
+            return len(self.dirty)
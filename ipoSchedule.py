@@ -0,0 +1,83 @@
+from bisect import bisect_right
+from data.priceSnapshot import tick_key
+
+
+class IpoSchedule():
+    """
+    Precomputed index of the new stock issued at each time tick.
+
+    Maps every tick key to a sparse list of (stock, delta) tuples, so a
+    TimeUpdate costs one dict lookup instead of a query over the quantity
+    table. Only positive quantities are issues. The earliest tick of the data
+    is left out: its quantities are the opening book, which is already in
+    stock_current_quantity_table.
+
+    Attributes:
+        events: A dict of tick keys to lists of (stock, delta) tuples
+        ticks_applied: Number of ticks handled, with or without issues
+        seconds_applied: Total time spent applying ticks
+        slowest_tick: Longest time spent applying a single tick
+    """
+    def __init__(self, events):
+        self.events = events
+        self.keys = sorted(events)
+        self.ticks_applied = 0
+        self.seconds_applied = 0.0
+        self.slowest_tick = 0.0
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds the schedule from (stock_name, quantity, quantity_date, quantity_time) rows
+        """
+        events = {}
+        keys = {}
+        for stock_name, quantity, quantity_date, quantity_time in rows:
+            key = keys.get((quantity_date, quantity_time))
+            if key is None:
+                key = keys[quantity_date, quantity_time] = tick_key(quantity_date, quantity_time)
+            if quantity > 0:
+                events.setdefault(key, []).append((stock_name, quantity))
+        if keys:
+            events.pop(min(keys.values()), None)
+        return cls(events)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Builds the schedule from the quantity columns of a PriceSnapshot
+        """
+        events = {}
+        for stock_name, column in snapshot.quantity_columns.items():
+            # Tick 0 is the opening book
+            for tick in range(1, len(column)):
+                if column[tick] > 0:
+                    events.setdefault(snapshot.calendar[tick], []).append((stock_name, column[tick]))
+        return cls(events)
+
+    def events_at(self, date, time):
+        """Returns the (stock, delta) issues of a tick, which may be empty"""
+        return self.events.get(tick_key(date, time), [])
+
+    def events_between(self, after_key, up_to_key):
+        """
+        Returns the issues of every tick after after_key up to and including
+        up_to_key, in time order, for catching up on missed ticks
+        """
+        start = bisect_right(self.keys, after_key)
+        stop = bisect_right(self.keys, up_to_key)
+        return [issue for key in self.keys[start:stop] for issue in self.events[key]]
+
+    def record(self, elapsed):
+        """Records the time spent applying one tick"""
+        self.ticks_applied += 1
+        self.seconds_applied += elapsed
+        self.slowest_tick = max(self.slowest_tick, elapsed)
+
+    def stats(self):
+        """
+        Per-tick handling cost in milliseconds
+        """
+        mean = self.seconds_applied / self.ticks_applied if self.ticks_applied else 0.0
+        return {"ticks": self.ticks_applied, "scheduled_ticks": len(self.events),
+                "mean_ms": mean * 1000, "max_ms": self.slowest_tick * 1000}
@@ -0,0 +1,135 @@
+import asyncio
+import struct
+
+# Every frame is a 4-byte big-endian payload length followed by the payload
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class FrameError(Exception):
+    """Raised when a peer sends a frame that cannot be decoded."""
+    pass
+
+
+def encode_frame(payload):
+    """
+    Prefix the payload with its length so several messages can share one connection
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError("Frame of {} bytes exceeds maximum size.".format(len(payload)))
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder():
+    """
+    Streaming decoder for length-prefixed frames.
+
+    Bytes are fed in as they arrive from the socket, in chunks of any size,
+    and every frame completed by the new data is returned.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            if length > MAX_FRAME_SIZE:
+                raise FrameError("Frame of {} bytes exceeds maximum size.".format(length))
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append(bytes(self.buffer[HEADER.size:end]))
+            del self.buffer[:end]
+        return frames
+
+    def pending(self):
+        """
+        Number of buffered bytes belonging to an incomplete frame
+        """
+        return len(self.buffer)
+
+
+def send_frame(sock, payload):
+    """
+    Send a single framed payload over a connected socket
+    """
+    sock.sendall(encode_frame(payload))
+
+
+def recv_exact(sock, size):
+    """
+    Receive exactly size bytes, or fewer if the connection closes first
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+def recv_frame(sock):
+    """
+    Receive a single framed payload, or None if the connection was closed
+    between frames. Closing in the middle of a frame raises FrameError.
+    """
+    header = recv_exact(sock, HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise FrameError("Connection closed in the middle of a frame header.")
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError("Frame of {} bytes exceeds maximum size.".format(length))
+    if length == 0:
+        return b''
+    payload = recv_exact(sock, length)
+    if len(payload) < length:
+        raise FrameError("Connection closed in the middle of a frame.")
+    return payload
+
+
+def read_frame(stream):
+    """
+    Read a single framed payload from a buffered file object, such as the
+    rfile of a StreamRequestHandler. Returns None on end of stream between
+    frames, and raises FrameError on end of stream in the middle of one.
+    """
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise FrameError("Connection closed in the middle of a frame header.")
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError("Frame of {} bytes exceeds maximum size.".format(length))
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise FrameError("Connection closed in the middle of a frame.")
+    return payload
+
+
+async def read_frame_async(reader):
+    """
+    Read a single framed payload from an asyncio StreamReader. Returns None
+    on end of stream between frames, and raises FrameError on end of stream
+    in the middle of one.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise FrameError("Connection closed in the middle of a frame header.")
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError("Frame of {} bytes exceeds maximum size.".format(length))
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise FrameError("Connection closed in the middle of a frame.")
@@ -1,76 +1,240 @@
-import json
-
-class PaxosNode():
-    def __init__(self):
-        self.group = None
-        self.name = None
-        self.port = None
-        self.peer_num = None
-        self.election_num = 0
-        self.promise = 0
-        self.accepted = None
-
-        self.isReceiving = False
-        self.responses = []
-
-    def send_to_port(self, address, port, msg, need_reply=False, timeout=5, retries=3):
-        pass
-
-    def msg_prepare(self):
-        msg = {}
-        msg["action"] = "Prepare"
-        msg["group"] = self.group
-        msg["name"] = self.name
-        msg["portNum"] = self.port
-        self.election_num += 1
-        self.last_proposal = self.election_num*100 + self.peer_num
-        msg["seq"] = self.last_proposal
-        msg["elecNum"] = self.election_num
-        return json.dumps(msg).encode()
-
-    def msg_promise(self):
-        msg = {}
-        msg["action"] = "Promise"
-        msg["group"] = self.group
-        msg["name"] = self.name
-        msg["portNum"] = self.port
-        msg["accepted"] = self.accepted
-        return json.dumps(msg).encode()
-
-    def msg_accept(self):
-        msg = {}
-        msg["action"] = "Accept"
-        msg["group"] = self.group
-        msg["name"] = self.name
-        msg["portNum"] = self.port
-        msg["seq"] = self.last_proposal
-        msg["elecNum"] = self.election_num
-        return json.dumps(msg).encode()
-
-    def msg_accepted(self):
-        msg = {}
-        msg["action"] = "Accepted"
-        msg["group"] = self.group
-        msg["name"] = self.name
-        msg["portNum"] = self.port
-        msg["accepted"] = self.accepted
-        return json.dumps(msg).encode()
-
-    def process_paxos(self, msg):
-        if msg["action"] == "Prepare":
-            print("Received election message: prepare.")
-            if self.promise < msg["seq"]:
-                self.promise = msg["seq"]
-                print("\tSending out promise.")
-                self.send_to_port("localhost", msg["portNum"], self.msg_promise())
-        elif msg["action"] in ("Promise", "Accepted"):
-            if self.isReceiving:
-                self.responses.append(msg)
-        elif msg["action"] == "Accept":
-            print("Received election message: accept.")
-            if self.promise == msg["seq"]:
-                self.accepted = msg["seq"]
-                self.election_num = msg["elecNum"]
-                print("\tSending out accepted.")
-                self.send_to_port("localhost", msg["portNum"], self.msg_accepted())
-    
\ No newline at end of file
+import json
+import random
+import time
+from threading import Condition
+
+# Replies to a proposer. They are delivered straight to receive_reply by the
+# receiving thread, since the proposer's processing thread is busy waiting.
+PAXOS_REPLIES = ("Promise", "Accepted", "Nack")
+# Messages handled by receive_paxos on the receiving thread instead of being queued
+PAXOS_DIRECT = PAXOS_REPLIES + ("Heartbeat",)
+# Lower than every proposal, so any first Prepare is promised
+NO_BALLOT = (0, 0)
+
+
+def ballot(seq):
+    """
+    Returns a proposal number as a comparable (election number, peer number)
+    tuple. JSON carries proposal numbers as two-element lists.
+    """
+    return tuple(seq) if seq is not None else None
+
+
+def proposal_round(seq):
+    """Returns the election number a proposal number was made in"""
+    return seq[0]
+
+
+class PaxosNode():
+    # Upper bound on each phase. A phase ends as soon as a quorum replies.
+    phase_timeout = 5
+    # Proposals rejected by a competing proposer are retried this many times
+    election_attempts = 4
+    # Base of the randomized exponential backoff between attempts, in seconds
+    election_backoff = 0.2
+    # Multi-Paxos: the elected superpeer keeps its ballot and renews a lease
+    # with phase 2 heartbeats, and peers holding the lease refuse other proposers
+    multi_paxos = True
+    heartbeat_interval = 1
+    lease_duration = 3
+
+    def __init__(self):
+        self.group = None
+        self.name = None
+        self.port = None
+        self.peer_num = None
+        self.election_num = 0
+        self.promise = NO_BALLOT
+        self.accepted = None
+        self.accepted_value = None
+        # Election number of the last election known to have ended. Values accepted
+        # up to it belong to superpeers already established and are not carried over.
+        self.settled_round = 0
+
+        self.isReceiving = False
+        self.responses = []
+        self.rejections = []
+        self.last_proposal = None
+        # Guards responses, the acceptor state and the lease, and wakes the proposer when a reply arrives
+        self.quorum = Condition()
+
+        # Leader lease, renewed by every heartbeat of the superpeer
+        self.leader = None
+        self.leader_port = None
+        self.lease_expiry = 0
+        self.heartbeat_timer = None
+
+    def send_to_port(self, address, port, msg, need_reply=False, timeout=5, retries=3):
+        pass
+
+    def msg_prepare(self):
+        msg = {}
+        msg["action"] = "Prepare"
+        msg["group"] = self.group
+        msg["name"] = self.name
+        msg["portNum"] = self.port
+        self.election_num += 1
+        self.last_proposal = (self.election_num, self.peer_num or 0)
+        msg["seq"] = self.last_proposal
+        msg["elecNum"] = self.election_num
+        return json.dumps(msg).encode()
+
+    def msg_promise(self):
+        msg = {}
+        msg["action"] = "Promise"
+        msg["group"] = self.group
+        msg["name"] = self.name
+        msg["portNum"] = self.port
+        msg["accepted"] = self.accepted
+        msg["acceptedValue"] = self.accepted_value
+        msg["seq"] = self.promise
+        return json.dumps(msg).encode()
+
+    def msg_accept(self, value=None):
+        msg = {}
+        msg["action"] = "Accept"
+        msg["group"] = self.group
+        msg["name"] = self.name
+        msg["portNum"] = self.port
+        msg["seq"] = self.last_proposal
+        msg["elecNum"] = self.election_num
+        msg["value"] = value or self.name
+        return json.dumps(msg).encode()
+
+    def msg_accepted(self):
+        msg = {}
+        msg["action"] = "Accepted"
+        msg["group"] = self.group
+        msg["name"] = self.name
+        msg["portNum"] = self.port
+        msg["accepted"] = self.accepted
+        msg["seq"] = self.accepted
+        return json.dumps(msg).encode()
+
+    def msg_nack(self, seq):
+        msg = {}
+        msg["action"] = "Nack"
+        msg["group"] = self.group
+        msg["name"] = self.name
+        msg["portNum"] = self.port
+        msg["seq"] = seq
+        msg["promise"] = self.promise
+        msg["accepted"] = self.accepted
+        if self.lease_holds():
+            msg["leader"] = self.leader
+            msg["leaderPort"] = self.leader_port
+        return json.dumps(msg).encode()
+
+    def msg_heartbeat(self):
+        msg = {}
+        msg["action"] = "Heartbeat"
+        msg["group"] = self.group
+        msg["name"] = self.name
+        msg["portNum"] = self.port
+        msg["seq"] = self.last_proposal
+        msg["elecNum"] = self.election_num
+        msg["lease"] = self.lease_duration
+        return json.dumps(msg).encode()
+
+    def start_phase(self):
+        """Clears the replies of the previous phase and starts collecting"""
+        with self.quorum:
+            self.responses = []
+            self.rejections = []
+            self.isReceiving = True
+
+    def await_quorum(self, needed, expected):
+        """
+        Waits until needed of the expected replies to the current proposal
+        arrive, enough are rejections that the quorum cannot be reached, or
+        phase_timeout passes. Returns True on quorum.
+        """
+        with self.quorum:
+            self.quorum.wait_for(lambda: len(self.responses) >= needed
+                                 or len(self.rejections) > expected - needed,
+                                 self.phase_timeout)
+            self.isReceiving = False
+            return len(self.responses) >= needed
+
+    def receive_paxos(self, msg):
+        """
+        Handles a message of PAXOS_DIRECT. Safe to call from any thread.
+        """
+        if msg["action"] == "Heartbeat":
+            self.receive_heartbeat(msg)
+        else:
+            self.receive_reply(msg)
+
+    def receive_reply(self, msg):
+        """
+        Records a reply to the current proposal. Safe to call from any thread.
+        """
+        with self.quorum:
+            if not self.isReceiving or ballot(msg.get("seq")) != self.last_proposal:
+                return
+            if msg["action"] == "Nack":
+                self.rejections.append(msg)
+            else:
+                self.responses.append(msg)
+            self.quorum.notify_all()
+
+    def receive_heartbeat(self, msg):
+        """
+        A heartbeat is the leader's phase 2 for its standing ballot: peers that
+        have not promised a higher proposal accept it and extend the lease.
+        """
+        seq = ballot(msg["seq"])
+        with self.quorum:
+            if seq < self.promise:
+                return
+            self.promise = seq
+            self.accepted = seq
+            self.accepted_value = msg["name"]
+            self.election_num = max(self.election_num, msg["elecNum"])
+            self.settled_round = max(self.settled_round, proposal_round(seq))
+            self.leader = msg["name"]
+            self.leader_port = msg["portNum"]
+            self.lease_expiry = time.monotonic() + msg["lease"]
+
+    def lease_holds(self):
+        """True while the superpeer's last heartbeat is within its lease"""
+        return self.multi_paxos and time.monotonic() < self.lease_expiry
+
+    def backoff(self, attempt):
+        """Sleeps a random time that doubles in range with every attempt"""
+        time.sleep(random.uniform(0, self.election_backoff * 2 ** attempt))
+
+    def process_paxos(self, msg):
+        """
+        Acceptor side of Prepare and Accept. Heartbeats update the same state
+        on the receiving thread, so the check and update are made under
+        quorum, and the reply is sent once it is released.
+        """
+        if msg["action"] == "Prepare":
+            print("Received election message: prepare.")
+            seq = ballot(msg["seq"])
+            with self.quorum:
+                # A live leader is not deposed by a peer that merely missed it
+                leased = self.lease_holds() and msg["name"] != self.leader
+                if self.promise < seq and not leased:
+                    self.promise = seq
+                    print("\tSending out promise.")
+                    reply = self.msg_promise()
+                else:
+                    reply = self.msg_nack(seq)
+            self.send_to_port("localhost", msg["portNum"], reply)
+        elif msg["action"] in PAXOS_DIRECT:
+            self.receive_paxos(msg)
+        elif msg["action"] == "Accept":
+            print("Received election message: accept.")
+            seq = ballot(msg["seq"])
+            with self.quorum:
+                if self.promise == seq:
+                    self.accepted = seq
+                    self.accepted_value = msg.get("value", msg["name"])
+                    self.election_num = msg["elecNum"]
+                    print("\tSending out accepted.")
+                    reply = self.msg_accepted()
+                else:
+                    reply = self.msg_nack(seq)
+            self.send_to_port("localhost", msg["portNum"], reply)
@@ -0,0 +1,111 @@
+from array import array
+from bisect import bisect_left
+from data.priceSnapshot import tick_key
+
+MISSING = float('nan')
+
+
+class PriceStore():
+    """
+    Columnar price history of the stocks traded on one exchange.
+
+    Every distinct date and time in the history gets a tick number in
+    chronological order. Each stock has one array('d') column holding its
+    price at every tick, NaN where the data has no price, and one array('i')
+    holding the tick of its latest price at or before every tick. Point
+    lookups, as-of lookups and range slices are all array indexing. The
+    columns may also be memoryviews into a mapped PriceSnapshot.
+
+    Attributes:
+        calendar: A list of tick keys, indexed by tick number
+        ticks: A dict mapping each tick key to its tick number
+        columns: A dict, keyed by stock, of price columns
+        last_seen: A dict, keyed by stock, of as-of index columns (-1 before the first price)
+    """
+    def __init__(self, calendar, columns, last_seen=None):
+        self.calendar = calendar
+        self.ticks = {key: tick for tick, key in enumerate(calendar)}
+        self.columns = columns
+        if last_seen is not None:
+            self.last_seen = last_seen
+            return
+        self.last_seen = {}
+        for stock, column in columns.items():
+            last_seen = array('i', bytes(4 * len(column)))
+            last = -1
+            for tick, price in enumerate(column):
+                # NaN is the only value not equal to itself
+                if price == price:
+                    last = tick
+                last_seen[tick] = last
+            self.last_seen[stock] = last_seen
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds the store from (stock_name, price, price_date, price_time) rows in any order
+        """
+        # Parse each distinct date and time once, not once per stock
+        keys = {}
+        for stock, price, date, time in rows:
+            if (date, time) not in keys:
+                keys[date, time] = tick_key(date, time)
+        calendar = sorted(set(keys.values()))
+        ticks = {key: tick for tick, key in enumerate(calendar)}
+        tick_of = {pair: ticks[key] for pair, key in keys.items()}
+        columns = {}
+        for stock, price, date, time in rows:
+            column = columns.get(stock)
+            if column is None:
+                column = columns[stock] = array('d', [MISSING]) * len(calendar)
+            column[tick_of[date, time]] = price
+        return cls(calendar, columns)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Builds the store on the mapped columns of a PriceSnapshot without copying them
+        """
+        return cls(snapshot.calendar, snapshot.price_columns, snapshot.as_of_columns)
+
+    def tick_of(self, date, time):
+        """Returns the tick number of a date and time, or None if the history has no such tick"""
+        return self.ticks.get(tick_key(date, time))
+
+    def tick_as_of(self, date, time):
+        """Returns the latest tick at or before a date and time, or None if it precedes the history"""
+        key = tick_key(date, time)
+        if key in self.ticks:
+            return self.ticks[key]
+        tick = bisect_left(self.calendar, key) - 1
+        return tick if tick >= 0 else None
+
+    def price_at(self, stock, tick):
+        """Returns the price of a stock at exactly this tick, or None if it has none"""
+        price = self.columns[stock][tick]
+        return price if price == price else None
+
+    def price_as_of(self, stock, tick):
+        """Returns the latest price of a stock at or before this tick, or None"""
+        last = self.last_seen[stock][tick]
+        return self.columns[stock][last] if last >= 0 else None
+
+    def price(self, stock, date, time):
+        """Returns the latest price of a stock as of a date and time, or None"""
+        tick = self.tick_as_of(date, time)
+        return None if tick is None else self.price_as_of(stock, tick)
+
+    def prices_between(self, stock, first_tick, last_tick):
+        """Returns the price column of a stock from first_tick to last_tick inclusive, NaN where missing"""
+        return self.columns[stock][first_tick:last_tick + 1]
+
+    def stocks(self):
+        return list(self.columns)
+
+    def nbytes(self):
+        """Bytes held by the price and as-of columns"""
+        return sum(column.itemsize * len(column) for column in self.columns.values()) + \
+            sum(column.itemsize * len(column) for column in self.last_seen.values())
+
+    def __len__(self):
+        return len(self.calendar)
@@ -0,0 +1,310 @@
+import copy
+import json
+import random
+import time
+from threading import Lock, Thread
+from paxos import NO_BALLOT, PaxosNode, ballot, proposal_round
+
+# Group of the messages the registration replicas exchange among themselves
+REPLICA_GROUP = "Registration"
+
+
+class RegistrationReplica(PaxosNode):
+    """
+    One of 3 or 5 registration servers that agree on the super peer table
+    and the clock through Multi-Paxos.
+
+    The replicated value is the whole directory state, a small JSON dict,
+    numbered by version. The replica that wins a Prepare round leads: it
+    proposes every change as the next version in an Accept of its standing
+    ballot, and commits it once a majority of the replicas, itself included,
+    accepted it. Its heartbeats carry the committed state, so they renew the
+    followers' lease and bring them up to date at once, and any replica can
+    serve reads. Followers forward writes to the leader. The leader renews
+    its own lease only once a majority acknowledged a heartbeat, from the
+    time it was sent, so its lease ends before any of its followers' do,
+    and it steps down once its lease runs out.
+
+    A new leader first proposes the newest state accepted by its Prepare
+    quorum, since that state may have been committed. The leader proposes
+    one version at a time, so within a ballot a higher version extends a
+    lower one: the newest state is the one of the highest ballot, then of
+    the highest version.
+
+    Attributes:
+        replicas: A dict of the other replicas' names to port numbers
+        state: The committed directory state
+        version: Version of the committed state
+        accepted_state: The (ballot, version, state) last accepted
+        pending_version: Version of the proposal waiting for its quorum
+        leading: True while this replica is the leader
+        apply: Called with every newly committed state
+        on_lead: Called with the committed state once this replica leads
+        on_step_down: Called once this replica stops leading
+    """
+    heartbeat_interval = 0.5
+    lease_duration = 1.5
+    # The longest a send to another replica may take, so a hung replica cannot hold up a quorum
+    send_deadline = 0.5
+    # The longest a follower holds a write while a leader is elected
+    forward_timeout = 3
+
+    def __init__(self, port, ports, state, connection_pool, fan_out, apply, on_lead, on_step_down):
+        PaxosNode.__init__(self)
+        self.group = REPLICA_GROUP
+        self.name = REPLICA_GROUP + str(port)
+        self.port = port
+        self.peer_num = sorted(ports).index(port) + 1
+        self.replicas = {REPLICA_GROUP + str(other): other for other in ports if other != port}
+        self.connection_pool = connection_pool
+        self.fan_out = fan_out
+        self.apply = apply
+        self.on_lead = on_lead
+        self.on_step_down = on_step_down
+
+        self.state = state
+        self.version = 0
+        self.accepted_state = (NO_BALLOT, 0, state)
+        self.pending_version = None
+        self.leading = False
+        # When this replica last promised another's Prepare
+        self.promised_at = 0
+        # Serializes proposals, so each extends the version committed before it
+        self.write_lock = Lock()
+        self.commit_lock = Lock()
+
+    def start(self):
+        Thread(target=self.watch_leader, daemon=True).start()
+
+    def send_to_port(self, address, port, msg, need_reply=False, timeout=5, retries=3):
+        reply = self.connection_pool.send(address, port, msg, need_reply, timeout)
+        if need_reply and reply is not None:
+            return json.loads(reply.decode())
+        return reply
+
+    def send_to_replicas(self, msg):
+        self.fan_out.send_to_many([(name, port, msg) for name, port in self.replicas.items()], self.send_deadline)
+
+    def quorum_size(self):
+        """Returns the (members, needed) sizes of a majority of the replicas"""
+        members = len(self.replicas) + 1
+        return members, members // 2 + 1
+
+    def msg_promise(self):
+        msg = json.loads(PaxosNode.msg_promise(self))
+        msg["acceptedState"] = self.accepted_state
+        return json.dumps(msg).encode()
+
+    def msg_accept_state(self, version, state):
+        msg = json.loads(self.msg_accept(self.name))
+        msg["version"] = version
+        msg["state"] = state
+        return json.dumps(msg).encode()
+
+    def msg_accepted(self):
+        msg = json.loads(PaxosNode.msg_accepted(self))
+        msg["version"] = self.accepted_state[1]
+        return json.dumps(msg).encode()
+
+    def msg_heartbeat(self):
+        msg = json.loads(PaxosNode.msg_heartbeat(self))
+        msg["version"] = self.version
+        msg["state"] = self.state
+        return json.dumps(msg).encode()
+
+    def msg_heartbeat_ok(self):
+        msg = {}
+        msg["action"] = "HeartbeatOK"
+        msg["group"] = self.group
+        msg["name"] = self.name
+        msg["portNum"] = self.port
+        msg["seq"] = self.promise
+        return json.dumps(msg).encode()
+
+    def process_paxos(self, msg):
+        if msg["action"] == "Prepare" and msg["name"] != self.name:
+            PaxosNode.process_paxos(self, msg)
+            if self.promise == ballot(msg["seq"]):
+                self.promised_at = time.monotonic()
+            return
+        if msg["action"] == "Accept":
+            seq = ballot(msg["seq"])
+            accepted_seq, accepted_version, accepted_state = self.accepted_state
+            # Accepts may arrive out of order over separate connections, and an older one is dropped
+            if seq == self.promise and (seq, msg["version"]) <= (ballot(accepted_seq), accepted_version):
+                return
+            if seq == self.promise:
+                self.accepted_state = (seq, msg["version"], msg["state"])
+        PaxosNode.process_paxos(self, msg)
+
+    def receive_reply(self, msg):
+        # Accepted replies of the previous version must not count towards this one
+        if msg["action"] == "Accepted" and msg.get("version") != self.pending_version:
+            return
+        PaxosNode.receive_reply(self, msg)
+
+    def answer_heartbeat(self, msg):
+        """
+        Handles a heartbeat and returns the acknowledgement the leader waits
+        for. It carries this replica's promise, so it counts only towards the
+        ballot this replica follows.
+        """
+        self.receive_heartbeat(msg)
+        return self.msg_heartbeat_ok()
+
+    def receive_heartbeat(self, msg):
+        PaxosNode.receive_heartbeat(self, msg)
+        if msg["name"] == self.name or ballot(msg["seq"]) != self.promise:
+            return
+        # A leader with a ballot at least as high as ours has taken over
+        self.step_down()
+        self.commit(msg["version"], msg["state"])
+
+    def commit(self, version, state):
+        with self.commit_lock:
+            if version <= self.version:
+                return
+            self.version, self.state = version, state
+            self.apply(state)
+
+    def replicate(self, change):
+        """
+        Commits change(state) as the next version of the directory state.
+        Returns False if this replica is not leading or lost its quorum, in
+        which case it steps down.
+        """
+        with self.write_lock:
+            if not self.leading:
+                return False
+            return self.propose(change(copy.deepcopy(self.state)))
+
+    def propose(self, state):
+        """Runs phase 2 for one new version under the standing ballot"""
+        self.pending_version = max(self.version, self.accepted_state[1]) + 1
+        self.start_phase()
+        accept = self.msg_accept_state(self.pending_version, state)
+        self.send_to_replicas(accept)
+        self.process_paxos(json.loads(accept.decode()))
+        members, needed = self.quorum_size()
+        if not self.await_quorum(needed, members):
+            print("Replica {} lost its quorum.".format(self.name))
+            self.step_down()
+            return False
+        self.commit(self.pending_version, state)
+        # Followers learn of the commit from the heartbeat
+        self.send_heartbeat()
+        return True
+
+    def forward(self, received_message, need_reply):
+        """
+        Sends a write to the leader. Returns its reply, or True once sent
+        without one, or None if no leader is elected within forward_timeout
+        """
+        deadline = time.monotonic() + self.forward_timeout
+        while self.leader is None or self.leader == self.name or not self.lease_holds():
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(self.heartbeat_interval / 5)
+        reply = self.connection_pool.send("localhost", self.leader_port, received_message.encode('ascii'),
+                                          need_reply)
+        return reply.decode('ascii') if need_reply and reply is not None else reply
+
+    def watch_leader(self):
+        """Starts an election whenever no leader holds the lease"""
+        while True:
+            # Randomized, so replicas that lose their leader together rarely duel
+            time.sleep(random.uniform(self.heartbeat_interval, 2 * self.heartbeat_interval))
+            # A candidate this replica promised is given a lease's time to win before it is run against
+            contested = time.monotonic() < self.promised_at + self.lease_duration
+            if not self.leading and not self.lease_holds() and not contested:
+                self.elect()
+
+    def elect(self):
+        for attempt in range(self.election_attempts):
+            if attempt:
+                self.backoff(attempt)
+            if self.lease_holds():
+                return False
+            result = self.run_election()
+            if result is not None:
+                return result
+        return False
+
+    def run_election(self):
+        """
+        One Prepare round. Returns True when this replica won, False when the
+        election ended, and None when a competing proposal should be retried.
+        """
+        members, needed = self.quorum_size()
+        promised = self.promise
+        self.start_phase()
+        prepare = self.msg_prepare()
+        self.send_to_replicas(prepare)
+        self.process_paxos(json.loads(prepare.decode()))
+        if not self.await_quorum(needed, members):
+            with self.quorum:
+                # Only this replica relied on its promise to itself, which would otherwise
+                # refuse the heartbeats of a leader it never heard of
+                if self.promise == self.last_proposal:
+                    self.promise = promised
+            return self.retry_after_rejection()
+        newest = max((msg["acceptedState"] for msg in self.responses),
+                     key=lambda accepted: (ballot(accepted[0]), accepted[1]))
+        with self.write_lock:
+            self.leading = True
+            self.leader, self.leader_port = self.name, self.port
+            if not self.propose(newest[2]):
+                return False
+        print("Replica {} leads at version {}.".format(self.name, self.version))
+        Thread(target=self.lead, daemon=True).start()
+        self.on_lead(self.state)
+        return True
+
+    def retry_after_rejection(self):
+        """
+        Decides what to do with a Prepare round that missed its quorum
+        """
+        if not self.rejections:
+            return False
+        for msg in self.rejections:
+            if msg.get("leader"):
+                self.leader, self.leader_port = msg["leader"], msg["leaderPort"]
+                return False
+        # Retry in an election number above every promise seen
+        self.election_num = max([self.election_num] + [proposal_round(msg["promise"]) for msg in self.rejections])
+        return None
+
+    def send_heartbeat(self):
+        """
+        Sends the committed state to the other replicas. Once a majority,
+        this replica included, acknowledged it, renews this replica's lease
+        from the time it was sent and returns True.
+        """
+        sent_at = time.monotonic()
+        heartbeat = self.msg_heartbeat()
+        replies = self.fan_out.ask_many([(name, port, heartbeat) for name, port in self.replicas.items()],
+                                        self.send_deadline)
+        acks = [reply for reply in map(json.loads, replies.values()) if ballot(reply["seq"]) == self.last_proposal]
+        members, needed = self.quorum_size()
+        if len(acks) + 1 < needed:
+            return False
+        # The leader holds its own lease, so it refuses Prepares as its followers do
+        with self.quorum:
+            self.lease_expiry = max(self.lease_expiry, sent_at + self.lease_duration)
+        return True
+
+    def lead(self):
+        """Sends heartbeats for as long as this replica leads and holds its lease"""
+        while self.leading:
+            if not self.send_heartbeat() and not self.lease_holds():
+                print("Replica {} lost its lease.".format(self.name))
+                self.step_down()
+                return
+            time.sleep(self.heartbeat_interval)
+
+    def step_down(self):
+        with self.quorum:
+            leading, self.leading = self.leading, False
+        if leading:
+            print("Replica {} stepped down.".format(self.name))
+            self.on_step_down()
@@ -1,22 +1,77 @@
 import sys
-import socket
+import asyncio
 import json
 import threading
 import time
-import sqlite3
 from sqlite3 import Error
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from connectionPool import ConnectionPool, FanOut
+from failureDetector import FailureDetector
+from messageFraming import FrameError, encode_frame, read_frame_async
+from paxos import PAXOS_DIRECT
+from registrationReplica import REPLICA_GROUP, RegistrationReplica
+from registrationStorage import RegistrationStorage
 
 # Constants
 SERVER_PORT_NUM = 12345
-CONNECTION_TRIALS = 3
-CONNECTION_TRIALS_COOLDOWN = 1
+SERVER_BACKLOG = 128
+HEARTBEAT_INTERVAL = 1
+TIME_HOP_DEADLINE = 0.5
 HOST_NAME = 'localhost'
 CONTINENTAL_GROUPS = 6
 SUPER_PEER_LIST = []
-SLEEP_TIMER = 1
+# How the clock advances: 'rate' sends CLOCK_RATE ticks per second of wall time, 'max' sends
+# the next tick as soon as every live super peer acknowledges the last one, and 'virtual' as
+# soon as every node that acknowledged the last one has. Virtual mode is best-effort lockstep:
+# a node that misses CLOCK_ACK_TIMEOUT is left behind for that tick and waited for again once
+# it acknowledges a later one, so each tick is handled throughout the network before the next
+# only while every node answers within the timeout
+CLOCK_MODE = 'rate'
+CLOCK_RATE = 1.0
+# The longest max and virtual modes wait for a node's acknowledgement
+CLOCK_ACK_TIMEOUT = 1.0
+# Date of the last tick, or None to run forever
+CLOCK_END = None
+# The longest a replica goes without committing the clock to the others. A new leader resumes
+# from the last tick committed, so the ticks sent since are sent again and dropped as seen.
+CLOCK_REPLICATION_INTERVAL = 0.5
 DATABASE_NAME = 'registration.db'
+# Write-behind store of the clock and the super peer table, opened by setup_database
+STORAGE = None
+CONNECTION_POOL = ConnectionPool()
+FAN_OUT = FanOut(CONNECTION_POOL)
+# Super peer liveness by port number, fed by their heartbeats
+FAILURE_DETECTOR = FailureDetector(HEARTBEAT_INTERVAL)
+# Guards SUPER_PEER_LIST, shared by the server loop and the time thread
+STATE_LOCK = threading.Lock()
+# Ticks and super peer table versions are numbered within an epoch, which changes every time the
+# server starts. Replicas share the epoch of their first leader, so a failover keeps the numbering.
+TICK_EPOCH = int(time.time() * 1000)
+# Version of the super peer table, bumped by update_super_peer
+SUPER_PEER_VERSION = 0
+# Serialized QueryAck replies keyed by the version the client knew, None for the full table,
+# until the table next changes
+QUERY_CACHE = {}
+# [send time, {node name: receipt time}] per tick, keyed by tick sequence number, until the
+# tick is reported
+TICK_STATS = {}
+# Guards TICK_STATS and wakes the time thread as acknowledgements arrive
+TICK_LOCK = threading.Condition()
+# The running time thread. Replicated servers run it on the leading replica only.
+TIME_THREAD = None
+# Port numbers of every replica, this one included, or empty for a single server
+REPLICA_PORTS = []
+# This server's RegistrationReplica, opened by setup_database when REPLICA_PORTS is set
+REPLICA = None
+# Serializes the super peer decisions of registrations and elections, which a replica
+# makes while it waits on the others
+WRITE_LOCK = threading.Lock()
+# Runs the replicas' Prepare and Accept messages in order, off the event loop
+PAXOS_EXECUTOR = ThreadPoolExecutor(1)
+# Runs the registrations and elections of a replica, which wait on the others, off the event loop
+WRITE_EXECUTOR = ThreadPoolExecutor(8)
 
 
 ##################
@@ -36,6 +91,7 @@ class SuperPeer:
         - _clock_time: Super peer's current clock time
         - _election_count: Number of elections taken so far
         - _name: Super peer's name
+        - _version: SUPER_PEER_VERSION at which the super peer last changed
     """
 
     def __init__(self, group, port_number, election_count, name):
@@ -45,6 +101,7 @@ class SuperPeer:
         self._port_number = port_number
         self._election_count = election_count
         self._name = name
+        self._version = 0
 
 
 class ServerDateTime:
@@ -106,69 +163,195 @@ class TimeThread(threading.Thread):
         - Handles sending time updates to all the super peers
 
     Member Variables:
-        - Nothing
+        - _tick_seq: Sequence number of the last tick sent
+        - _mode: 'rate', 'max' or 'virtual', as CLOCK_MODE
+        - _rate: Ticks per second of wall time in rate mode
+        - _end: Date of the last tick, or None to run forever
+        - _members: Names of the nodes that acknowledged the last tick
+        - _stopped: Set by stop, once the replica running the clock no longer leads
     """
 
-    def __init__(self, start_day, start_month, start_year, start_hour):
+    def __init__(self, start_day, start_month, start_year, start_hour, mode=None, rate=None, end=None, tick_seq=0):
         threading.Thread.__init__(self)
         self._start_day = start_day
         self._start_month = start_month
         self._start_year = start_year
         self._start_hour = start_hour
+        self._tick_seq = tick_seq
+        self._mode = mode or CLOCK_MODE
+        self._rate = rate or CLOCK_RATE
+        self._end = end if end is not None else CLOCK_END
+        self._members = set()
+        self._stopped = threading.Event()
 
-    def run(self):
-        global SLEEP_TIMER
+    def stop(self):
+        """Stops the clock after the tick being sent"""
 
+        self._stopped.set()
+
+    def run(self):
         # We start at 7AM because we apply advance time right away
         server_datetime = ServerDateTime(self._start_day, self._start_month, self._start_year, self._start_hour)
+        started = time.monotonic()
+        first_seq = self._tick_seq
+        # The last tick sent and not yet saved, and when the clock was last saved
+        unsaved = None
+        saved_at = started
 
         # Increments the global timer and sends it to all the super peers
-        while True:
+        while not self._stopped.is_set():
             server_datetime.advance_time()
+            if self._end is not None and server_datetime._dateTime.date() > self._end:
+                break
             (server_date, server_time) = server_datetime.get_time()
             server_datetime.print_time()
-            update_time_database(server_date, server_time)
-            send_time_update(server_date, server_time)
-            time.sleep(SLEEP_TIMER)
+            self._tick_seq += 1
+            # The tick goes out before it is saved, so saving it adds no skew
+            waiting = send_time_update(server_date, server_time, self._tick_seq)
+            unsaved = (server_date, server_time, self._tick_seq)
+            # Each replicated save is a round among the replicas, so a replica saves only every
+            # CLOCK_REPLICATION_INTERVAL, as the storage writes to disk
+            if REPLICA is None or time.monotonic() >= saved_at + CLOCK_REPLICATION_INTERVAL:
+                update_time_database(*unsaved)
+                unsaved = None
+                saved_at = time.monotonic()
+            if self._mode == 'rate':
+                # Paced from the start, so the time spent sending does not slow the clock
+                self._stopped.wait(max(started + (self._tick_seq - first_seq) / self._rate - time.monotonic(), 0))
+            else:
+                if self._mode == 'virtual':
+                    waiting |= self._members
+                self._members = await_tick_acks(self._tick_seq, waiting, CLOCK_ACK_TIMEOUT)
+            report_tick(self._tick_seq)
 
+        if self._stopped.is_set():
+            print('Clock stopped after tick ' + str(self._tick_seq))
+            return
+        if unsaved is not None:
+            update_time_database(*unsaved)
+        print('Clock reached ' + str(self._end) + ' after ' + str(self._tick_seq) + ' ticks in '
+              + '{:.1f}'.format(time.monotonic() - started) + ' s')
 
-def send_time_update(server_date, server_time):
+
+def send_time_update(server_date, server_time, tick_seq):
     """
     Description:
         - Void function that sends a JSON message to tell all the super peers to update clocks
+        - Super peers are sent the tick concurrently, each within TIME_HOP_DEADLINE, and
+          forward it to their peers down a broadcast tree
 
     Args:
         - string server_date: The server's date
         - string server_time: The server's time
+        - int tick_seq: Sequence number of the tick within TICK_EPOCH
 
     Returns:
-        - Nothing
+        - The set of names of the super peers sent the tick
     """
 
     global SUPER_PEER_LIST
+    global CONNECTION_POOL
+    global FAILURE_DETECTOR
+    global STATE_LOCK
 
     # Creates a message from json
     message_dict = {}
     message_dict['action'] = 'TimeUpdate'
     message_dict['serverDate'] = server_date
     message_dict['serverTime'] = server_time
+    message_dict['tickEpoch'] = TICK_EPOCH
+    message_dict['tickSeq'] = tick_seq
+    # Receipts come back to the replica that sent the tick
+    message_dict['registrationPort'] = SERVER_PORT_NUM
     msg_string = json.dumps(message_dict)
 
-    # For each super peer, if they are alive, open up a connection and send them a time update
-    for super_peer in SUPER_PEER_LIST:
-        # Will also test for the port's health
-        if super_peer._port_number > 0 and test_super_peer(super_peer._port_number):
-            # print('Sending time update to port number ' + str(super_peer._port_number))
-            super_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            super_socket.connect(('localhost', super_peer._port_number))
-            super_socket.send(msg_string.encode('ascii'))
-            super_socket.close()
+    with STATE_LOCK:
+        super_peers = [(super_peer._name, super_peer._port_number) for super_peer in SUPER_PEER_LIST]
 
+    # Liveness comes from heartbeats, so a dead super peer costs no probe. Super peers
+    # that never send heartbeats, such as clients other than Node, are never suspected.
+    super_peers = [(name, super_port) for name, super_port in super_peers
+                   if super_port > 0 and not FAILURE_DETECTOR.is_suspected(super_port)]
+    targets = [(super_port, super_port, msg_string.encode('ascii')) for name, super_port in super_peers]
 
-def update_time_database(server_date, server_time):
-    """Saves the time onto the database"""
+    with TICK_LOCK:
+        TICK_STATS[tick_seq] = (time.time(), {})
 
-    global DATABASE_NAME
+    # Sends to every super peer not suspected at once over pooled connections
+    FAN_OUT.send_to_many(targets, TIME_HOP_DEADLINE)
+    return {name for name, super_port in super_peers}
+
+
+def record_tick_ack(name, tick_epoch, tick_seq, received_at):
+    """Records when a node received a tick"""
+
+    with TICK_LOCK:
+        if tick_epoch == TICK_EPOCH and tick_seq in TICK_STATS:
+            TICK_STATS[tick_seq][1][name] = received_at
+            TICK_LOCK.notify_all()
+
+
+def await_tick_acks(tick_seq, names, timeout):
+    """
+    Description:
+        - Waits until every named node acknowledges a tick, giving up on the rest once
+          timeout passes
+
+    Args:
+        - int tick_seq: Sequence number of the tick
+        - set names: Names of the nodes to wait for
+        - float timeout: The longest wait in seconds
+
+    Returns:
+        - The set of names of the nodes that acknowledged the tick so far
+    """
+
+    with TICK_LOCK:
+        if tick_seq not in TICK_STATS:
+            return set()
+        received = TICK_STATS[tick_seq][1]
+        TICK_LOCK.wait_for(lambda: names <= received.keys(), timeout)
+        acked = set(received)
+
+    # A node that missed the timeout is waited for again once it acknowledges a tick
+    if names - acked:
+        print('Tick ' + str(tick_seq) + ' not acknowledged by ' + ', '.join(sorted(names - acked)))
+    return acked
+
+
+def report_tick(tick_seq):
+    """
+    Description:
+        - Prints how many nodes a tick reached and the spread between the first and the
+          last of them, then forgets the tick
+
+    Args:
+        - int tick_seq: Sequence number of the tick
+
+    Returns:
+        - The (nodes, spread, slowest) tuple, spread and slowest in seconds, or None
+    """
+
+    with TICK_LOCK:
+        sent_at, received = TICK_STATS.pop(tick_seq, (None, {}))
+    if not received:
+        return None
+    received = received.values()
+    spread = max(received) - min(received)
+    slowest = max(received) - sent_at
+    print('Tick ' + str(tick_seq) + ' reached ' + str(len(received)) + ' nodes, spread '
+          + '{:.1f}'.format(spread * 1000) + ' ms, last ' + '{:.1f}'.format(slowest * 1000) + ' ms after send')
+    return len(received), spread, slowest
+
+
+def update_time_database(server_date, server_time, tick_seq=None):
+    """
+    Saves the time onto the database, without waiting for the disk. A replica commits it to
+    the others first, so the next leader resumes the clock after it.
+    """
+
+    global STORAGE
+    global REPLICA
 
     # Get date components
     server_date_list = server_date.split('/')
@@ -179,13 +362,14 @@ def update_time_database(server_date, server_time):
     # Get hour
     server_hour = int(server_time.split(':')[0])
 
-    # Updates and commits the changes
-    db_connection = sqlite3.connect(DATABASE_NAME)
-    db_cursor = db_connection.cursor()
-    db_cursor.execute('''UPDATE date_time_table SET month=?, day=?, hour=?
-                      WHERE year=?''', [server_month, server_day, server_hour, server_year,])
-    db_connection.commit()
-    db_connection.close()
+    # Saved by every replica once committed
+    if REPLICA is not None:
+        REPLICA.replicate(lambda state: dict(state, clock=[server_year, server_month, server_day, server_hour],
+                                             tickSeq=tick_seq))
+        return
+
+    # Committed by the storage's flusher thread along with any other change
+    STORAGE.record_tick(server_year, server_month, server_day, server_hour)
 
 
 ##################
@@ -195,9 +379,9 @@ def update_time_database(server_date, server_time):
 def server_process():
     """
     Description:
-        - Starts up a server-side process by creating a server socket, binds to it,
-          and continually listens to incoming connections.
-        - Will spawn new client threads whenever a connection successfully connects to it
+        - Starts up a non-blocking server on an asyncio event loop
+        - A single thread accepts every connection and reads its framed messages,
+          so a burst of registrations never waits for a thread per request
 
     Args:
         - Nothing
@@ -207,86 +391,210 @@ def server_process():
     """
 
     global SERVER_PORT_NUM
+    global SERVER_BACKLOG
     global HOST_NAME
 
-    # Creates a socket at the port number and binds to it
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((HOST_NAME, SERVER_PORT_NUM))
-    server_socket.listen(5)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(asyncio.start_server(handle_connection, HOST_NAME, SERVER_PORT_NUM,
+                                                 backlog=SERVER_BACKLOG, reuse_address=True))
 
     # Main Server Loop
-    while True:
-        # Accept message from any connected clients
-        (client_socket, client_address) = server_socket.accept()
+    loop.run_forever()
 
-        # Receive message from client
-        received_message = client_socket.recv(1024).decode('ascii')
 
-        # Spawns a client thread to solve the message
-        client_thread = ClientThread(client_socket, client_address, received_message)
-        client_thread.start()
+async def handle_connection(reader, writer):
+    """
+    Description:
+        - Serves framed messages on one connection until the client closes it
+        - Replies are sent as frames on the same connection
 
+    Args:
+        - reader, writer: The asyncio streams of the connection
+
+    Returns:
+        - Nothing
+    """
+
+    loop = asyncio.get_running_loop()
+    # Replies still being worked out off the loop, held until done
+    replies = set()
+    try:
+        while True:
+            received_message = await read_frame_async(reader)
+
+            # Connection probes and closed connections carry no message
+            if received_message is None:
+                break
+            try:
+                received_message = received_message.decode('ascii')
+                executor = message_executor(received_message)
+                if executor is not None:
+                    reply = loop.create_task(reply_off_loop(executor, received_message, writer))
+                    replies.add(reply)
+                    reply.add_done_callback(replies.discard)
+                    continue
+                ack_message = handle_message(received_message)
+            except (ValueError, KeyError, TypeError, IndexError):
+                print('Syntax Error, this should not happen')
+                continue
+            if ack_message is not None:
+                writer.write(encode_frame(ack_message.encode('ascii')))
+                await writer.drain()
+    except (FrameError, ConnectionError):
+        pass
+    finally:
+        writer.close()
 
-#################
-# CLIENT THREAD #
-#################
 
-class ClientThread(threading.Thread):
+async def reply_off_loop(executor, received_message, writer):
+    """
+    Description:
+        - Runs handle_message on an executor and sends its reply, if any, on the connection
+        - The connection goes on reading meanwhile, since its sender may use it next for a
+          message the handler waits for, such as the Accepted of a follower that forwarded
+          the write
+
+    Args:
+        - executor: The executor chosen by message_executor
+        - string received_message: The JSON message
+        - writer: The asyncio stream the reply goes to
+
+    Returns:
+        - Nothing
     """
-    Client Thread Class
 
+    try:
+        ack_message = await asyncio.get_running_loop().run_in_executor(executor, handle_message, received_message)
+        if ack_message is not None and not writer.is_closing():
+            writer.write(encode_frame(ack_message.encode('ascii')))
+            await writer.drain()
+    except (ValueError, KeyError, TypeError, IndexError):
+        print('Syntax Error, this should not happen')
+    except ConnectionError:
+        writer.close()
+
+
+###################
+# MESSAGE HANDLER #
+###################
+
+def message_executor(received_message):
+    """
+    Description:
+        - Picks where a replica handles a message: the others' Prepare and Accept run in order
+          on PAXOS_EXECUTOR, registrations and elections on WRITE_EXECUTOR since they wait on
+          the other replicas, and everything else on the event loop
+
+    Args:
+        - string received_message: The JSON message
+
+    Returns:
+        - The executor to run handle_message on, or None for the event loop
+    """
+
+    global REPLICA
+
+    # A single server never blocks, so it skips the extra parse
+    if REPLICA is None:
+        return None
+
+    message_dict = json.loads(received_message)
+    if message_dict.get('group') == REPLICA_GROUP:
+        return None if message_dict['action'] in PAXOS_DIRECT else PAXOS_EXECUTOR
+    if message_dict['action'] in ('Register', 'Election'):
+        return WRITE_EXECUTOR
+    return None
+
+
+def forward_write(received_message, need_reply):
+    """
+    Description:
+        - Sends a registration or an election received by a follower on to the leading replica
+
+    Args:
+        - string received_message: The JSON message
+        - bool need_reply: True if the sender waits for a reply
+
+    Returns:
+        - The leader's JSON reply, or None if the action has no reply
+    """
+
+    global REPLICA
+
+    reply = REPLICA.forward(received_message, need_reply)
+
+    # Without a leader the connection is dropped, so the node tries the next replica
+    if reply is None and need_reply:
+        raise ConnectionError('No leading replica')
+    if reply is None:
+        print('No leading replica, dropped ' + received_message)
+    return reply if need_reply else None
+
+
+def handle_message(received_message):
+    """
     Description:
         - Handles actions recognition and calls the relevant functions
-        - Will close the client socket afterwards
+        - Runs on the event loop thread, so it must never block on the network, except for
+          the messages message_executor hands to a thread
 
-    Member Variables:
-        - _client_socket: Super peer's port number
-        - _client_address: Super peer's current clock time
-        - _received_message: Number of elections taken so far
+    Args:
+        - string received_message: The JSON message
+
+    Returns:
+        - The JSON string to send back, or None if the action has no reply
     """
 
-    def __init__(self, client_socket, client_address, received_message):
-        threading.Thread.__init__(self)
-        self._client_socket = client_socket
-        self._client_address = client_address
-        self._received_message = received_message
+    global SUPER_PEER_LIST
+    global STATE_LOCK
 
-    def run(self):
+    #########################
+    #                       #
+    # action:   Register    #
+    # group:    0           #
+    # name:     'PeerName'  #
+    # portNum:  0           #
+    #                       #
+    #########################
+
+    message_dict = json.loads(received_message)
+    ack_dict = {}
 
-        global SUPER_PEER_LIST
+    action = message_dict['action']
 
-        #########################
-        #                       #
-        # action:   Register    #
-        # group:    0           #
-        # name:     'PeerName'  #
-        # portNum:  0           #
-        #                       #
-        #########################
+    # Handles the messages among the replicas. The leader waits for the acknowledgement of a heartbeat.
+    if message_dict.get('group') == REPLICA_GROUP:
+        if action == 'Heartbeat':
+            return REPLICA.answer_heartbeat(message_dict).decode('ascii')
+        REPLICA.process_paxos(message_dict)
+        return None
 
-        message_dict = json.loads(self._received_message)
-        ack_dict = {}
+    # Only the leading replica decides on the super peer table
+    if action in ('Register', 'Election') and REPLICA is not None and not REPLICA.leading:
+        return forward_write(received_message, action == 'Register')
 
-        action = message_dict['action']
+    # Handles a peer registration
+    if action == 'Register':
 
-        # Handles a peer registration
-        if action == 'Register':
+        # The peer has this information in the original message
+        continental_group = message_dict['group']
+        new_port = message_dict['portNum']
+        new_name = message_dict['name']
 
-            # The peer has this information in the original message
-            continental_group = message_dict['group']
-            new_port = message_dict['portNum']
-            new_name = message_dict['name']
+        print('Received Registration Request from port number ' + str(new_port))
 
-            print('Received Registration Request from port number ' + str(new_port))
+        # The decision and the update must not interleave with another registration of the group
+        with WRITE_LOCK:
             super_port_number = handle_registration(new_port, new_name, continental_group)
+            updated = True
 
             # If this is the first peer, will register it as the new super peer
             if super_port_number == 0:
                 # The peer has this information in the original message
                 election_count = 0
 
-                update_super_peer(new_name, new_port, continental_group, election_count)
+                updated = update_super_peer(new_name, new_port, continental_group, election_count)
                 ack_dict['action'] = 'RegisterURSuper'
                 ack_dict['elecNum'] = election_count
 
@@ -295,7 +603,7 @@ class ClientThread(threading.Thread):
                 # The peer has this information in the original message
                 election_count = SUPER_PEER_LIST[continental_group]._election_count + 1
 
-                update_super_peer(new_name, new_port, continental_group, election_count)
+                updated = update_super_peer(new_name, new_port, continental_group, election_count)
                 ack_dict['action'] = 'RegisterURSuper'
                 ack_dict['elecNum'] = election_count
 
@@ -304,7 +612,7 @@ class ClientThread(threading.Thread):
                 # The peer has this information in the original message
                 election_count = SUPER_PEER_LIST[continental_group]._election_count + 1
 
-                update_super_peer(new_name, new_port, continental_group, election_count)
+                updated = update_super_peer(new_name, new_port, continental_group, election_count)
                 ack_dict['action'] = 'RegisterURSuper'
                 ack_dict['elecNum'] = election_count
 
@@ -313,59 +621,91 @@ class ClientThread(threading.Thread):
                 ack_dict['action'] = 'RegisterOK'
                 ack_dict['portNum'] = super_port_number
 
-            ack_message = json.dumps(ack_dict)
-            self._client_socket.send(ack_message.encode('ascii'))
-
-        #########################
-        #                       #
-        # action:   Election    #
-        # group:    0           #
-        # name:     'PeerName'  #
-        # portNum:  0           #
-        # eleNum:   0           #
-        #                       #
-        #########################
-
-        # Handles a super group election
-        elif action == 'Election':
-
-            # Fill up details
-            new_name = message_dict['name']
-            new_port = message_dict['portNum']
-            continental_group = message_dict['group']
-            election_count = message_dict['elecNum']
-            print('Received Election Update from port number ' + str(new_port))
-
-            # Finally handles the election and prints a message
-            handle_message = handle_election(new_name, new_port, continental_group, election_count)
-
-            if handle_message != 'ALL_GOOD':
-                print(handle_message)
-            else:
-                print('Exchange ' + new_name + ' in continental group ' + str(continental_group) + ' with port number '
-                    + str(new_port) + ' has gone through an election and is currently at '
-                    + str(election_count) + ' elections.')
+        # A replica that lost its quorum drops the connection, so the peer registers at another
+        if not updated:
+            raise ConnectionError('Registration not replicated')
 
-        #########################
-        #                       #
-        # action:   Query       #
-        # group:    0           #
-        #                       #
-        #########################
+        return json.dumps(ack_dict)
 
-        # Handles a super query
-        elif action == 'Query':
+    #########################
+    #                       #
+    # action:   Election    #
+    # group:    0           #
+    # name:     'PeerName'  #
+    # portNum:  0           #
+    # eleNum:   0           #
+    #                       #
+    #########################
+
+    # Handles a super group election
+    elif action == 'Election':
 
-            print('Received Query from group number ' + str(message_dict['group']))
-            ack_message = handle_super_query(message_dict['group'])
-            self._client_socket.send(ack_message.encode('ascii'))
+        # Fill up details
+        new_name = message_dict['name']
+        new_port = message_dict['portNum']
+        continental_group = message_dict['group']
+        election_count = message_dict['elecNum']
+        print('Received Election Update from port number ' + str(new_port))
 
-        # Handles a syntax error
+        # Finally handles the election and prints a message
+        with WRITE_LOCK:
+            election_message = handle_election(new_name, new_port, continental_group, election_count)
+
+        if election_message != 'ALL_GOOD':
+            print(election_message)
         else:
-            print('Syntax Error, this should not happen')
+            print('Exchange ' + new_name + ' in continental group ' + str(continental_group) + ' with port number '
+                + str(new_port) + ' has gone through an election and is currently at '
+                + str(election_count) + ' elections.')
+
+    #########################
+    #                       #
+    # action:   Heartbeat   #
+    # group:    0           #
+    # name:     'PeerName'  #
+    # portNum:  0           #
+    #                       #
+    #########################
+
+    # Handles a super peer heartbeat, which needs no reply
+    elif action == 'Heartbeat':
+
+        FAILURE_DETECTOR.heartbeat(message_dict['portNum'])
+
+    #########################
+    #                       #
+    # action:   TickAck     #
+    # name:     'PeerName'  #
+    # tickEpoch: 0          #
+    # tickSeq:  0           #
+    # receivedAt: 0.0       #
+    #                       #
+    #########################
 
-        # Finally close the socket
-        self._client_socket.close()
+    # Handles a node's receipt of a tick, which needs no reply
+    elif action == 'TickAck':
+
+        record_tick_ack(message_dict['name'], message_dict['tickEpoch'], message_dict['tickSeq'], message_dict['receivedAt'])
+
+    #########################
+    #                       #
+    # action:   Query       #
+    # group:    0           #
+    #                       #
+    #########################
+
+    # Handles a super query
+    elif action == 'Query':
+
+        print('Received Query from group number ' + str(message_dict['group']))
+        with STATE_LOCK:
+            return handle_super_query(message_dict['group'], message_dict.get('version'))
+
+    # Handles a syntax error
+    else:
+        print('Syntax Error, this should not happen')
+
+    return None
 
 
 ########################
@@ -403,11 +743,9 @@ def handle_registration(new_port, new_name, continental_group):
     ##############################
 
     global SUPER_PEER_LIST
-    global CONNECTION_TRIALS
-
-    try_num = CONNECTION_TRIALS
+    global FAILURE_DETECTOR
 
-    # Tests for the super peer's connection, returns the port number if successful, else -1
+    # Returns the super peer's port number if it is sending heartbeats, else -1
     super_port = SUPER_PEER_LIST[continental_group]._port_number
     super_name = SUPER_PEER_LIST[continental_group]._name
 
@@ -428,56 +766,16 @@ def handle_registration(new_port, new_name, continental_group):
         print('Peer connecting for the first time')
         return 0
 
-    # Tries to connect to a super peer for CONNECTION_TRIALS number of times
-    while try_num > 0:
-        # If the test is positive, will return the super peer's port number
-        if test_super_peer(super_port):
-            print('Super peer is alive!')
-            return super_port
-        # Otherwise it will decrement the number of tries by 1 and wait a bit
-        try_num -= 1
-        time.sleep(CONNECTION_TRIALS_COOLDOWN)
+    # The answer is cached, so registrations never wait on a probe
+    if FAILURE_DETECTOR.is_alive(super_port):
+        print('Super peer is alive!')
+        return super_port
 
     # Returns -1 to indicate super peer was dead and the super group needs a new super peer
     print('Super peer is dead, need a new super peer')
     return -1
 
 
-def test_super_peer(super_peer_port_number):
-    """
-    Description:
-        - Tests for the presence of a super peer
-
-    Args:
-        - int super_peer_port_number: Super peer's port number
-
-    Returns:
-        - True: Super Peer is still alive
-        - False: Super Peer is not alive and/or election is in progress
-    """
-
-    global HOST_NAME
-
-    # Socket number must be greater than 0
-    if super_peer_port_number < 0:
-        return False
-
-    # Creates a new socket and sets the timeout to 0.1 seconds
-    super_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    super_socket.settimeout(0.1)
-
-    # Tries to connect to the super peer socket
-    try:
-        super_socket.connect((HOST_NAME, super_peer_port_number))
-    except socket.error:
-        super_socket.close()
-        return False
-
-    # If it's all good, return True
-    super_socket.close()
-    return True
-
-
 ####################
 # ELECTION HANDLER #
 ####################
@@ -501,22 +799,20 @@ def handle_election(new_name, new_port, continental_group, election_count):
 
     global SUPER_PEER_LIST
     global CONTINENTAL_GROUPS
+    global FAILURE_DETECTOR
 
     # Need to test if continentalGroup is within range
     if continental_group < 0 or continental_group > CONTINENTAL_GROUPS:
         return 'New Continental Group ' + str(continental_group) + ' is not in range'
 
-    # Tests new port to see if new port actually works
-    if not test_super_peer(new_port):
-        return 'New Port number ' + str(new_port) + ' is dead'
-
     # Tests if the election count is actually higher than what we have
     if election_count <= SUPER_PEER_LIST[continental_group]._election_count:
         return ('New Election count of ' + str(election_count) + 'is too low. Current election count is at '
                + str(SUPER_PEER_LIST[continental_group]._election_count))
 
     # If all test are passed, just update the super peer list
-    update_super_peer(new_name, new_port, continental_group, election_count)
+    if not update_super_peer(new_name, new_port, continental_group, election_count):
+        return 'Election in continental group ' + str(continental_group) + ' was not replicated'
 
     return 'ALL_GOOD'
 
@@ -526,6 +822,7 @@ def update_super_peer(new_name, new_port, continental_group, election_count):
     Description:
         - Handles a super peer update, by updating the super peer's list with the new information
         - Works for both new super peers and old super peers
+        - A replica commits the update to the others, and every replica applies it once committed
         - Note: no checking!
 
     Args:
@@ -534,39 +831,168 @@ def update_super_peer(new_name, new_port, continental_group, election_count):
         - int continental_group: Continental group of the new super peer
         - int election_count: Number of elections so far for continental group
 
+    Returns:
+        - True once updated, False if the replica no longer leads or lost its quorum
+    """
+
+    global SUPER_PEER_VERSION
+    global STATE_LOCK
+    global REPLICA
+
+    if REPLICA is not None:
+        return REPLICA.replicate(lambda state: change_super_peer(state, new_name, new_port, continental_group,
+                                                                 election_count))
+
+    with STATE_LOCK:
+        apply_super_peer(new_name, new_port, continental_group, election_count, SUPER_PEER_VERSION + 1)
+    return True
+
+
+def apply_super_peer(new_name, new_port, continental_group, election_count, version):
+    """
+    Description:
+        - Updates the super peer's list and the database with a group's new super peer
+        - The caller holds STATE_LOCK
+
+    Args:
+        - int new_name: Name of the new super peer
+        - int new_port: Port number of the new super peer
+        - int continental_group: Continental group of the new super peer
+        - int election_count: Number of elections so far for continental group
+        - int version: SUPER_PEER_VERSION of the update
+
     Returns:
         - Nothing
     """
 
     global SUPER_PEER_LIST
-    global DATABASE_NAME
+    global SUPER_PEER_VERSION
+    global STORAGE
+    global FAILURE_DETECTOR
 
-    # Update locally
+    # A new super peer has just contacted us, which counts as its first heartbeat
+    FAILURE_DETECTOR.remove(SUPER_PEER_LIST[continental_group]._port_number)
+    FAILURE_DETECTOR.heartbeat(new_port)
+
+    # Update locally, and forget the replies to queries about the old table
+    SUPER_PEER_VERSION = version
     SUPER_PEER_LIST[continental_group]._name = new_name
     SUPER_PEER_LIST[continental_group]._port_number = new_port
     SUPER_PEER_LIST[continental_group]._election_count = election_count
+    SUPER_PEER_LIST[continental_group]._version = SUPER_PEER_VERSION
+    QUERY_CACHE.clear()
+
+    # Update remotely, leaving the disk write to the flusher thread
+    STORAGE.record_super_peer(continental_group, new_port, election_count, new_name)
 
-    # Update remotely
-    db_connection = sqlite3.connect(DATABASE_NAME)
-    db_cursor = db_connection.cursor()
-    db_cursor.execute('''UPDATE super_peers_table SET port_number=?, election_count=?, name=?
-                      WHERE group_id=?''', [new_port, election_count, new_name, continental_group,])
-    db_connection.commit()
-    db_connection.close()
+
+####################
+# REPLICATED STATE #
+####################
+
+def directory_state(date_time_row):
+    """
+    Description:
+        - Returns the state the replicas agree on, built from this server's table and clock:
+          {'epoch': TICK_EPOCH, 'tickSeq': 0, 'clock': [year, month, day, hour],
+          'peerVersion': SUPER_PEER_VERSION, 'superPeers': [[port, elecNum, name, version], ...]}
+
+    Args:
+        - tuple date_time_row: The (year, month, day, hour) of the latest saved tick
+
+    Returns:
+        - The state as a JSON-serializable dict
+    """
+
+    global SUPER_PEER_LIST
+
+    with STATE_LOCK:
+        super_peers = [[super_peer._port_number, super_peer._election_count, super_peer._name, super_peer._version]
+                       for super_peer in SUPER_PEER_LIST]
+
+    return {'epoch': TICK_EPOCH, 'tickSeq': 0, 'clock': list(date_time_row), 'peerVersion': SUPER_PEER_VERSION,
+            'superPeers': super_peers}
+
+
+def change_super_peer(state, new_name, new_port, continental_group, election_count):
+    """Returns the replicated state with a group's new super peer"""
+
+    state['peerVersion'] += 1
+    state['superPeers'][continental_group] = [new_port, election_count, new_name, state['peerVersion']]
+    return state
+
+
+def apply_directory_state(state):
+    """
+    Description:
+        - Applies a state committed by the replicas to the super peer's list, the query
+          version and the database
+
+    Args:
+        - dict state: The committed state, as directory_state
+
+    Returns:
+        - Nothing
+    """
+
+    global SUPER_PEER_LIST
+    global SUPER_PEER_VERSION
+    global TICK_EPOCH
+    global STORAGE
+
+    with STATE_LOCK:
+        for group, (port_number, election_count, name, version) in enumerate(state['superPeers']):
+            super_peer = SUPER_PEER_LIST[group]
+            known = (super_peer._port_number, super_peer._election_count, super_peer._name)
+            if known != (port_number, election_count, name):
+                apply_super_peer(name, port_number, group, election_count, version)
+            super_peer._version = version
+
+        # Versions of the first leader's epoch hold at every replica
+        if (TICK_EPOCH, SUPER_PEER_VERSION) != (state['epoch'], state['peerVersion']):
+            TICK_EPOCH, SUPER_PEER_VERSION = state['epoch'], state['peerVersion']
+            QUERY_CACHE.clear()
+
+    STORAGE.record_tick(*state['clock'])
+
+
+def start_clock(state):
+    """Starts the time thread from the committed clock, once this replica leads"""
+
+    global TIME_THREAD
+
+    year, month, day, hour = state['clock']
+    TIME_THREAD = TimeThread(day, month, year, hour, tick_seq=state['tickSeq'])
+    TIME_THREAD.start()
+
+
+def stop_clock():
+    """Stops the time thread, once this replica no longer leads"""
+
+    global TIME_THREAD
+
+    if TIME_THREAD is not None:
+        TIME_THREAD.stop()
+        TIME_THREAD = None
 
 
 #################
 # QUERY HANDLER #
 #################
 
-def handle_super_query(group):
+def handle_super_query(group, known_version=None):
     """
     Description:
         - Handles a super peer query by returning a JSON filled with each known super
           peer information, including port number and election count
+        - A client that sends the version of the table it knows is told it is not modified,
+          or sent only the super peers that changed since
+        - Replies are serialized once per version of the table, so a burst of queries costs
+          one dictionary lookup each
 
     Args:
-        - Nothing
+        - int group: Continental group of the client
+        - list known_version: The [epoch, version] of the table the client knows, or None
 
     Returns:
         - json_string: Returns the json string filled with the information
@@ -592,17 +1018,38 @@ def handle_super_query(group):
     #   }                       #
     #   ...                     #
     # ]                         #
+    # version:  [0, 0]          #
+    # notModified / delta: true #
     #                           #
     #############################
 
     global SUPER_PEER_LIST
+    global SUPER_PEER_VERSION
+    global QUERY_CACHE
+
+    # Versions of an earlier epoch, or a later version, say nothing about this table
+    since = None
+    if known_version is not None and known_version[0] == TICK_EPOCH and 0 <= known_version[1] <= SUPER_PEER_VERSION:
+        since = known_version[1]
+
+    json_string = QUERY_CACHE.get(since)
+    if json_string is not None:
+        return json_string
 
     query_ack = {}
     super_groups = []
 
     query_ack['action'] = 'QueryAck'
+    query_ack['version'] = [TICK_EPOCH, SUPER_PEER_VERSION]
+
+    if since == SUPER_PEER_VERSION:
+        query_ack['notModified'] = True
+    elif since is not None:
+        query_ack['delta'] = True
 
     for super_peer in SUPER_PEER_LIST:
+        if since is not None and super_peer._version <= since:
+            continue
         super_dict = {}
         super_dict['group'] = super_peer._group
         super_dict['name'] = super_peer._name
@@ -611,9 +1058,11 @@ def handle_super_query(group):
 
         super_groups.append(super_dict)
 
-    query_ack['superPeers'] = super_groups
+    if since != SUPER_PEER_VERSION:
+        query_ack['superPeers'] = super_groups
 
     json_string = json.dumps(query_ack)
+    QUERY_CACHE[since] = json_string
     return json_string
 
 
@@ -622,59 +1071,54 @@ def handle_super_query(group):
 #################
 
 def setup_database():
-    """"""
+    """
+    Description:
+        - Opens the registration database, creating it if needed, and recovers the super peer
+          table and the latest tick from it
+        - Starts the time thread from the recovered tick, or with REPLICA_PORTS the replica,
+          which starts it once elected
+
+    Args:
+        - Nothing
+
+    Returns:
+        - Nothing
+    """
+
     global DATABASE_NAME
     global CONTINENTAL_GROUPS
+    global STORAGE
+    global REPLICA
+    global TIME_THREAD
 
     # Connect to sqlite database
     try:
-        db_connection = sqlite3.connect(DATABASE_NAME)
+        STORAGE = RegistrationStorage(DATABASE_NAME, CONTINENTAL_GROUPS)
     except Error as e:
         print(e)
         exit(0)
 
-    # Get a cursor
-    db_cursor = db_connection.cursor()
-
-    # Create super peers table
-    db_cursor.execute('''CREATE TABLE IF NOT EXISTS super_peers_table
-                      (group_id INTEGER PRIMARY KEY, port_number INTEGER, election_count INTEGER, name text)''')
-
-    # Create datetime table
-    db_cursor.execute('''CREATE TABLE IF NOT EXISTS date_time_table
-        (year INTEGER PRIMARY KEY, month INTEGER, day INTEGER, hour INTEGER)''')
-
-    # Sets up the super peers if they do not exist
-    db_cursor.execute('''INSERT OR IGNORE INTO super_peers_table (group_id, port_number, election_count, name)
-                      VALUES (0, -1, 0, 'UNIDENTIFIED'), (1, -1, 0, 'UNIDENTIFIED'), (2, -1, 0, 'UNIDENTIFIED'),
-                      (3, -1, 0, 'UNIDENTIFIED'), (4, -1, 0, 'UNIDENTIFIED'), (5, -1, 0, 'UNIDENTIFIED')''')
-
-    # Sets up the datetime if it does not exist
-    db_cursor.execute('''INSERT OR IGNORE INTO date_time_table (year, month, day, hour) VALUES (2016, 1, 1, 7)''')
-
-    # Save (commit) the changes
-    db_connection.commit()
-
-    # Grab all the contents from super peers table
-    db_cursor.execute('''SELECT * FROM super_peers_table''')
-    all_rows = db_cursor.fetchall()
+    super_peer_rows, date_time_row = STORAGE.load()
 
     # Populates the Super Peer List with the saved super peers
     for i in range(CONTINENTAL_GROUPS):
-        super_peer_tuple = all_rows[i]
+        super_peer_tuple = super_peer_rows[i]
         super_peer = SuperPeer(super_peer_tuple[0], super_peer_tuple[1], super_peer_tuple[2], super_peer_tuple[3])
         SUPER_PEER_LIST.append(super_peer)
+        # Saved super peers get one detection period to resume their heartbeats
+        if super_peer._port_number > 0:
+            FAILURE_DETECTOR.heartbeat(super_peer._port_number)
 
-    # Grab all the contents from date time table
-    db_cursor.execute('''SELECT * FROM date_time_table''')
-    all_rows = db_cursor.fetchall()
+    # Replicas start from what they saved, and the state of the first leader prevails
+    if REPLICA_PORTS:
+        REPLICA = RegistrationReplica(SERVER_PORT_NUM, REPLICA_PORTS, directory_state(date_time_row), CONNECTION_POOL,
+                                      FAN_OUT, apply_directory_state, start_clock, stop_clock)
+        REPLICA.start()
+        return
 
     # Start the time thread
-    time_thread = TimeThread(all_rows[0][2], all_rows[0][1], all_rows[0][0], all_rows[0][3])
-    time_thread.start()
-
-    # Finally close the connection
-    db_connection.close()
+    TIME_THREAD = TimeThread(date_time_row[2], date_time_row[1], date_time_row[0], date_time_row[3])
+    TIME_THREAD.start()
 
 
 #################
@@ -688,14 +1132,36 @@ def main():
     global SUPER_PEER_LIST
     global DATABASE_NAME
     global SERVER_PORT_NUM
-
-    if len(sys.argv) == 2 and sys.argv[1].isdigit():
+    global CLOCK_MODE
+    global CLOCK_RATE
+    global CLOCK_END
+    global REPLICA_PORTS
+
+    # registrationServer.py [port] [ticks per second | max | virtual] [m/d/yyyy of the last tick | -]
+    #                       [comma-separated port numbers of the replicas]
+    if len(sys.argv) > 1 and sys.argv[1].isdigit():
         SERVER_PORT_NUM = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        if sys.argv[2] in ('max', 'virtual'):
+            CLOCK_MODE = sys.argv[2]
+        else:
+            CLOCK_RATE = float(sys.argv[2])
+    if len(sys.argv) > 3 and sys.argv[3] != '-':
+        CLOCK_END = datetime.datetime.strptime(sys.argv[3], '%m/%d/%Y').date()
+    if len(sys.argv) > 4:
+        REPLICA_PORTS = sorted({int(port) for port in sys.argv[4].split(',')} | {SERVER_PORT_NUM})
+        # Replicas on one machine keep a database each
+        DATABASE_NAME = 'registration' + str(SERVER_PORT_NUM) + '.db'
 
     # Sets up the database
     setup_database()
 
-    # Start the server process
-    server_process()
+    # Start the server process, saving what is left on the way out
+    try:
+        server_process()
+    finally:
+        STORAGE.close()
+
 
-main()
+if __name__ == "__main__":
+    main()
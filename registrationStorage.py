@@ -0,0 +1,149 @@
+import sqlite3
+from threading import Condition, Lock, Thread
+
+
+class RegistrationStorage():
+    """
+    Write-behind storage for the registration server's clock and super peer table.
+
+    The registration server keeps both in memory and records every change
+    here. A flusher thread writes whatever changed in one transaction over a
+    single SQLite connection, held open in WAL mode with synchronous=NORMAL:
+    a super peer change wakes it at once, and ticks alone are written at most
+    once every flush_interval seconds. Changes recorded while a flush runs
+    are committed together by the next one, so neither the clock thread nor
+    the event loop ever waits on the disk.
+
+    Crash-consistency rules:
+        1. The saved tick may lag the clock by up to flush_interval. On
+           restart the clock resumes from the saved tick, so the ticks of
+           that interval are sent again.
+        2. Rows hold absolute values, keyed by year and by group, so a flush
+           is idempotent and the newest value always wins.
+        3. A flush is one transaction: after a crash either every row of a
+           batch is on disk or none is. Rows of a failed flush are retried
+           by the next, unless a newer value arrived meanwhile.
+        4. A registration is answered before its super peer change is on
+           disk. A change lost in a crash costs the group one more election,
+           since the restarted server finds the previous super peer dead.
+
+    Attributes:
+        database_name: Path of the registration database
+        flush_interval: The longest a tick waits to be written, in seconds
+        dirty_tick: The (year, month, day, hour) of the newest tick not yet written
+        dirty_peers: A dict, keyed by group, of super peer rows not yet written
+    """
+    kCreateSuperPeers = '''CREATE TABLE IF NOT EXISTS super_peers_table
+                        (group_id INTEGER PRIMARY KEY, port_number INTEGER, election_count INTEGER, name text)'''
+    kCreateDateTime = '''CREATE TABLE IF NOT EXISTS date_time_table
+                      (year INTEGER PRIMARY KEY, month INTEGER, day INTEGER, hour INTEGER)'''
+    kInsertSuperPeer = '''INSERT OR IGNORE INTO super_peers_table (group_id, port_number, election_count, name)
+                       VALUES (?, -1, 0, 'UNIDENTIFIED')'''
+    kInsertDateTime = '''INSERT OR IGNORE INTO date_time_table (year, month, day, hour) VALUES (2016, 1, 1, 7)'''
+    kSelectSuperPeers = '''SELECT * FROM super_peers_table ORDER BY group_id'''
+    kSelectDateTime = '''SELECT * FROM date_time_table ORDER BY year DESC LIMIT 1'''
+    kWriteSuperPeer = '''INSERT OR REPLACE INTO super_peers_table (group_id, port_number, election_count, name)
+                      VALUES (?, ?, ?, ?)'''
+    kWriteDateTime = '''INSERT OR REPLACE INTO date_time_table (year, month, day, hour) VALUES (?, ?, ?, ?)'''
+
+    def __init__(self, database_name, groups=6, flush_interval=0.5):
+        self.database_name = database_name
+        self.flush_interval = flush_interval
+        self.dirty_tick = None
+        self.dirty_peers = {}
+        self.closed = False
+        # Guards the dirty rows and wakes the flusher when they change
+        self.changed = Condition()
+        # Guards the connection
+        self.flush_lock = Lock()
+
+        # Counters for debugging and benchmarks
+        self.flushes = 0
+        self.rows_written = 0
+
+        self.connection = sqlite3.connect(database_name, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(self.kCreateSuperPeers)
+            self.connection.execute(self.kCreateDateTime)
+            self.connection.executemany(self.kInsertSuperPeer, [(group,) for group in range(groups)])
+            self.connection.execute(self.kInsertDateTime)
+        self.flusher = Thread(target=self.__run, daemon=True)
+        self.flusher.start()
+
+    def load(self):
+        """
+        Returns the saved (group_id, port_number, election_count, name) rows
+        and the (year, month, day, hour) of the latest saved tick
+        """
+        with self.flush_lock:
+            super_peers = self.connection.execute(self.kSelectSuperPeers).fetchall()
+            date_time = self.connection.execute(self.kSelectDateTime).fetchone()
+        return super_peers, date_time
+
+    def record_tick(self, year, month, day, hour):
+        """Records the clock's newest tick"""
+        with self.changed:
+            self.dirty_tick = (year, month, day, hour)
+            self.changed.notify()
+
+    def record_super_peer(self, group, port_number, election_count, name):
+        """Records a group's new super peer, to be written at once"""
+        with self.changed:
+            self.dirty_peers[group] = (group, port_number, election_count, name)
+            self.changed.notify()
+
+    def flush(self):
+        """
+        Write every dirty row in one transaction. Returns the number of rows written.
+        """
+        with self.flush_lock:
+            with self.changed:
+                tick, peers = self.dirty_tick, self.dirty_peers
+                self.dirty_tick, self.dirty_peers = None, {}
+            rows = list(peers.values())
+            if tick is None and not rows:
+                return 0
+            try:
+                with self.connection:
+                    if tick is not None:
+                        self.connection.execute(self.kWriteDateTime, tick)
+                    self.connection.executemany(self.kWriteSuperPeer, rows)
+            except sqlite3.Error as e:
+                print("SQL ERROR: ", e)
+                # Keep the failed rows unless a newer value arrived meanwhile
+                with self.changed:
+                    if self.dirty_tick is None:
+                        self.dirty_tick = tick
+                    for group, row in peers.items():
+                        self.dirty_peers.setdefault(group, row)
+                return 0
+            self.flushes += 1
+            self.rows_written += len(rows) + (tick is not None)
+            return len(rows) + (tick is not None)
+
+    def pending(self):
+        with self.changed:
+            return len(self.dirty_peers) + (self.dirty_tick is not None)
+
+    def close(self):
+        """Writes what is left and closes the connection"""
+        with self.changed:
+            self.closed = True
+            self.changed.notify()
+        self.flusher.join()
+        with self.flush_lock:
+            self.connection.close()
+
+    def __run(self):
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: self.dirty_peers or self.dirty_tick or self.closed)
+                # Ticks alone wait out the interval, so a fast clock costs one commit per interval
+                if not self.dirty_peers:
+                    self.changed.wait_for(lambda: self.dirty_peers or self.closed, self.flush_interval)
+                closed = self.closed
+            self.flush()
+            if closed:
+                return
@@ -1,5 +1,6 @@
 import socket
 import json
+from messageFraming import recv_frame, send_frame
 
 SERVER_ADDRESS = 'localhost'
 SERVER_PORT_NUM = 12345
@@ -32,8 +33,8 @@ def test_register(server_address, server_port_num, group, name, port_num):
     # Creates a new socket sends the message
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.connect((server_address, server_port_num))
-    server_socket.send(msg_string.encode('ascii'))
-    received_message = server_socket.recv(1024).decode('ascii')
+    send_frame(server_socket, msg_string.encode('ascii'))
+    received_message = recv_frame(server_socket).decode('ascii')
 
     # Receives and interprets the message
     message_dict = json.loads(received_message)
@@ -75,7 +76,7 @@ def update_election(server_address, server_port_num, group, name, port_num, elec
     # Creates a new socket sends the message
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.connect((server_address, server_port_num))
-    server_socket.send(msg_string.encode('ascii'))
+    send_frame(server_socket, msg_string.encode('ascii'))
 
 
 #########################
@@ -100,8 +101,8 @@ def query_supers(server_address, server_port_num, group):
     # Creates a new socket sends the message
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.connect((server_address, server_port_num))
-    server_socket.send(msg_string.encode('ascii'))
-    received_message = server_socket.recv(1024).decode('ascii')
+    send_frame(server_socket, msg_string.encode('ascii'))
+    received_message = recv_frame(server_socket).decode('ascii')
 
     # Receives and interprets the message
     message_dict = json.loads(received_message)
@@ -139,9 +140,10 @@ def time_test(port_num):
         (client_socket, client_address) = server_socket.accept()
 
         # Receive message from client and load up the dict
-        received_message = client_socket.recv(1024).decode('ascii')
+        received_message = recv_frame(client_socket)
+        client_socket.close()
 
-        if len(received_message) > 0:
+        if received_message:
             # Receives and interprets the message
             message_dict = json.loads(received_message)
             action = message_dict['action']
@@ -0,0 +1,97 @@
+import heapq
+import itertools
+import time
+from threading import Condition, Thread
+
+
+class Scheduler():
+    """
+    Single-threaded timer heap shared by every timeout of a node.
+
+    One daemon thread sleeps until the earliest deadline instead of one
+    threading.Timer thread per timeout. A due timer is not run on that
+    thread: its id is handed to dispatch, which queues it for the thread that
+    processes messages, and that thread calls fire. Timer callbacks therefore
+    never race with message handlers, and a timer cancelled before fire runs
+    never runs, even if its deadline had already passed.
+
+    Cancelled timers are left in the heap and skipped when they come due. The
+    heap is rebuilt when cancelled entries outnumber live ones.
+
+    Attributes:
+        dispatch: Called with a timer id when that timer is due
+        timers: A dict, keyed by timer id, of (callback, args) tuples not yet run or cancelled
+        heap: A heap of (deadline, timer id) tuples
+    """
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+        self.timers = {}
+        self.heap = []
+        self.ids = itertools.count()
+        self.condition = Condition()
+
+        # Counters for debugging and benchmarks
+        self.fired = 0
+        self.cancelled = 0
+
+        Thread(target=self.__run, daemon=True).start()
+
+    def schedule(self, delay, callback, *args):
+        """
+        Run callback(*args) on the processing thread after delay seconds. Returns the timer id.
+        """
+        with self.condition:
+            timer_id = next(self.ids)
+            self.timers[timer_id] = (callback, args)
+            heapq.heappush(self.heap, (time.monotonic() + delay, timer_id))
+            # Only wake the timer thread if this is the new earliest deadline
+            if self.heap[0][1] == timer_id:
+                self.condition.notify()
+            return timer_id
+
+    def cancel(self, timer_id):
+        """
+        Cancel a timer. Returns False if it already ran or was cancelled.
+        """
+        with self.condition:
+            if self.timers.pop(timer_id, None) is None:
+                return False
+            self.cancelled += 1
+            if len(self.heap) > 2 * len(self.timers) + 64:
+                self.heap = [entry for entry in self.heap if entry[1] in self.timers]
+                heapq.heapify(self.heap)
+            return True
+
+    def fire(self, timer_id):
+        """
+        Run a dispatched timer unless it was cancelled in the meantime
+        """
+        with self.condition:
+            entry = self.timers.pop(timer_id, None)
+            if entry is None:
+                return False
+            self.fired += 1
+        callback, args = entry
+        callback(*args)
+        return True
+
+    def live(self):
+        """Returns the number of timers that have neither run nor been cancelled"""
+        with self.condition:
+            return len(self.timers)
+
+    def __run(self):
+        while True:
+            with self.condition:
+                due = []
+                while not due:
+                    now = time.monotonic()
+                    while self.heap and self.heap[0][0] <= now:
+                        deadline, timer_id = heapq.heappop(self.heap)
+                        if timer_id in self.timers:
+                            due.append(timer_id)
+                    if due:
+                        break
+                    self.condition.wait(self.heap[0][0] - now if self.heap else None)
+            for timer_id in due:
+                self.dispatch(timer_id)
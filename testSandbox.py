@@ -0,0 +1,139 @@
+import os
+import socketserver
+import sqlite3
+import tempfile
+import Exchange
+from Node import MessageHandler, Node
+from asyncRuntime import AsyncRuntime
+from connectionPool import ConnectionPool, FanOut
+from exchangeStorage import ExchangeStorage
+from failureDetector import FailureDetector
+from inventoryJournal import InventoryJournal
+from ipoSchedule import IpoSchedule
+from paxos import PaxosNode
+from queue import Queue
+from scheduler import Scheduler
+from threading import Thread
+
+
+def make_sandbox(name, stocks):
+    """Creates a temporary working directory with the databases an exchange expects"""
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, 'data'))
+
+    db_connection = sqlite3.connect(os.path.join(directory, 'data', name + '.db'))
+    db_connection.execute('''CREATE TABLE stock_price_table
+                          (stock_name TEXT, price REAL, price_date TEXT, price_time TEXT)''')
+    db_connection.execute('''CREATE TABLE stock_quantity_table
+                          (stock_name TEXT, quantity INTEGER, quantity_date TEXT, quantity_time TEXT)''')
+    db_connection.execute('''CREATE TABLE stock_current_quantity_table
+                          (stock_name TEXT PRIMARY KEY, current_quantity INTEGER)''')
+    db_connection.executemany('INSERT INTO stock_current_quantity_table VALUES (?, ?)', stocks.items())
+    db_connection.commit()
+    db_connection.close()
+
+    db_connection = sqlite3.connect(os.path.join(directory, 'data', 'exchange.db'))
+    db_connection.execute('''CREATE TABLE preCommit (reservation_number INTEGER, reservation TEXT)''')
+    db_connection.commit()
+    db_connection.close()
+    return directory
+
+
+def offline_exchange(name, stocks):
+    """Builds an Exchange with its trading state but without joining the network"""
+
+    exchange = Exchange.Exchange.__new__(Exchange.Exchange)
+    exchange.name = name
+    exchange.reservations = []
+    exchange.orders = []
+    exchange.precommit_acks = {}
+    exchange.clients = {}
+    exchange.mutual_funds = {}
+    exchange.stocks = dict(stocks)
+    exchange.reservation_timers = {}
+    exchange.order_timers = {}
+    # Due timers wait in request_queue until a test fires them
+    exchange.request_queue = Queue()
+    exchange.scheduler = Scheduler(exchange.dispatch_timer)
+    exchange.storage = ExchangeStorage(name)
+    exchange.inventory = InventoryJournal(exchange.storage)
+    exchange.ipo_schedule = IpoSchedule.from_rows(exchange.storage.load_quantity_schedule())
+    exchange.isSuper = False
+    exchange.tick_epoch = None
+    exchange.tick_seq = None
+    exchange.tick = None
+    exchange.missed_ticks = 0
+    exchange.registration_port = None
+    exchange.registration_ports = []
+    # Offline: outbound messages such as tick receipts go nowhere
+    exchange.send_to_port = lambda *args, **kwargs: None
+    return exchange
+
+
+class ReusableServer(socketserver.ThreadingTCPServer):
+    # Runs in quick succession must not wait for TIME_WAIT
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def network_peer(name, port, peer_num, registration_port, on_win, runtime=None):
+    """
+    Starts a Node of group 0 on a real socket, without storage or registering.
+    Its superpeer starts out as registration_port, and winning an election
+    calls on_win(name) instead of contacting the registration server.
+    With runtime "asyncio" it is served by an AsyncRuntime, to stop when done.
+    """
+    node = Node.__new__(Node)
+    PaxosNode.__init__(node)
+    node.group = 0
+    node.name = name
+    node.port = port
+    node.peer_num = peer_num
+    node.registration_port = registration_port
+    node.registration_ports = [registration_port]
+    node.ipo_schedule = IpoSchedule({})
+    node.isSuper = False
+    node.node_time = None
+    node.tick_epoch = None
+    node.tick_seq = None
+    node.tick = None
+    node.missed_ticks = 0
+    node.superpeer = registration_port
+    node.election = False
+    node.failover_time = None
+    node.peer_list = {}
+    node.superpeer_list = {}
+    node.superpeer_version = None
+    node.route_index = {}
+    node.msg_num = 0
+    node.incarnation = 0
+    node.msg_dict = {}
+    node.dedup_hits = 0
+    node.dedup_misses = 0
+    node.request_queue = Queue()
+    node.connection_pool = ConnectionPool()
+    node.fan_out = FanOut(node.connection_pool)
+    node.runtime = None
+    node.scheduler = Scheduler(node.dispatch_timer)
+    node.failure_detector = FailureDetector(node.heartbeat_interval)
+    node.set_superpeer = lambda: on_win(name)
+
+    if runtime == "asyncio":
+        node.runtime = AsyncRuntime(node)
+        node.request_queue = node.runtime.inbox
+        node.runtime.start()
+        return node
+
+    server = ReusableServer(("localhost", port), MessageHandler)
+    server.request_queue = node.request_queue
+    server.node = node
+    Thread(target=server.serve_forever, daemon=True).start()
+    Thread(target=serve_requests, args=(node,), daemon=True).start()
+    return node
+
+
+def serve_requests(node):
+    """Stands in for Node.process without registering again"""
+    while True:
+        node.process_request(node.request_queue.get())